@@ -0,0 +1,116 @@
+import io
+import json
+import os
+import random
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, Tag)
+from recipes.shopping_list import rebuild
+from rest_framework.authtoken.models import Token
+from users.models import Subscription
+
+User = get_user_model()
+
+INGREDIENTS_FILE = os.path.join(settings.BASE_DIR, 'ingredients.json')
+
+BATCH_SIZE = 400
+
+DEFAULT_SIZE = {
+    'users': 50,
+    'recipes': 300,
+    'ingredients': 500,
+    'ingredients_per_recipe': 10,
+    'favorites_per_user': 20,
+    'carts_per_user': 10,
+    'subscriptions_per_user': 10,
+}
+
+
+def load_ingredients(limit):
+    """
+    Первые limit ингредиентов из ingredients.json.
+    """
+    with open(INGREDIENTS_FILE, encoding='utf-8') as file:
+        rows = json.load(file)[:limit]
+    Ingredient.objects.bulk_create((
+        Ingredient(name=row['fields']['name'],
+                   measurement_unit=row['fields']['measurement_unit'])
+        for row in rows
+    ), batch_size=BATCH_SIZE)
+    return list(Ingredient.objects.values_list('id', flat=True))
+
+
+def seed(size=None, seed=0):
+    """
+    Заполнение базы синтетическими данными заданного размера. Возвращает
+    пользователя с токеном, от имени которого выполняются запросы.
+    """
+    size = {**DEFAULT_SIZE, **(size or {})}
+    generator = random.Random(seed)
+
+    User.objects.bulk_create(
+        (User(username=f'user{number}', email=f'user{number}@example.com',
+              first_name='Имя', last_name='Фамилия')
+         for number in range(size['users'])),
+        batch_size=BATCH_SIZE,
+    )
+    user_ids = list(User.objects.values_list('id', flat=True))
+    Tag.objects.bulk_create(
+        Tag(name=name, slug=slug, color=color)
+        for name, slug, color in (('Завтрак', 'breakfast', '#E26C2D'),
+                                  ('Обед', 'lunch', '#49B64E'),
+                                  ('Ужин', 'dinner', '#8775D2'))
+    )
+    tag_ids = list(Tag.objects.values_list('id', flat=True))
+    ingredient_ids = load_ingredients(size['ingredients'])
+
+    Recipe.objects.bulk_create(
+        (Recipe(author_id=generator.choice(user_ids),
+                name=f'Рецепт {number}',
+                text='Описание рецепта ' * 20,
+                cooking_time=generator.randint(5, 120))
+         for number in range(size['recipes'])),
+        batch_size=BATCH_SIZE,
+    )
+    recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+    Recipe.tags.through.objects.bulk_create(
+        (Recipe.tags.through(recipe_id=recipe_id,
+                             tag_id=generator.choice(tag_ids))
+         for recipe_id in recipe_ids),
+        batch_size=BATCH_SIZE,
+    )
+    per_recipe = min(size['ingredients_per_recipe'], len(ingredient_ids))
+    RecipeIngredient.objects.bulk_create(
+        (RecipeIngredient(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                          amount=generator.randint(1, 500))
+         for recipe_id in recipe_ids
+         for ingredient_id in generator.sample(ingredient_ids, per_recipe)),
+        batch_size=BATCH_SIZE,
+    )
+
+    for model, per_user in ((FavoriteRecipe, 'favorites_per_user'),
+                            (ShoppingCart, 'carts_per_user')):
+        count = min(size[per_user], len(recipe_ids))
+        model.objects.bulk_create(
+            (model(user_id=user_id, recipe_id=recipe_id)
+             for user_id in user_ids
+             for recipe_id in generator.sample(recipe_ids, count)),
+            batch_size=BATCH_SIZE,
+        )
+    count = min(size['subscriptions_per_user'], len(user_ids) - 1)
+    Subscription.objects.bulk_create(
+        (Subscription(follower_id=user_id, author_id=author_id)
+         for user_id in user_ids
+         for author_id in generator.sample(
+             [author for author in user_ids if author != user_id], count)),
+        batch_size=BATCH_SIZE,
+    )
+    call_command('rebuild_recipe_counters', stdout=io.StringIO())
+    rebuild(user_ids)
+
+    user = User.objects.get(id=user_ids[0])
+    Token.objects.get_or_create(user=user)
+    return user
@@ -0,0 +1,79 @@
+import json
+import os
+
+from benchmarks import dataset, runner
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+BASELINE_FILE = os.path.join(settings.BASE_DIR, 'benchmarks',
+                             'baseline.json')
+
+
+class Command(BaseCommand):
+    help = ('Заполняет временную базу синтетическими данными, измеряет '
+            'количество запросов, время и память ключевых эндпоинтов API '
+            'и сравнивает результат с базовым.')
+
+    def add_arguments(self, parser):
+        for name, default in dataset.DEFAULT_SIZE.items():
+            parser.add_argument(f'--{name.replace("_", "-")}', type=int,
+                                default=default, dest=name)
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Количество замеров времени.')
+        parser.add_argument('--output', help='Файл для результатов JSON.')
+        parser.add_argument('--baseline', default=BASELINE_FILE,
+                            help='Файл с базовыми результатами.')
+        parser.add_argument('--update-baseline', action='store_true',
+                            help='Записать результаты как базовые.')
+        parser.add_argument('--query-tolerance', type=int, default=0)
+        parser.add_argument('--time-tolerance', type=float, default=2.0)
+        parser.add_argument('--memory-tolerance', type=float, default=1.5)
+
+    def handle(self, *args, **options):
+        size = {name: options[name] for name in dataset.DEFAULT_SIZE}
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            user = dataset.seed(size)
+            results = runner.run(user, repeat=options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {'dataset': size, 'endpoints': results}
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:32} {result["status"]} {result["queries"]:>3} '
+                f'запросов {result["time_ms"]:>9} мс '
+                f'{result["peak_kb"]:>9} КБ')
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+
+        if options['update_baseline']:
+            with open(options['baseline'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Базовые результаты записаны в '
+                              f'{options["baseline"]}')
+            return
+        if not os.path.exists(options['baseline']):
+            return
+        with open(options['baseline'], encoding='utf-8') as file:
+            baseline = json.load(file)
+        if baseline['dataset'] != size:
+            self.stdout.write('Размер данных отличается от базового, '
+                              'сравнение пропущено.')
+            return
+        regressions = runner.compare(
+            results, baseline['endpoints'],
+            query_tolerance=options['query_tolerance'],
+            time_tolerance=options['time_tolerance'],
+            memory_tolerance=options['memory_tolerance'],
+        )
+        if regressions:
+            raise CommandError('Регрессии производительности:\n'
+                               + '\n'.join(regressions))
+        self.stdout.write('Регрессий не обнаружено.')
@@ -0,0 +1,134 @@
+import statistics
+import time
+import tracemalloc
+
+from django.db import connection
+from django.test import override_settings
+from recipes.models import Recipe
+from rest_framework.test import APIClient
+
+TIME_SLACK_MS = 10
+MEMORY_SLACK_KB = 64
+
+
+def endpoints(user):
+    """
+    Измеряемые эндпоинты: имя, клиент (анонимный или с токеном) и адрес.
+    """
+    recipe = Recipe.objects.order_by('id').first()
+    return [
+        ('recipes.list', False, '/api/recipes/?limit=6'),
+        ('recipes.list.auth', True, '/api/recipes/?limit=6'),
+        ('recipes.list.cursor', True,
+         '/api/recipes/?limit=6&pagination=cursor'),
+        ('recipes.list.filtered', True,
+         '/api/recipes/?limit=6&is_favorited=1&tags=breakfast&tags=lunch'),
+        ('recipes.list.popular', False,
+         '/api/recipes/?limit=6&ordering=popular'),
+        ('recipes.retrieve', True, f'/api/recipes/{recipe.id}/'),
+        ('recipes.download_shopping_cart', True,
+         '/api/recipes/download_shopping_cart/'),
+        ('tags.list', False, '/api/tags/'),
+        ('ingredients.list', False, '/api/ingredients/?name=са'),
+        ('ingredients.autocomplete', False,
+         '/api/ingredients/autocomplete/?name=са'),
+        ('users.list', True, '/api/users/?limit=6'),
+        ('users.subscriptions', True,
+         '/api/users/subscriptions/?limit=6&recipes_limit=3'),
+    ]
+
+
+class QueryCounter:
+    """
+    Счетчик запросов к базе для connection.execute_wrapper.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def request(client, url):
+    response = client.get(url)
+    if response.streaming:
+        b''.join(response.streaming_content)
+    else:
+        response.content
+    return response
+
+
+def measure(client, url, repeat):
+    """
+    Количество запросов к базе, медианное время и пиковая память одного
+    запроса к эндпоинту.
+    """
+    response = request(client, url)
+    queries = QueryCounter()
+    with connection.execute_wrapper(queries):
+        request(client, url)
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        request(client, url)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    try:
+        request(client, url)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'status': response.status_code,
+        'queries': queries.count,
+        'time_ms': round(statistics.median(timings), 2),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def run(user, repeat=20):
+    """
+    Измерение всех эндпоинтов от имени пользователя с токеном. Замеры
+    Server-Timing отключены, чтобы случайная выборка не влияла на время.
+    """
+    guest = APIClient()
+    authorized = APIClient()
+    authorized.credentials(HTTP_AUTHORIZATION=f'Token {user.auth_token.key}')
+    with override_settings(SERVER_TIMING_SAMPLE_RATE=0):
+        return {
+            name: measure(authorized if auth else guest, url, repeat)
+            for name, auth, url in endpoints(user)
+        }
+
+
+def compare(results, baseline, query_tolerance=0, time_tolerance=2.0,
+            memory_tolerance=1.5):
+    """
+    Сравнение результатов с базовыми, возвращает список регрессий.
+    """
+    regressions = []
+    for name, expected in baseline.items():
+        actual = results.get(name)
+        if actual is None:
+            regressions.append(f'{name}: эндпоинт не измерялся')
+            continue
+        if actual['status'] != expected['status']:
+            regressions.append(f'{name}: статус {actual["status"]}, '
+                               f'ожидался {expected["status"]}')
+        if actual['queries'] > expected['queries'] + query_tolerance:
+            regressions.append(f'{name}: {actual["queries"]} запросов, '
+                               f'было {expected["queries"]}')
+        if actual['time_ms'] > max(expected['time_ms'] * time_tolerance,
+                                   expected['time_ms'] + TIME_SLACK_MS):
+            regressions.append(f'{name}: {actual["time_ms"]} мс, '
+                               f'было {expected["time_ms"]}')
+        if actual['peak_kb'] > max(expected['peak_kb'] * memory_tolerance,
+                                   expected['peak_kb'] + MEMORY_SLACK_KB):
+            regressions.append(f'{name}: {actual["peak_kb"]} КБ, '
+                               f'было {expected["peak_kb"]}')
+    return regressions
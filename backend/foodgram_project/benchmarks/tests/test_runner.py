@@ -0,0 +1,86 @@
+from benchmarks import dataset, runner
+from django.test import TestCase
+from recipes.models import ShoppingListItem
+
+
+class BenchmarkRunnerTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.user = dataset.seed({
+            'users': 5,
+            'recipes': 12,
+            'ingredients': 30,
+            'ingredients_per_recipe': 4,
+            'favorites_per_user': 3,
+            'carts_per_user': 3,
+            'subscriptions_per_user': 2,
+        })
+
+    def test_run_all_endpoints(self):
+        """
+        Все эндпоинты отвечают успешно и измеряются, количество запросов
+        совпадает с базовыми результатами.
+        """
+        results = runner.run(self.user, repeat=1)
+        self.assertEqual(set(results),
+                         {name for name, _, _ in runner.endpoints(self.user)})
+        for name, result in results.items():
+            with self.subTest(name=name):
+                self.assertEqual(result['status'], 200)
+                self.assertGreater(result['peak_kb'], 0)
+        self.assertEqual(results['recipes.list']['queries'], 4)
+        self.assertEqual(
+            results['recipes.download_shopping_cart']['queries'], 1)
+        self.assertEqual(results['tags.list']['queries'], 0)
+
+    def test_seed_shopping_list(self):
+        """
+        Списки покупок заполняются по рецептам в корзине, выгрузка
+        измеряется на непустом списке.
+        """
+        self.assertTrue(
+            ShoppingListItem.objects.filter(user=self.user).exists())
+
+    def test_compare_detects_regressions(self):
+        """
+        Сравнение с базовыми результатами находит рост количества запросов,
+        времени ответа и памяти. Небольшие абсолютные изменения
+        быстрых эндпоинтов не считаются регрессией.
+        """
+        baseline = {'recipes.list': {'status': 200, 'queries': 4,
+                                     'time_ms': 10, 'peak_kb': 100},
+                    'tags.list': {'status': 200, 'queries': 0,
+                                  'time_ms': 0.5, 'peak_kb': 10}}
+        same = {'recipes.list': {'status': 200, 'queries': 4,
+                                 'time_ms': 12, 'peak_kb': 120},
+                'tags.list': {'status': 200, 'queries': 0,
+                              'time_ms': 2, 'peak_kb': 40}}
+        worse = {'recipes.list': {'status': 200, 'queries': 40,
+                                  'time_ms': 100, 'peak_kb': 400},
+                 'tags.list': {'status': 200, 'queries': 0,
+                               'time_ms': 0.5, 'peak_kb': 10}}
+        self.assertEqual(runner.compare(same, baseline), [])
+        self.assertEqual(len(runner.compare(worse, baseline)), 3)
+        self.assertEqual(len(runner.compare({}, baseline)), 2)
+
+    def test_compare_beyond_slack(self):
+        """
+        Рост времени и памяти быстрого эндпоинта больше абсолютного
+        запаса считается регрессией.
+        """
+        baseline = {'tags.list': {'status': 200, 'queries': 0,
+                                  'time_ms': 0.5, 'peak_kb': 10}}
+        within = {'tags.list': {
+            'status': 200, 'queries': 0,
+            'time_ms': 0.5 + runner.TIME_SLACK_MS,
+            'peak_kb': 10 + runner.MEMORY_SLACK_KB}}
+        beyond = {'tags.list': {
+            'status': 200, 'queries': 1,
+            'time_ms': 0.5 + runner.TIME_SLACK_MS + 0.1,
+            'peak_kb': 10 + runner.MEMORY_SLACK_KB + 0.1}}
+        self.assertEqual(runner.compare(within, baseline), [])
+        regressions = runner.compare(beyond, baseline)
+        self.assertEqual(len(regressions), 3)
+        self.assertIn('tags.list: 1 запросов, было 0', regressions)
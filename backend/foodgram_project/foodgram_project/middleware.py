@@ -0,0 +1,111 @@
+import logging
+import random
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger('foodgram.performance')
+
+
+class QueryStats:
+    """
+    Обертка connection.execute_wrapper: количество запросов, суммарное
+    время в базе и число повторов каждого шаблона SQL.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+
+    def duplicates(self, threshold):
+        return {sql: count for sql, count in self.statements.items()
+                if count >= threshold}
+
+
+class ServerTimingMiddleware:
+    """
+    Замер времени обработки запроса, времени и количества запросов к базе
+    и рендеринга ответа в JSON. Остальное время, включая сериализацию
+    объектов во вьюсете, отдается фазой app. Результат отдается в
+    заголовке Server-Timing и пишется в лог строкой с именем вьюсета и
+    действия. Замеряется доля запросов SERVER_TIMING_SAMPLE_RATE.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sample_rate = getattr(settings, 'SERVER_TIMING_SAMPLE_RATE', 1.0)
+        if sample_rate <= 0 or random.random() >= sample_rate:
+            return self.get_response(request)
+
+        request.timing_view = None
+        request.timing_render = 0.0
+        stats = QueryStats()
+        started = time.perf_counter()
+        with connection.execute_wrapper(stats):
+            response = self.get_response(request)
+        total = time.perf_counter() - started
+
+        threshold = getattr(settings, 'SERVER_TIMING_DUPLICATE_THRESHOLD', 3)
+        duplicates = stats.duplicates(threshold)
+        render = request.timing_render
+        app = max(total - stats.duration - render, 0)
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={stats.duration * 1000:.2f};'
+            f'desc="{stats.count} queries, {len(duplicates)} duplicated"',
+            f'render;dur={render * 1000:.2f}',
+            f'app;dur={app * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}',
+        ))
+
+        view = request.timing_view or request.path
+        logger.info(
+            'view=%s method=%s status=%s total_ms=%.2f db_ms=%.2f '
+            'queries=%d render_ms=%.2f duplicated=%d',
+            view, request.method, response.status_code, total * 1000,
+            stats.duration * 1000, stats.count, render * 1000,
+            len(duplicates),
+            extra={'view': view, 'queries': stats.count},
+        )
+        for sql, count in duplicates.items():
+            logger.warning('view=%s duplicated_query count=%d sql=%s',
+                           view, count, sql[:200],
+                           extra={'view': view, 'queries': count})
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not hasattr(request, 'timing_view'):
+            return
+        view_class = getattr(view_func, 'cls', None)
+        actions = getattr(view_func, 'actions', None) or {}
+        if view_class is None:
+            request.timing_view = view_func.__name__
+        elif request.method.lower() in actions:
+            request.timing_view = (
+                f'{view_class.__name__}.{actions[request.method.lower()]}')
+        else:
+            request.timing_view = view_class.__name__
+
+    def process_template_response(self, request, response):
+        if not hasattr(request, 'timing_view'):
+            return response
+        started = time.perf_counter()
+
+        def finish_render(response):
+            request.timing_render += time.perf_counter() - started
+
+        response.add_post_render_callback(finish_render)
+        return response
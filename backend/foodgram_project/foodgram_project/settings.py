@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -15,8 +16,10 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'users',
-    'recipes',
+    'users.apps.UsersConfig',
+    'recipes.apps.RecipesConfig',
+    'jobs',
+    'benchmarks',
     'colorfield',
     'rest_framework',
     'rest_framework.authtoken',
@@ -25,6 +28,7 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    'foodgram_project.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -34,6 +38,13 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+SERVER_TIMING_SAMPLE_RATE = float(
+    os.environ.get('SERVER_TIMING_SAMPLE_RATE', default=0.1))
+
+SERVER_TIMING_DUPLICATE_THRESHOLD = 3
+
+FEED_FANOUT_LIMIT = int(os.environ.get('FEED_FANOUT_LIMIT', default=5000))
+
 ROOT_URLCONF = 'foodgram_project.urls'
 
 TEMPLATES = [
@@ -65,6 +76,32 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'reference': {
+        'BACKEND': os.environ.get(
+            'REFERENCE_CACHE_BACKEND',
+            default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get(
+            'REFERENCE_CACHE_LOCATION',
+            default=os.path.join(tempfile.gettempdir(), 'foodgram_reference')),
+        'TIMEOUT': int(os.environ.get('REFERENCE_CACHE_TIMEOUT',
+                                      default=60 * 60 * 24)),
+    },
+}
+
+if os.environ.get('TOKEN_CACHE_BACKEND'):
+    CACHES['tokens'] = {
+        'BACKEND': os.environ.get('TOKEN_CACHE_BACKEND'),
+        'LOCATION': os.environ.get('TOKEN_CACHE_LOCATION', default='tokens'),
+    }
+
+TOKEN_CACHE_SIZE = 10000
+
+TOKEN_CACHE_TIMEOUT = int(os.environ.get('TOKEN_CACHE_TIMEOUT', default=60))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -92,7 +129,7 @@ USE_TZ = True
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
     ),
 }
 
@@ -110,8 +147,30 @@ DJOSER = {
     },
 }
 
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'foodgram': {
+            'handlers': ['console'],
+            'level': os.environ.get('FOODGRAM_LOG_LEVEL', default='INFO'),
+        },
+    },
+}
+
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, "static")
 
+RECIPE_IMAGE_PLACEHOLDER = STATIC_URL + 'recipes/placeholder.svg'
+
+SHOPPING_LIST_PDF_FONT = os.environ.get(
+    'SHOPPING_LIST_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
@@ -0,0 +1,20 @@
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+@contextmanager
+def on_commit_callbacks(using=DEFAULT_DB_ALIAS):
+    """
+    Выполнение функций transaction.on_commit, зарегистрированных внутри
+    блока. TestCase не фиксирует транзакцию, и без этого они
+    отбрасываются при откате.
+    """
+    connection = connections[using]
+    start = len(connection.run_on_commit)
+    try:
+        yield
+    finally:
+        while len(connection.run_on_commit) > start:
+            _, callback = connection.run_on_commit.pop(start)
+            callback()
@@ -0,0 +1,13 @@
+from django.contrib import admin
+
+from .models import Job
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'run_after',
+                    'started', 'finished')
+    list_filter = ('status', 'name')
+    empty_value_display = "-пусто-"
+
+
+admin.site.register(Job, JobAdmin)
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from jobs.queue import run_pending
+from jobs.tasks import schedule_jobs_pruning
+
+
+class Command(BaseCommand):
+    help = 'Воркер фоновых задач из таблицы Job.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Выполнить готовые задачи и завершиться.')
+        parser.add_argument('--sleep', type=float, default=1.0,
+                            help='Пауза между опросами пустой очереди, с.')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            processed = run_pending()
+            self.stdout.write(f'Выполнено задач: {processed}.')
+            return
+        schedule_jobs_pruning()
+        try:
+            while True:
+                if not run_pending(limit=100):
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            self.stdout.write('Воркер остановлен.')
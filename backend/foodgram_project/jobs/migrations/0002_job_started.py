@@ -0,0 +1,18 @@
+# Generated by Django 3.0.5 on 2026-10-18 19:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='started',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Запущена'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.0.5 on 2026-10-18 19:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0002_job_started'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='unique',
+            field=models.BooleanField(default=False, verbose_name='Без повторов в очереди'),
+        ),
+        migrations.AddConstraint(
+            model_name='job',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending'), ('unique', True)), fields=('name', 'payload'), name='unique_pending_job'),
+        ),
+    ]
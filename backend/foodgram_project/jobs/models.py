@@ -0,0 +1,43 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+    """
+    Фоновая задача в очереди на таблице базы данных.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    )
+
+    name = models.CharField('Задача', max_length=100)
+    payload = models.TextField('Параметры JSON', default='{}')
+    status = models.CharField('Статус', max_length=10, choices=STATUSES,
+                              default=PENDING)
+    attempts = models.PositiveSmallIntegerField('Попытки', default=0)
+    run_after = models.DateTimeField('Выполнить после', default=timezone.now)
+    created = models.DateTimeField('Создана', auto_now_add=True)
+    started = models.DateTimeField('Запущена', null=True, blank=True)
+    finished = models.DateTimeField('Завершена', null=True, blank=True)
+    error = models.TextField('Ошибка', blank=True)
+    unique = models.BooleanField('Без повторов в очереди', default=False)
+
+    class Meta:
+        ordering = ['run_after', 'id']
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        indexes = [models.Index(fields=['status', 'run_after'],
+                                name='job_status_run_after_idx')]
+        constraints = [models.UniqueConstraint(
+            fields=['name', 'payload'], name='unique_pending_job',
+            condition=models.Q(status='pending', unique=True))]
+
+    def __str__(self):
+        return f'{self.name} ({self.get_status_display()})'
@@ -0,0 +1,161 @@
+import json
+import logging
+import traceback
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger('foodgram.jobs')
+
+MAX_ATTEMPTS = 3
+RETRY_DELAY = timedelta(seconds=30)
+LEASE = timedelta(minutes=10)
+
+HANDLERS = {}
+FAILURE_HANDLERS = {}
+
+
+def task(name, on_failure=None):
+    """
+    Регистрация функции как обработчика задач с именем name. Функция
+    on_failure вызывается с параметрами задачи, когда все попытки
+    выполнения исчерпаны.
+    """
+    def register(handler):
+        HANDLERS[name] = handler
+        if on_failure is not None:
+            FAILURE_HANDLERS[name] = on_failure
+        return handler
+    return register
+
+
+def enqueue(name, run_after=None, **payload):
+    """
+    Постановка задачи в очередь. Внутри транзакции задача становится
+    видна воркеру только после ее фиксации.
+    """
+    if name not in HANDLERS:
+        raise ValueError(f'Неизвестная задача {name}')
+    return Job.objects.create(name=name, payload=json.dumps(payload),
+                              run_after=run_after or timezone.now())
+
+
+def enqueue_once(name, run_after=None, **payload):
+    """
+    Постановка задачи в очередь, если такая же задача еще не ожидает
+    выполнения: частые события объединяются в одну задачу.
+    """
+    enqueue_many_once(name, [payload], run_after)
+
+
+def enqueue_many_once(name, payloads, run_after=None):
+    """
+    Постановка задач name с параметрами payloads одним запросом.
+    Задачи, которые уже ожидают выполнения, пропускаются частичным
+    уникальным индексом без предварительной проверки.
+    """
+    if name not in HANDLERS:
+        raise ValueError(f'Неизвестная задача {name}')
+    run_after = run_after or timezone.now()
+    Job.objects.bulk_create([
+        Job(name=name, payload=json.dumps(payload), run_after=run_after,
+            unique=True)
+        for payload in payloads
+    ], ignore_conflicts=True)
+
+
+def claim():
+    """
+    Захват следующей готовой задачи. Строка блокируется с SKIP LOCKED,
+    поэтому несколько воркеров не берут одну задачу. Задача, которая
+    выполняется дольше LEASE, считается брошенной остановленным воркером
+    и захватывается заново как следующая попытка.
+    """
+    now = timezone.now()
+    ready = (Q(status=Job.PENDING, run_after__lte=now)
+             | Q(status=Job.RUNNING, started__lt=now - LEASE))
+    with transaction.atomic():
+        job = Job.objects.select_for_update(skip_locked=True).filter(
+            ready).first()
+        if job is None:
+            return None
+        job.status = Job.RUNNING
+        job.attempts += 1
+        job.started = now
+        job.save(update_fields=['status', 'attempts', 'started'])
+    return job
+
+
+def fail(job):
+    """
+    Пометка задачи как неуспешной и вызов обработчика окончательной
+    ошибки задачи.
+    """
+    job.status = Job.FAILED
+    job.finished = timezone.now()
+    on_failure = FAILURE_HANDLERS.get(job.name)
+    if on_failure is None:
+        return
+    try:
+        on_failure(**json.loads(job.payload))
+    except Exception:
+        logger.exception('job=%s id=%s failure handler failed',
+                         job.name, job.id)
+
+
+def run(job):
+    """
+    Выполнение задачи. При ошибке задача повторяется с задержкой, после
+    MAX_ATTEMPTS попыток помечается как неуспешная. Брошенная задача,
+    у которой попытки уже исчерпаны, не выполняется.
+    """
+    if job.attempts > MAX_ATTEMPTS:
+        job.error = f'Время выполнения {LEASE} истекло.'
+        fail(job)
+        logger.error('job=%s id=%s lease expired', job.name, job.id)
+        job.save(update_fields=['status', 'finished', 'error'])
+        return job
+    try:
+        HANDLERS[job.name](**json.loads(job.payload))
+    except Exception:
+        job.error = traceback.format_exc()
+        if job.attempts < MAX_ATTEMPTS:
+            job.status = Job.PENDING
+            job.run_after = timezone.now() + RETRY_DELAY * job.attempts
+        else:
+            fail(job)
+        logger.exception('job=%s id=%s attempt=%s failed',
+                         job.name, job.id, job.attempts)
+    else:
+        job.status = Job.DONE
+        job.finished = timezone.now()
+    try:
+        with transaction.atomic():
+            job.save(update_fields=['status', 'run_after', 'finished',
+                                    'error'])
+    except IntegrityError:
+        # Пока задача выполнялась, в очередь встала такая же задача без
+        # повторов, и повтор не нужен: она выполнит ту же работу.
+        job.status = Job.FAILED
+        job.finished = timezone.now()
+        job.save(update_fields=['status', 'finished', 'error'])
+    return job
+
+
+def run_pending(limit=None):
+    """
+    Выполнение готовых задач, пока очередь не опустеет или не будет
+    выполнено limit задач. Возвращает количество выполненных задач.
+    """
+    processed = 0
+    while limit is None or processed < limit:
+        job = claim()
+        if job is None:
+            break
+        run(job)
+        processed += 1
+    return processed
@@ -0,0 +1,34 @@
+import logging
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import Job
+from .queue import enqueue, task
+
+logger = logging.getLogger('foodgram.jobs')
+
+PRUNE_INTERVAL = timedelta(days=1)
+PRUNE_AGE = timedelta(days=7)
+
+
+def schedule_jobs_pruning(run_after=None):
+    """
+    Постановка удаления выполненных задач в очередь, если оно еще не
+    запланировано.
+    """
+    if Job.objects.filter(name='prune_jobs', status=Job.PENDING).exists():
+        return None
+    return enqueue('prune_jobs', run_after=run_after)
+
+
+@task('prune_jobs')
+def prune_jobs():
+    """
+    Удаление задач, выполненных раньше PRUNE_AGE, и планирование
+    следующего запуска. Неуспешные задачи остаются для разбора.
+    """
+    deleted, _ = Job.objects.filter(
+        status=Job.DONE, finished__lt=timezone.now() - PRUNE_AGE).delete()
+    logger.info('done jobs pruned: %s', deleted)
+    schedule_jobs_pruning(run_after=timezone.now() + PRUNE_INTERVAL)
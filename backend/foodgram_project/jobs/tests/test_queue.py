@@ -0,0 +1,118 @@
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+from jobs.models import Job
+from jobs.queue import (FAILURE_HANDLERS, HANDLERS, LEASE, MAX_ATTEMPTS, claim,
+                        enqueue, enqueue_many_once, enqueue_once, run,
+                        run_pending)
+from jobs.tasks import PRUNE_AGE, PRUNE_INTERVAL
+
+
+class QueueTests(TestCase):
+    def setUp(self):
+        self.handler = mock.Mock()
+        self.on_failure = mock.Mock()
+        patcher = mock.patch.dict(HANDLERS, {'test': self.handler})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.dict(FAILURE_HANDLERS,
+                                  {'test': self.on_failure})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_expired_lease_reclaimed(self):
+        """
+        Задача брошенного воркера захватывается заново после LEASE.
+        """
+        job = enqueue('test', value=1)
+        self.assertEqual(claim().id, job.id)
+        self.assertIsNone(claim())
+        Job.objects.filter(id=job.id).update(
+            started=timezone.now() - LEASE)
+        self.assertEqual(run_pending(), 1)
+        self.handler.assert_called_once_with(value=1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(job.attempts, 2)
+
+    def test_expired_lease_attempts_exhausted(self):
+        """
+        Брошенная задача с исчерпанными попытками не выполняется, а
+        помечается как неуспешная.
+        """
+        job = enqueue('test', value=1)
+        Job.objects.filter(id=job.id).update(
+            status=Job.RUNNING, attempts=MAX_ATTEMPTS,
+            started=timezone.now() - LEASE)
+        run_pending()
+        self.handler.assert_not_called()
+        self.on_failure.assert_called_once_with(value=1)
+        self.assertEqual(Job.objects.get(id=job.id).status, Job.FAILED)
+
+    def test_failure_handler(self):
+        """
+        Обработчик ошибки вызывается только после последней попытки.
+        """
+        self.handler.side_effect = ValueError
+        job = enqueue('test', value=1)
+        for attempt in range(MAX_ATTEMPTS):
+            self.on_failure.assert_not_called()
+            Job.objects.update(run_after=timezone.now())
+            run_pending()
+        self.on_failure.assert_called_once_with(value=1)
+        self.assertEqual(Job.objects.get(id=job.id).status, Job.FAILED)
+
+    def test_enqueue_once(self):
+        """
+        Ожидающая задача с теми же параметрами не дублируется, проверка
+        выполняется уникальным индексом в том же запросе.
+        """
+        enqueue_once('test', value=1)
+        with self.assertNumQueries(1):
+            enqueue_many_once('test', [{'value': 1}, {'value': 2}])
+        self.assertEqual(
+            sorted(Job.objects.values_list('payload', flat=True)),
+            ['{"value": 1}', '{"value": 2}'])
+        claim()
+        enqueue_once('test', value=1)
+        self.assertEqual(Job.objects.filter(payload='{"value": 1}').count(),
+                         2)
+
+    def test_retry_replaced_by_pending_job(self):
+        """
+        Повтор задачи без повторов не ставится, если такая же задача уже
+        ожидает выполнения.
+        """
+        self.handler.side_effect = ValueError
+        enqueue_once('test', value=1)
+        job = claim()
+        enqueue_once('test', value=1)
+        run(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.on_failure.assert_not_called()
+        self.assertEqual(Job.objects.filter(status=Job.PENDING).count(), 1)
+
+    def test_prune_jobs(self):
+        """
+        Старые выполненные задачи удаляются, неуспешные остаются, удаление
+        планируется заново.
+        """
+        old = timezone.now() - PRUNE_AGE
+        done = enqueue('test')
+        failed = enqueue('test')
+        recent = enqueue('test')
+        Job.objects.filter(id__in=[done.id, failed.id]).update(finished=old)
+        Job.objects.filter(id__in=[done.id, recent.id]).update(
+            status=Job.DONE)
+        Job.objects.filter(id=failed.id).update(status=Job.FAILED)
+        Job.objects.filter(id=recent.id).update(finished=timezone.now())
+        enqueue('prune_jobs')
+        run_pending()
+        self.assertFalse(Job.objects.filter(id=done.id).exists())
+        self.assertTrue(Job.objects.filter(id=failed.id).exists())
+        self.assertTrue(Job.objects.filter(id=recent.id).exists())
+        scheduled = Job.objects.get(name='prune_jobs', status=Job.PENDING)
+        self.assertGreater(scheduled.run_after,
+                           timezone.now() + PRUNE_INTERVAL / 2)
@@ -1,7 +1,8 @@
 from django.contrib import admin
 
 from .models import (FavoriteRecipe, Ingredient, Recipe, RecipeIngredient,
-                     ShoppingCart, Tag)
+                     ShoppingCart, ShoppingListItem, Tag)
+from .shopping_list import recipes_changes
 
 
 class TagAdmin(admin.ModelAdmin):
@@ -25,18 +26,37 @@ class RecipeIngredientInline(admin.TabularInline):
 
 class RecipeAdmin(admin.ModelAdmin):
     inlines = (RecipeIngredientInline,)
-    list_display = ('author', 'name', 'favorite_count')
+    list_display = ('author', 'name', 'favorites_count', 'in_carts_count')
     list_filter = ('author', 'name', 'tags')
+    list_select_related = ('author',)
+    readonly_fields = ('favorites_count', 'in_carts_count')
     empty_value_display = "-пусто-"
 
-    def favorite_count(self, obj):
-        return FavoriteRecipe.objects.filter(recipe=obj).count()
+    def save_related(self, request, form, formsets, change):
+        with recipes_changes([form.instance.pk]):
+            super().save_related(request, form, formsets, change)
 
 
 class RecipeIngredientAdmin(admin.ModelAdmin):
+    """
+    Изменения ингредиентов рецептов переносятся в списки покупок.
+    """
     list_display = ('id', 'recipe', 'ingredient', 'amount')
     empty_value_display = "-пусто-"
 
+    def save_model(self, request, obj, form, change):
+        recipe_ids = {obj.recipe_id, form.initial.get('recipe')} - {None}
+        with recipes_changes(recipe_ids):
+            super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        with recipes_changes([obj.recipe_id]):
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with recipes_changes(set(queryset.values_list('recipe', flat=True))):
+            super().delete_queryset(request, queryset)
+
 
 class FavoriteRecipeAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'recipe')
@@ -48,9 +68,16 @@ class ShoppingCartAdmin(admin.ModelAdmin):
     empty_value_display = "-пусто-"
 
 
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'ingredient', 'amount', 'checked')
+    list_select_related = ('user', 'ingredient')
+    empty_value_display = "-пусто-"
+
+
 admin.site.register(Tag, TagAdmin)
 admin.site.register(Ingredient, IngredientAdmin)
 admin.site.register(Recipe, RecipeAdmin)
 admin.site.register(RecipeIngredient, RecipeIngredientAdmin)
 admin.site.register(FavoriteRecipe, FavoriteRecipeAdmin)
 admin.site.register(ShoppingCart, ShoppingCartAdmin)
+admin.site.register(ShoppingListItem, ShoppingListItemAdmin)
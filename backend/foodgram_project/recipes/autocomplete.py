@@ -0,0 +1,75 @@
+from bisect import bisect_left
+from threading import Lock
+
+from .cache import get_version
+from .models import Ingredient
+
+AUTOCOMPLETE_LIMIT = 20
+
+
+class IngredientIndex:
+    """
+    Отсортированный по названию массив ингредиентов в памяти процесса.
+    Совпадения по началу названия ищутся бинарным поиском, совпадения по
+    вхождению - проходом по массиву. Загружается заново, когда меняется
+    версия справочника ингредиентов.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._version = None
+        self._keys = None
+        self._items = None
+
+    def invalidate(self):
+        with self._lock:
+            self._version = None
+            self._keys = None
+            self._items = None
+
+    def load(self):
+        version = get_version(Ingredient)
+        with self._lock:
+            if self._keys is None or self._version != version:
+                rows = sorted(
+                    (name.casefold(), pk, name, measurement_unit)
+                    for pk, name, measurement_unit
+                    in Ingredient.objects.values_list(
+                        'id', 'name', 'measurement_unit').iterator()
+                )
+                self._keys = [row[0] for row in rows]
+                self._items = [
+                    {'id': pk, 'name': name,
+                     'measurement_unit': measurement_unit}
+                    for _, pk, name, measurement_unit in rows
+                ]
+                self._version = version
+            return self._keys, self._items
+
+    def search(self, query, limit=AUTOCOMPLETE_LIMIT):
+        """
+        Поиск ингредиентов: сначала совпадения по началу названия, затем
+        по вхождению подстроки, не более limit результатов.
+        """
+        keys, items = self.load()
+        query = query.strip().casefold()
+        if not query:
+            return items[:limit]
+
+        start = end = bisect_left(keys, query)
+        while (end < len(keys) and end - start < limit
+               and keys[end].startswith(query)):
+            end += 1
+        result = items[start:end]
+
+        for position, key in enumerate(keys):
+            if len(result) >= limit:
+                break
+            if start <= position < end or key.startswith(query):
+                continue
+            if query in key:
+                result.append(items[position])
+        return result
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,102 @@
+import hashlib
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+REFERENCE_CACHE = 'reference'
+
+
+def version_key(model):
+    return f'{model._meta.label_lower}:version'
+
+
+def modified_key(model):
+    return f'{model._meta.label_lower}:modified'
+
+
+def get_version(model):
+    """
+    Текущая версия справочника: номер и время последнего изменения.
+    Счетчик версий начинается с текущего времени в миллисекундах, поэтому
+    после вытеснения счетчика из кэша номера не повторяются.
+    """
+    cache = caches[REFERENCE_CACHE]
+    number_key, modified = version_key(model), modified_key(model)
+    values = cache.get_many([number_key, modified])
+    if len(values) < 2:
+        now = time.time()
+        cache.add(number_key, int(now * 1000), timeout=None)
+        cache.add(modified, now, timeout=None)
+        values = {number_key: int(now * 1000), modified: now,
+                  **cache.get_many([number_key, modified])}
+    return values[number_key], values[modified]
+
+
+def increment_version(model):
+    cache = caches[REFERENCE_CACHE]
+    now = time.time()
+    cache.add(version_key(model), int(now * 1000), timeout=None)
+    try:
+        cache.incr(version_key(model))
+    except ValueError:
+        cache.add(version_key(model), int(now * 1000) + 1, timeout=None)
+    cache.set(modified_key(model), now, timeout=None)
+
+
+def bump_version(model):
+    """
+    Увеличение версии справочника после фиксации текущей транзакции, кэш
+    предыдущей версии перестает использоваться. До фиксации другие
+    запросы видят старые строки и старую версию. incr атомарен не во всех
+    бэкендах: в файловом кэше одновременные увеличения могут слиться в
+    одно, поэтому ключи кэша включают и время изменения, которое
+    записывается при каждом увеличении.
+    """
+    transaction.on_commit(lambda: increment_version(model))
+
+
+class VersionedCacheMixin:
+    """
+    Кэширование ответов list и retrieve справочных вьюсетов. Ключ кэша
+    включает версию модели, поэтому изменение записи делает устаревшими
+    все закэшированные ответы. Ответы содержат ETag и Last-Modified, на
+    повторный запрос с теми же значениями отдается 304.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request,
+                                    *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        model = self.get_queryset().model
+        number, modified = get_version(model)
+        path = request.get_full_path()
+        etag = quote_etag(hashlib.md5(
+            f'{number}:{modified}:{path}'.encode()).hexdigest())
+        last_modified = int(modified)
+
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        cache = caches[REFERENCE_CACHE]
+        key = f'{model._meta.label_lower}:{number}:{modified}:{path}'
+        data = cache.get(key)
+        if data is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            cache.set(key, response.data)
+        else:
+            response = Response(data)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
@@ -0,0 +1,135 @@
+import csv
+import hashlib
+import json
+import logging
+import os
+from io import BytesIO, StringIO
+
+from django.conf import settings
+from django.core.cache import cache
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.negotiation import DefaultContentNegotiation
+
+logger = logging.getLogger('foodgram')
+
+EXPORT_VERSION = 1
+EXPORT_CACHE_TIMEOUT = 60 * 60 * 24
+PDF_FONT = 'ShoppingList'
+PDF_MARGIN = 50
+PDF_TITLE_SIZE = 18
+PDF_FONT_SIZE = 12
+PDF_LINE_HEIGHT = 20
+TITLE = 'Список покупок'
+
+
+def register_pdf_font():
+    """
+    Регистрация шрифта с кириллицей один раз при запуске процесса. Без
+    файла шрифта используется Helvetica, в которой нет кириллицы.
+    """
+    path = settings.SHOPPING_LIST_PDF_FONT
+    if path and os.path.exists(path):
+        pdfmetrics.registerFont(TTFont(PDF_FONT, path))
+        return PDF_FONT
+    logger.warning('shopping list pdf font not found: %s', path)
+    return 'Helvetica'
+
+
+pdf_font = register_pdf_font()
+
+
+def render_txt(rows):
+    for name, amount, unit in rows:
+        yield f'{name} - {amount} {unit}\n'.encode()
+
+
+def render_csv(rows):
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(('Ингредиент', 'Количество', 'Единица измерения'))
+    writer.writerows(rows)
+    yield buffer.getvalue().encode('utf-8-sig')
+
+
+def render_json(rows):
+    yield json.dumps([
+        {'name': name, 'amount': amount, 'measurement_unit': unit}
+        for name, amount, unit in rows
+    ], ensure_ascii=False).encode()
+
+
+def render_pdf(rows):
+    """
+    Список покупок на страницах A4 с квадратом для отметки у каждого
+    ингредиента. Документ не содержит даты создания, поэтому одинаковые
+    списки дают одинаковые файлы.
+    """
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4, invariant=True)
+    pdf.setTitle(TITLE)
+    width, height = A4
+    pdf.setFont(pdf_font, PDF_TITLE_SIZE)
+    pdf.drawString(PDF_MARGIN, height - PDF_MARGIN, TITLE)
+    top = height - PDF_MARGIN - PDF_TITLE_SIZE * 2
+    y = top
+    pdf.setFont(pdf_font, PDF_FONT_SIZE)
+    for name, amount, unit in rows:
+        if y < PDF_MARGIN:
+            pdf.showPage()
+            pdf.setFont(pdf_font, PDF_FONT_SIZE)
+            y = height - PDF_MARGIN
+        pdf.rect(PDF_MARGIN, y, PDF_FONT_SIZE * 0.8, PDF_FONT_SIZE * 0.8)
+        pdf.drawString(PDF_MARGIN + PDF_FONT_SIZE * 1.5, y,
+                       f'{name} - {amount} {unit}')
+        y -= PDF_LINE_HEIGHT
+    if y == top:
+        pdf.drawString(PDF_MARGIN, y, 'Список пуст.')
+    pdf.save()
+    yield buffer.getvalue()
+
+
+EXPORT_FORMATS = {
+    'txt': ('text/plain; charset=utf-8', render_txt),
+    'csv': ('text/csv; charset=utf-8', render_csv),
+    'json': ('application/json', render_json),
+    'pdf': ('application/pdf', render_pdf),
+}
+
+
+def cache_key(export_format, rows):
+    digest = hashlib.sha256(
+        json.dumps(rows, ensure_ascii=False).encode()).hexdigest()
+    return f'shopping_list:{export_format}:{EXPORT_VERSION}:{digest}'
+
+
+def export(queryset, export_format):
+    """
+    Файл списка покупок по частям. Строки (название, количество, единица)
+    читаются при первой итерации, готовый файл кэшируется по хэшу строк,
+    поэтому повторное скачивание неизменного списка не рендерится заново.
+    """
+    rows = [list(row) for row in queryset]
+    key = cache_key(export_format, rows)
+    content = cache.get(key)
+    if content is not None:
+        yield content
+        return
+    _, renderer = EXPORT_FORMATS[export_format]
+    chunks = []
+    for chunk in renderer(rows):
+        chunks.append(chunk)
+        yield chunk
+    cache.set(key, b''.join(chunks), EXPORT_CACHE_TIMEOUT)
+
+
+class DownloadNegotiation(DefaultContentNegotiation):
+    """
+    Параметр 'format' выбирает формат файла, а не рендерер DRF: ответы с
+    ошибками отдаются первым рендерером.
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
@@ -0,0 +1,92 @@
+import base64
+import binascii
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from rest_framework import serializers
+
+from .images import VARIANTS
+
+IMAGE_TYPES = ('jpeg', 'jpg', 'png', 'gif', 'webp')
+MAX_IMAGE_SIZE = 10 * 1024 * 1024
+
+
+class Base64UploadField(serializers.FileField):
+    """
+    Изображение в формате data:image/...;base64. Проверяются только тип и
+    размер, файл сохраняется как есть под именем из хэша содержимого:
+    декодирование и проверка изображения выполняются в фоновой задаче.
+    """
+    default_error_messages = {
+        'invalid': 'Изображение должно быть передано в base64.',
+        'type': 'Недопустимый тип изображения.',
+        'size': 'Размер изображения не должен превышать '
+                f'{MAX_IMAGE_SIZE // 1024 // 1024} МБ.',
+    }
+
+    def to_internal_value(self, data):
+        if not isinstance(data, str) or ';base64,' not in data:
+            self.fail('invalid')
+        header, content = data.split(';base64,', 1)
+        extension = header.rpartition('/')[2].lower()
+        if not header.startswith('data:image/') or (
+                extension not in IMAGE_TYPES):
+            self.fail('type')
+        if len(content) * 3 // 4 > MAX_IMAGE_SIZE:
+            self.fail('size')
+        try:
+            decoded = base64.b64decode(content, validate=True)
+        except (binascii.Error, ValueError):
+            self.fail('invalid')
+        return ContentFile(decoded, name=f'image.{extension}')
+
+
+class RecipeImageField(serializers.Field):
+    """
+    Адрес варианта изображения рецепта ('small', 'medium'), а при его
+    отсутствии - оригинала. Пока изображение обрабатывается, отдается
+    заглушка.
+    """
+
+    def __init__(self, variant=None, **kwargs):
+        self.variant = variant
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        if recipe.image_status != recipe.IMAGE_READY:
+            return self.build_url(settings.RECIPE_IMAGE_PLACEHOLDER)
+        image = None
+        if self.variant is not None:
+            image = getattr(recipe, f'image_{self.variant}')
+        if not image:
+            image = recipe.image
+        if not image:
+            return None
+        return self.build_url(image.url)
+
+    def build_url(self, url):
+        request = self.context.get('request')
+        if request is None:
+            return url
+        return request.build_absolute_uri(url)
+
+
+class RecipeImageInfoField(RecipeImageField):
+    """
+    Размеры и основной цвет варианта изображения рецепта, чтобы разметка
+    строилась до загрузки изображения. Пока изображение обрабатывается -
+    null.
+    """
+
+    def to_representation(self, recipe):
+        if recipe.image_status != recipe.IMAGE_READY or not (
+                recipe.image_width):
+            return None
+        if self.variant is not None and getattr(
+                recipe, f'image_{self.variant}'):
+            width, height = VARIANTS[self.variant]
+        else:
+            width, height = recipe.image_width, recipe.image_height
+        return {'width': width, 'height': height,
+                'color': recipe.image_color}
@@ -1,6 +1,10 @@
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework as filters
 
-from .models import Ingredient, Recipe, Tag
+from .models import FavoriteRecipe, Ingredient, Recipe, ShoppingCart, Tag
+from .search import search_recipes
+
+POPULAR_ORDERING = ('-favorites_count', '-pub_date', '-id')
 
 
 class RecipeFilter(filters.FilterSet):
@@ -11,7 +15,8 @@ class RecipeFilter(filters.FilterSet):
     tags = filters.ModelMultipleChoiceFilter(
         field_name='tags__slug',
         to_field_name='slug',
-        queryset=Tag.objects.all()
+        queryset=Tag.objects.all(),
+        method='get_tags',
     )
     is_favorited = filters.BooleanFilter(
         method='get_favorite',
@@ -19,22 +24,57 @@ class RecipeFilter(filters.FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_cart',
     )
+    search = filters.CharFilter(
+        method='get_search',
+    )
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'По популярности'),),
+        method='get_ordering',
+    )
 
     class Meta:
         model = Recipe
-        fields = ('is_favorited', 'author', 'tags', 'is_in_shopping_cart')
+        fields = ('is_favorited', 'author', 'tags', 'is_in_shopping_cart',
+                  'search', 'ordering')
+
+    def get_tags(self, queryset, name, value):
+        """
+        Рецепты хотя бы с одним из тэгов, без дублей из-за соединения.
+        """
+        if not value:
+            return queryset
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'), tag__in=value)))
+
+    def get_user_related(self, queryset, value, model):
+        """
+        Рецепты, для которых у текущего пользователя есть запись модели.
+        """
+        if not value:
+            return queryset
+        if self.request.user.is_anonymous:
+            return queryset.none()
+        return queryset.filter(Exists(model.objects.filter(
+            user=self.request.user, recipe=OuterRef('pk'))))
 
     def get_favorite(self, queryset, name, value):
-        if value:
-            return Recipe.objects.filter(
-                favorite_recipe__user=self.request.user)
-        return Recipe.objects.all()
+        return self.get_user_related(queryset, value, FavoriteRecipe)
 
     def get_cart(self, queryset, name, value):
-        if value:
-            return Recipe.objects.filter(
-                shop_cart__user=self.request.user)
-        return Recipe.objects.all()
+        return self.get_user_related(queryset, value, ShoppingCart)
+
+    def get_search(self, queryset, name, value):
+        """
+        Полнотекстовый поиск по названию и описанию, по убыванию
+        релевантности.
+        """
+        return search_recipes(queryset, value)
+
+    def get_ordering(self, queryset, name, value):
+        """
+        Сортировка по количеству добавлений в избранное.
+        """
+        return queryset.order_by(*POPULAR_ORDERING)
 
 
 class IngredientFilter(filters.FilterSet):
@@ -0,0 +1,267 @@
+import hashlib
+import os
+import shutil
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from PIL import Image, ImageOps
+
+from .models import Recipe, StoredImage
+
+IMAGES_DIR = 'recipes/images'
+VARIANTS_DIR = 'recipes/variants'
+MAX_SIZE = (1920, 1920)
+MAX_PIXELS = 40 * 1000 * 1000
+VARIANTS = {
+    'small': (240, 240),
+    'medium': (640, 480),
+}
+QUALITY = 85
+PALETTE_SIZE = 8
+ORPHAN_MIN_AGE = 60 * 60
+
+
+def normalize(image):
+    """
+    Поворот по EXIF, приведение цветового режима и ограничение размеров.
+    Метаданные (EXIF, ICC, текстовые блоки PNG) при сохранении не
+    переносятся.
+    """
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ('RGBA', 'LA') or (
+        image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+    image.thumbnail(MAX_SIZE, Image.LANCZOS)
+    return image
+
+
+def dominant_color(image):
+    """
+    Самый частый цвет уменьшенной копии изображения в палитре из
+    PALETTE_SIZE цветов.
+    """
+    sample = image.convert('RGB')
+    sample.thumbnail((64, 64))
+    sample = sample.quantize(colors=PALETTE_SIZE)
+    count, index = max(sample.getcolors())
+    red, green, blue = sample.getpalette()[index * 3:index * 3 + 3]
+    return f'#{red:02x}{green:02x}{blue:02x}'
+
+
+def encode(image, image_format):
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, quality=QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def store(name, content):
+    """
+    Сохранение файла под именем из хэша содержимого. Файл с таким именем
+    уже содержит те же данные, поэтому повторно не записывается.
+    """
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(content))
+    return name
+
+
+def acquire(name):
+    """
+    Новая ссылка на файл изображения. Вызывается в транзакции до записи
+    файла: блокировка строки не дает одновременно удалить файл в release.
+    """
+    stored, created = StoredImage.objects.select_for_update().get_or_create(
+        name=name)
+    StoredImage.objects.filter(pk=stored.pk).update(refs=F('refs') + 1)
+
+
+@transaction.atomic
+def release(name):
+    """
+    Удаление ссылки на файл изображения. Файл и его варианты удаляются
+    после фиксации транзакции, когда ссылок не остается, и если за это
+    время на файл не появилась новая ссылка. Возвращает True, если
+    последняя ссылка удалена.
+    """
+    stored = StoredImage.objects.select_for_update().filter(
+        name=name).first()
+    if stored is None:
+        return False
+    if stored.refs > 1:
+        StoredImage.objects.filter(pk=stored.pk).update(refs=F('refs') - 1)
+        return False
+    stored.delete()
+    transaction.on_commit(lambda: delete_unreferenced_files(name))
+    return True
+
+
+@transaction.atomic
+def save_upload(file):
+    """
+    Сохранение загруженного файла под именем из SHA-256 его содержимого.
+    Повторная загрузка того же файла не записывается, а добавляет ссылку
+    на уже сохраненный.
+    """
+    content = file.read()
+    extension = os.path.splitext(file.name)[1]
+    digest = hashlib.sha256(content).hexdigest()
+    name = f'{IMAGES_DIR}/{digest}{extension}'
+    acquire(name)
+    return store(name, content)
+
+
+def variant_name(digest, variant):
+    return f'{VARIANTS_DIR}/{digest}-{variant}.webp'
+
+
+def build_variants(file):
+    """
+    Нормализованный оригинал и уменьшенные WebP варианты изображения без
+    обращения к базе. Возвращает поля рецепта с именами файлов и
+    параметрами изображения и содержимое новых файлов по именам.
+    Изображения больше MAX_PIXELS не обрабатываются, поэтому время
+    обработки ограничено и заметно меньше аренды задачи в очереди.
+    """
+    with Image.open(file) as source:
+        if source.width * source.height > MAX_PIXELS:
+            raise Image.DecompressionBombError(
+                f'Изображение больше {MAX_PIXELS} пикселей.')
+        image = normalize(source)
+    if image.mode == 'RGBA':
+        extension, image_format = 'png', 'PNG'
+    else:
+        extension, image_format = 'jpg', 'JPEG'
+    content = encode(image, image_format)
+    digest = hashlib.sha256(content).hexdigest()
+    name = f'{IMAGES_DIR}/{digest}.{extension}'
+
+    names = {'image': name}
+    files = {name: content}
+    for variant, size in VARIANTS.items():
+        name = variant_name(digest, variant)
+        if not default_storage.exists(name):
+            resized = ImageOps.fit(image, size, Image.LANCZOS)
+            files[name] = encode(resized, 'WEBP')
+        names[f'image_{variant}'] = name
+    names.update(image_width=image.width, image_height=image.height,
+                 image_color=dominant_color(image))
+    return names, files
+
+
+def process_recipe_image(recipe):
+    """
+    Замена загруженного изображения рецепта нормализованным и сохранение
+    вариантов для списков и миниатюр. Изображение обрабатывается и файлы
+    записываются вне транзакции, блокировки берутся только для записи
+    результата. Ссылка на загруженный файл переходит к нормализованному,
+    повторная обработка уже замененного изображения ничего не меняет.
+    """
+    uploaded = recipe.image.name
+    with recipe.image.open('rb') as file:
+        names, files = build_variants(file)
+    for name, content in files.items():
+        store(name, content)
+
+    with transaction.atomic():
+        acquire(names['image'])
+        # Файл мог быть удален release до появления ссылки.
+        for name, content in files.items():
+            store(name, content)
+        updated = Recipe.objects.filter(pk=recipe.pk, image=uploaded).update(
+            image_status=Recipe.IMAGE_READY, **names)
+        if not updated:
+            release(names['image'])
+            return recipe
+        release(uploaded)
+    for field, value in names.items():
+        setattr(recipe, field, value)
+    recipe.image_status = Recipe.IMAGE_READY
+    return recipe
+
+
+def delete_image_files(name):
+    """
+    Удаление изображения и его вариантов.
+    """
+    digest = os.path.splitext(os.path.basename(name))[0]
+    for variant in VARIANTS:
+        default_storage.delete(variant_name(digest, variant))
+    default_storage.delete(name)
+
+
+def delete_unreferenced_files(name):
+    if not StoredImage.objects.filter(name=name).exists():
+        delete_image_files(name)
+
+
+def referenced_files():
+    """
+    Имена всех файлов, на которые ссылаются рецепты, одним запросом.
+    """
+    referenced = set()
+    for names in Recipe.objects.values_list(
+            'image', 'image_small', 'image_medium').iterator():
+        referenced.update(name for name in names if name)
+    return referenced
+
+
+def scan(path):
+    """
+    Рекурсивный обход каталога без построения полного списка файлов.
+    """
+    try:
+        entries = os.scandir(path)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from scan(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+
+
+def find_orphans(min_age=ORPHAN_MIN_AGE):
+    """
+    Файлы в каталогах изображений рецептов, на которые не ссылается ни
+    один рецепт. Файлы моложе min_age секунд пропускаются: загрузка могла
+    быть сохранена до фиксации транзакции рецепта.
+    Возвращает пары (имя относительно MEDIA_ROOT, размер).
+    """
+    referenced = referenced_files()
+    deadline = time.time() - min_age
+    for directory in (IMAGES_DIR, VARIANTS_DIR):
+        for entry in scan(os.path.join(settings.MEDIA_ROOT, directory)):
+            name = os.path.relpath(entry.path, settings.MEDIA_ROOT).replace(
+                os.sep, '/')
+            if name in referenced:
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime > deadline:
+                continue
+            yield name, stat.st_size
+
+
+def collect_orphans(min_age=ORPHAN_MIN_AGE, quarantine=None, dry_run=False):
+    """
+    Удаление файлов без ссылок или перенос их в каталог quarantine с
+    сохранением относительного пути. Возвращает список пар (имя, размер).
+    """
+    collected = []
+    for name, size in find_orphans(min_age):
+        collected.append((name, size))
+        if dry_run:
+            continue
+        StoredImage.objects.filter(name=name).delete()
+        path = os.path.join(settings.MEDIA_ROOT, name)
+        if quarantine is None:
+            os.remove(path)
+            continue
+        target = os.path.join(quarantine, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(path, target)
+    return collected
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import ORPHAN_MIN_AGE, collect_orphans
+from recipes.tasks import schedule_orphans_collection
+
+
+class Command(BaseCommand):
+    help = ('Удаляет или переносит в карантин файлы изображений рецептов, '
+            'на которые не ссылается ни один рецепт.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только вывести список файлов без ссылок.')
+        parser.add_argument(
+            '--quarantine', metavar='DIR',
+            help='Переносить файлы в каталог вместо удаления.')
+        parser.add_argument(
+            '--min-age', type=int, default=ORPHAN_MIN_AGE,
+            help='Пропускать файлы моложе указанного числа секунд.')
+        parser.add_argument(
+            '--schedule', action='store_true',
+            help='Запланировать регулярную сборку в очереди задач.')
+
+    def handle(self, *args, **options):
+        if options['schedule']:
+            job = schedule_orphans_collection()
+            if job is None:
+                self.stdout.write('Сборка уже запланирована.')
+            else:
+                self.stdout.write(f'Сборка запланирована, задача {job.id}.')
+            return
+        collected = collect_orphans(
+            min_age=options['min_age'], quarantine=options['quarantine'],
+            dry_run=options['dry_run'])
+        for name, size in collected:
+            self.stdout.write(f'{name} {size}')
+        total = sum(size for name, size in collected)
+        if options['dry_run']:
+            action = 'Найдено'
+        elif options['quarantine']:
+            action = 'Перенесено'
+        else:
+            action = 'Удалено'
+        self.stdout.write(
+            f'{action} файлов: {len(collected)}, {total} байт.')
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from recipes.similarity import TOP_K, rebuild, update
+
+
+class Command(BaseCommand):
+    help = ('Рассчитывает похожие рецепты по совместным добавлениям в '
+            'избранное и списки покупок и общим ингредиентам.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top-k', type=int, default=TOP_K,
+            help='Количество похожих рецептов для каждого рецепта.')
+        parser.add_argument(
+            '--recipe', type=int, action='append', dest='recipes',
+            help='Пересчитать только указанные рецепты.')
+
+    def handle(self, *args, **options):
+        if options['recipes']:
+            for recipe_id in options['recipes']:
+                update(recipe_id, options['top_k'])
+            self.stdout.write(
+                f'Пересчитано рецептов: {len(options["recipes"])}.')
+            return
+        stored = rebuild(options['top_k'])
+        self.stdout.write(f'Сохранено пар похожих рецептов: {stored}.')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import process_recipe_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Нормализует изображения рецептов без вариантов или без '
+            'размеров и основного цвета, создает миниатюры.')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='').filter(
+            image_width__isnull=True, image_status=Recipe.IMAGE_READY)
+        processed = 0
+        for recipe in recipes.only('id', 'image').iterator():
+            try:
+                process_recipe_image(recipe)
+            except (OSError, ValueError) as error:
+                self.stderr.write(f'Рецепт {recipe.id}: {error}')
+                continue
+            processed += 1
+        self.stdout.write(f'Обработано изображений: {processed}.')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import FavoriteRecipe, Recipe, ShoppingCart
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счетчики избранного и списков покупок рецептов '
+            'с нуля.')
+
+    def handle(self, *args, **options):
+        counters = {
+            model.counter_field: Coalesce(Subquery(
+                model.objects.filter(recipe=OuterRef('pk')).order_by(
+                ).values('recipe').annotate(total=Count('id')).values(
+                    'total'),
+                output_field=IntegerField()), 0)
+            for model in (FavoriteRecipe, ShoppingCart)
+        }
+        updated = Recipe.objects.update(**counters)
+        self.stdout.write(f'Пересчитаны счетчики {updated} рецептов.')
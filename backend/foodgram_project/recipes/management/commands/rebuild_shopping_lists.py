@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from recipes.shopping_list import rebuild
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает списки покупок пользователей по рецептам в них '
+            'и исправляет расхождения.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int, action='append', dest='users',
+            help='Пересчитать только списки указанных пользователей.')
+
+    def handle(self, *args, **options):
+        fixed = rebuild(options['users'])
+        self.stdout.write(f'Исправлено строк списков покупок: {fixed}.')
@@ -0,0 +1,23 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_medium',
+            field=models.ImageField(blank=True, editable=False, upload_to='recipes/variants', verbose_name='Изображение для списков'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_small',
+            field=models.ImageField(blank=True, editable=False, upload_to='recipes/variants', verbose_name='Миниатюра'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:38
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_references(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    StoredImage = apps.get_model('recipes', 'StoredImage')
+    references = Recipe.objects.exclude(image='').order_by().values(
+        'image').annotate(refs=Count('id'))
+    StoredImage.objects.bulk_create(
+        StoredImage(name=reference['image'], refs=reference['refs'])
+        for reference in references.iterator())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_image_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredImage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Файл')),
+                ('refs', models.PositiveIntegerField(default=0, verbose_name='Ссылок')),
+            ],
+            options={
+                'verbose_name': 'Файл изображения',
+                'verbose_name_plural': 'Файлы изображений',
+            },
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
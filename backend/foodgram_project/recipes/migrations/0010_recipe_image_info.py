@@ -0,0 +1,28 @@
+# Generated by Django 3.0.5 on 2026-10-18 18:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_storedimage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_color',
+            field=models.CharField(blank=True, editable=False, max_length=7, verbose_name='Основной цвет изображения'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_height',
+            field=models.PositiveSmallIntegerField(editable=False, null=True, verbose_name='Высота изображения'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_width',
+            field=models.PositiveSmallIntegerField(editable=False, null=True, verbose_name='Ширина изображения'),
+        ),
+    ]
@@ -1,7 +1,10 @@
 from colorfield.fields import ColorField
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 
+from users.models import RelationQuerySet, Subscription
+
 User = get_user_model()
 
 
@@ -25,12 +28,70 @@ class Ingredient(models.Model):
     class Meta:
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        indexes = [models.Index(fields=['name'],
+                                name='ingredient_name_prefix_idx',
+                                opclasses=['varchar_pattern_ops'])]
 
     def __str__(self):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    """
+    Кверисет рецептов с подготовленными связями для сериализации списков.
+    """
+
+    def for_user(self, user):
+        """
+        Подгружает связанные объекты одним запросом на каждую связь и
+        аннотирует флаги избранного и списка покупок для пользователя.
+        """
+        queryset = self.defer('search_vector').prefetch_related(
+            'tags',
+            models.Prefetch(
+                'recipe_ingredient',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            ),
+        )
+        if user.is_anonymous:
+            return queryset.select_related('author').annotate(
+                is_favorited=models.Value(
+                    False, output_field=models.BooleanField()),
+                is_in_shopping_cart=models.Value(
+                    False, output_field=models.BooleanField()),
+            )
+        authors = User.objects.annotate(is_subscribed=models.Exists(
+            Subscription.objects.filter(author=models.OuterRef('pk'),
+                                        follower=user)))
+        return queryset.prefetch_related(
+            models.Prefetch('author', queryset=authors)
+        ).annotate(
+            is_favorited=models.Exists(FavoriteRecipe.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+            is_in_shopping_cart=models.Exists(ShoppingCart.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+        )
+
+    def change_counter(self, field, delta):
+        """
+        Атомарное изменение счетчика рецептов выражением F().
+        """
+        if delta < 0:
+            return self.filter(**{f'{field}__gte': -delta}).update(
+                **{field: models.F(field) + delta})
+        return self.update(**{field: models.F(field) + delta})
+
+
 class Recipe(models.Model):
+    IMAGE_PENDING = 'pending'
+    IMAGE_READY = 'ready'
+    IMAGE_FAILED = 'failed'
+    IMAGE_STATUSES = (
+        (IMAGE_PENDING, 'Обрабатывается'),
+        (IMAGE_READY, 'Готово'),
+        (IMAGE_FAILED, 'Ошибка обработки'),
+    )
+
     tags = models.ManyToManyField(Tag, verbose_name='Тэг')
     author = models.ForeignKey(User, on_delete=models.CASCADE,
                                verbose_name='Автор')
@@ -39,20 +100,71 @@ class Recipe(models.Model):
                                          verbose_name='Ингредиенты')
     name = models.CharField('Название', max_length=200)
     image = models.ImageField('Изображение', upload_to='recipes/images')
+    image_small = models.ImageField('Миниатюра', upload_to='recipes/variants',
+                                    blank=True, editable=False)
+    image_medium = models.ImageField('Изображение для списков',
+                                     upload_to='recipes/variants',
+                                     blank=True, editable=False)
+    image_status = models.CharField('Обработка изображения', max_length=10,
+                                    choices=IMAGE_STATUSES,
+                                    default=IMAGE_READY, editable=False)
+    image_width = models.PositiveSmallIntegerField('Ширина изображения',
+                                                   null=True, editable=False)
+    image_height = models.PositiveSmallIntegerField('Высота изображения',
+                                                    null=True, editable=False)
+    image_color = models.CharField('Основной цвет изображения', max_length=7,
+                                   blank=True, editable=False)
     text = models.TextField('Текст')
     cooking_time = models.PositiveSmallIntegerField('Время приготовления')
     pub_date = models.DateTimeField(auto_now_add=True,
                                     verbose_name='Дата публикации')
+    favorites_count = models.PositiveIntegerField('В избранном', default=0,
+                                                  editable=False)
+    in_carts_count = models.PositiveIntegerField('В списках покупок',
+                                                 default=0, editable=False)
+    search_vector = SearchVectorField('Поисковый вектор', null=True,
+                                      editable=False)
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ['-pub_date']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=['-favorites_count', '-pub_date', '-id'],
+                         name='recipe_popular_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='recipe_author_pub_date_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
 
+class RecipeIngredientQuerySet(models.QuerySet):
+
+    def coverage(self, ingredient_ids):
+        """
+        Рецепты хотя бы с одним из ингредиентов: количество ингредиентов
+        рецепта (total), сколько из них есть (matched) и их доля
+        (coverage), одним сгруппированным запросом по убыванию доли.
+        """
+        matched = models.Q(ingredient__in=ingredient_ids)
+        return self.filter(
+            recipe__in=self.filter(matched).values('recipe')
+        ).values('recipe').annotate(
+            total=models.Count('id'),
+            matched=models.Count('id', filter=matched),
+        ).annotate(
+            coverage=models.ExpressionWrapper(
+                models.F('matched') * 1.0 / models.F('total'),
+                output_field=models.FloatField()),
+        ).order_by('-coverage', '-matched', '-recipe')
+
+
 class RecipeIngredient(models.Model):
     """
     Модель количества ингредиентов в каком либо рецепте.
@@ -63,6 +175,8 @@ class RecipeIngredient(models.Model):
                                    related_name='recipe_ingredient')
     amount = models.PositiveSmallIntegerField()
 
+    objects = RecipeIngredientQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Ингредиент в рецепте'
         verbose_name_plural = 'Ингредиенты в рецепте'
@@ -74,12 +188,16 @@ class RecipeIngredient(models.Model):
 
 
 class FavoriteRecipe(models.Model):
+    counter_field = 'favorites_count'
+
     user = models.ForeignKey(User, on_delete=models.CASCADE,
                              verbose_name='Пользователь')
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
                                verbose_name='Рецепт',
                                related_name='favorite_recipe')
 
+    objects = RelationQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Избранный'
         verbose_name_plural = 'Избранные'
@@ -91,6 +209,8 @@ class FavoriteRecipe(models.Model):
 
 
 class ShoppingCart(models.Model):
+    counter_field = 'in_carts_count'
+
     user = models.ForeignKey(User, on_delete=models.CASCADE,
                              verbose_name='Пользователь',
                              related_name='shop_cart')
@@ -98,6 +218,8 @@ class ShoppingCart(models.Model):
                                verbose_name='Рецепт',
                                related_name='shop_cart')
 
+    objects = RelationQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Список покупок'
@@ -106,3 +228,70 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f'рецепт {self.recipe} в списке покупок  {self.user}'
+
+
+class ShoppingListItem(models.Model):
+    """
+    Сумма ингредиента по всем рецептам в списке покупок пользователя.
+    Обновляется при добавлении и удалении рецептов в списке покупок и при
+    изменении их ингредиентов.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             verbose_name='Пользователь',
+                             related_name='shopping_list')
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE,
+                                   verbose_name='Ингредиент',
+                                   related_name='shopping_list')
+    amount = models.IntegerField('Количество', default=0)
+    checked = models.BooleanField('Куплено', default=False)
+
+    class Meta:
+        verbose_name = 'Ингредиент к покупке'
+        verbose_name_plural = 'Ингредиенты к покупке'
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'ingredient'], name='unique_shoppinglistitem')]
+
+    def __str__(self):
+        return f'{self.ingredient} - {self.amount} для {self.user}'
+
+
+class StoredImage(models.Model):
+    """
+    Количество рецептов, ссылающихся на файл изображения. Файлы хранятся
+    под именем из хэша содержимого, одинаковые загрузки используют один
+    файл, который удаляется, когда ссылок не остается.
+    """
+    name = models.CharField('Файл', max_length=100, unique=True)
+    refs = models.PositiveIntegerField('Ссылок', default=0)
+
+    class Meta:
+        verbose_name = 'Файл изображения'
+        verbose_name_plural = 'Файлы изображений'
+
+    def __str__(self):
+        return self.name
+
+
+class RecipeSimilarity(models.Model):
+    """
+    Похожий рецепт и его сходство с рецептом: хранятся только TOP_K самых
+    похожих, рассчитанных командой compute_recipe_similarity и фоновыми
+    задачами.
+    """
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
+                               related_name='similarities',
+                               verbose_name='Рецепт')
+    similar = models.ForeignKey(Recipe, on_delete=models.CASCADE,
+                                related_name='+',
+                                verbose_name='Похожий рецепт')
+    score = models.FloatField('Сходство')
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [models.UniqueConstraint(fields=['recipe', 'similar'],
+                                               name='unique_similarity')]
+        indexes = [
+            models.Index(fields=['recipe', '-score'],
+                         name='recipe_similarity_score_idx'),
+        ]
@@ -0,0 +1,52 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class RecipeCursorPagination(CursorPagination):
+    """
+    Пагинация рецептов по курсору (pub_date, id): страницы выбираются по
+    индексу без OFFSET и без подсчета общего количества рецептов.
+    """
+    ordering = ('-pub_date', '-id')
+    page_size = 6
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+
+class RecipePagination(PageNumberPagination):
+    """
+    Постраничная пагинация рецептов. С параметром 'pagination=cursor'
+    переключается на пагинацию по курсору, формат ответа с номерами
+    страниц остается по умолчанию для старых клиентов. Результаты поиска
+    и сортировка по популярности всегда разбиваются на страницы по
+    номерам: релевантность и счетчик избранного не уникальны и меняются,
+    а курсор DRF не проходит больше 1000 рецептов с одинаковым значением.
+    """
+    page_size_query_param = 'limit'
+    mode_query_param = 'pagination'
+    cursor_class = RecipeCursorPagination
+
+    def __init__(self):
+        self.cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (request.query_params.get(self.mode_query_param) == 'cursor'
+                and not request.query_params.get('search')
+                and not request.query_params.get('ordering')):
+            self.cursor_paginator = self.cursor_class()
+            return self.cursor_paginator.paginate_queryset(queryset, request,
+                                                           view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class RecipeMatchPagination(PageNumberPagination):
+    """
+    Постраничная пагинация подбора рецептов по ингредиентам.
+    """
+    page_size = 6
+    page_size_query_param = 'limit'
+    max_page_size = 100
@@ -0,0 +1,178 @@
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from threading import Lock
+
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.models import Case, F, FloatField, Func, TextField, Value, When
+from django.utils.html import escape
+
+from .cache import get_version
+from .models import Recipe
+
+SEARCH_CONFIG = 'russian'
+START_SEL = '\ue000'
+STOP_SEL = '\ue001'
+HEADLINE_OPTIONS = (f'StartSel="{START_SEL}", StopSel="{STOP_SEL}", '
+                    'MaxWords=20, MinWords=5, MaxFragments=2')
+NAME_WEIGHT = 2
+SNIPPET_WORDS = 20
+FALLBACK_LIMIT = 500
+
+WORD = re.compile(r'\w+')
+
+
+def uses_search_vector():
+    return connection.vendor == 'postgresql'
+
+
+def search_vector():
+    """
+    Вектор рецепта: название с весом A, описание с весом B.
+    """
+    return (SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector('text', weight='B', config=SEARCH_CONFIG))
+
+
+def update_search_vector(queryset):
+    if uses_search_vector():
+        queryset.update(search_vector=search_vector())
+
+
+def tokenize(text):
+    return [word.casefold() for word in WORD.findall(text)]
+
+
+def snippet_html(snippet):
+    """
+    HTML фрагмента описания. ts_headline выделяет слова маркерами, текст
+    экранируется до замены маркеров на теги. Фрагменты индекса в памяти
+    экранируются при создании.
+    """
+    if not uses_search_vector():
+        return snippet
+    return escape(snippet).replace(START_SEL, '<b>').replace(STOP_SEL, '</b>')
+
+
+class RecipeIndex:
+    """
+    Обратный индекс рецептов в памяти процесса для баз без полнотекстового
+    поиска (SQLite в тестах и разработке). Слова запроса сопоставляются с
+    началом слов рецепта бинарным поиском по отсортированному словарю.
+    Загружается заново, когда меняется версия рецептов.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._version = None
+        self._words = None
+        self._postings = None
+        self._texts = None
+
+    def invalidate(self):
+        with self._lock:
+            self._version = None
+            self._words = None
+
+    def load(self):
+        version = get_version(Recipe)
+        with self._lock:
+            if self._words is None or self._version != version:
+                postings = defaultdict(lambda: defaultdict(int))
+                texts = {}
+                for pk, name, text in Recipe.objects.values_list(
+                        'id', 'name', 'text').iterator():
+                    for word in tokenize(name):
+                        postings[word][pk] += NAME_WEIGHT
+                    for word in tokenize(text):
+                        postings[word][pk] += 1
+                    texts[pk] = text
+                self._words = sorted(postings)
+                self._postings = postings
+                self._texts = texts
+                self._version = version
+            return self._words, self._postings, self._texts
+
+    def search(self, query, limit=FALLBACK_LIMIT):
+        """
+        Рецепты, содержащие все слова запроса, с весом совпадений.
+        Возвращает список пар (id, вес) по убыванию веса.
+        """
+        words, postings, _ = self.load()
+        scores = None
+        for term in set(tokenize(query)):
+            matches = defaultdict(int)
+            position = bisect_left(words, term)
+            while position < len(words) and words[position].startswith(term):
+                for pk, weight in postings[words[position]].items():
+                    matches[pk] += weight
+                position += 1
+            if scores is None:
+                scores = matches
+            else:
+                scores = {pk: score + matches[pk]
+                          for pk, score in scores.items() if pk in matches}
+        if not scores:
+            return []
+        return sorted(scores.items(), key=lambda item: -item[1])[:limit]
+
+    def snippet(self, pk, query):
+        """
+        Фрагмент описания вокруг первого совпадения с выделенными словами,
+        текст экранирован для HTML.
+        """
+        _, _, texts = self.load()
+        text = texts.get(pk, '')
+        terms = tuple(set(tokenize(query)))
+        words = list(WORD.finditer(text))
+        first = next((position for position, word in enumerate(words)
+                      if word.group().casefold().startswith(terms)), 0)
+        fragment = words[max(0, first - SNIPPET_WORDS // 4):][:SNIPPET_WORDS]
+        if not fragment:
+            return ''
+        parts = []
+        end = fragment[0].start()
+        for word in fragment:
+            parts.append(escape(text[end:word.start()]))
+            if word.group().casefold().startswith(terms):
+                parts.append(f'<b>{escape(word.group())}</b>')
+            else:
+                parts.append(escape(word.group()))
+            end = word.end()
+        return ''.join(parts)
+
+
+recipe_index = RecipeIndex()
+
+
+def search_recipes(queryset, query):
+    """
+    Рецепты, подходящие под запрос, с весом search_rank и выделенным
+    фрагментом описания search_snippet, по убыванию веса.
+    """
+    if not tokenize(query):
+        return queryset
+    if uses_search_vector():
+        search_query = SearchQuery(query, config=SEARCH_CONFIG)
+        return queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F('search_vector'), search_query),
+            search_snippet=Func(
+                Value(SEARCH_CONFIG), F('text'), search_query,
+                Value(HEADLINE_OPTIONS), function='ts_headline',
+                output_field=TextField()),
+        ).order_by('-search_rank', '-pub_date', '-id')
+
+    results = recipe_index.search(query)
+    if not results:
+        return queryset.none()
+    return queryset.filter(pk__in=[pk for pk, _ in results]).annotate(
+        search_rank=Case(
+            *[When(pk=pk, then=Value(float(score))) for pk, score in results],
+            output_field=FloatField()),
+        search_snippet=Case(
+            *[When(pk=pk, then=Value(recipe_index.snippet(pk, query)))
+              for pk, _ in results],
+            output_field=TextField()),
+    ).order_by('-search_rank', '-pub_date', '-id')
@@ -1,11 +1,19 @@
+from collections import Counter
+
 from django.contrib.auth import get_user_model
-from drf_extra_fields.fields import Base64ImageField
+from django.db import transaction
+from jobs.queue import enqueue
 from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
+from users.serializers import BatchSerializer, ReUserSerializer
 
-from users.serializers import ReUserSerializer
+from .fields import Base64UploadField, RecipeImageField, RecipeImageInfoField
+from .images import save_upload
 from .models import (FavoriteRecipe, Ingredient, Recipe, RecipeIngredient,
-                     ShoppingCart, Tag)
+                     ShoppingCart, ShoppingListItem, Tag)
+from .search import snippet_html
+from .shopping_list import change_recipe
+from .tasks import schedule_similarity_update
 
 User = get_user_model()
 
@@ -50,15 +58,16 @@ class RecipeGetSerializer(serializers.ModelSerializer):
                                              many=True)
     tags = TagSerializer(many=True)
     author = ReUserSerializer(read_only=True)
-    image = Base64ImageField()
+    image = RecipeImageField(source='*')
+    image_info = RecipeImageInfoField(source='*')
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name', 'image', 'text',
-                  'cooking_time')
+                  'is_in_shopping_cart', 'name', 'image', 'image_info',
+                  'text', 'cooking_time')
 
     def get_is_favorited(self, obj):
         """
@@ -67,6 +76,8 @@ class RecipeGetSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         queryset = FavoriteRecipe.objects.filter(user=request.user.id,
                                                  recipe=obj.id).exists()
         return queryset
@@ -78,11 +89,47 @@ class RecipeGetSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         queryset = ShoppingCart.objects.filter(user=request.user.id,
                                                recipe=obj.id).exists()
         return queryset
 
 
+class RecipeListSerializer(RecipeGetSerializer):
+    """Сериализатор модели Рецепт в списке, с изображением для карточки."""
+
+    image = RecipeImageField(variant='medium', source='*')
+    image_info = RecipeImageInfoField(variant='medium', source='*')
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if hasattr(instance, 'search_snippet'):
+            data['search_snippet'] = snippet_html(instance.search_snippet)
+        return data
+
+
+class RecipeMatchSerializer(RecipeListSerializer):
+    """
+    Рецепт в подборе по ингредиентам: сколько ингредиентов рецепта есть
+    у пользователя и каких не хватает.
+    """
+    ingredients_matched = serializers.ReadOnlyField()
+    ingredients_total = serializers.ReadOnlyField()
+    missing_ingredients = serializers.SerializerMethodField()
+
+    class Meta(RecipeListSerializer.Meta):
+        fields = RecipeListSerializer.Meta.fields + (
+            'ingredients_matched', 'ingredients_total', 'missing_ingredients')
+
+    def get_missing_ingredients(self, obj):
+        available = self.context['ingredient_ids']
+        return IngredientSerializer(
+            [item.ingredient for item in obj.recipe_ingredient.all()
+             if item.ingredient_id not in available],
+            many=True).data
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     """Сериализатор модели Рецепт, POST запрос."""
 
@@ -91,7 +138,7 @@ class RecipeSerializer(serializers.ModelSerializer):
                                              many=True)
     tags = serializers.PrimaryKeyRelatedField(many=True,
                                               queryset=Tag.objects.all())
-    image = Base64ImageField()
+    image = Base64UploadField()
     name = serializers.CharField(validators=[UniqueValidator(
         queryset=Recipe.objects.all(),
         message='Такой рецепт уже существует!')])
@@ -139,32 +186,88 @@ class RecipeSerializer(serializers.ModelSerializer):
         return data
 
     def create_recipe_ingredient(self, ingredients, recipe):
-        for ingredient in ingredients:
-            RecipeIngredient.objects.create(
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
                 ingredient_id=ingredient.get('id'),
                 recipe=recipe,
                 amount=ingredient.get('amount'),
             )
+            for ingredient in ingredients
+        )
 
+    def update_recipe_ingredient(self, ingredients, recipe):
+        """
+        Обновление ингредиентов рецепта: изменяются только добавленные,
+        удаленные и поменявшие количество строки, разница переносится в
+        списки покупок. При изменении набора ингредиентов планируется
+        пересчет похожих рецептов.
+        """
+        amounts = {int(ingredient.get('id')): int(ingredient.get('amount'))
+                   for ingredient in ingredients}
+        current = {item.ingredient_id: item
+                   for item in recipe.recipe_ingredient.all()}
+        deltas = Counter(amounts)
+        for ingredient_id, item in current.items():
+            deltas[ingredient_id] -= item.amount
+
+        removed = current.keys() - amounts.keys()
+        if removed:
+            recipe.recipe_ingredient.filter(
+                ingredient_id__in=removed).delete()
+
+        changed = []
+        for ingredient_id, item in current.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and item.amount != amount:
+                item.amount = amount
+                changed.append(item)
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+
+        added = [{'id': ingredient_id, 'amount': amounts[ingredient_id]}
+                 for ingredient_id in amounts.keys() - current.keys()]
+        if added:
+            self.create_recipe_ingredient(added, recipe)
+        change_recipe(recipe.id, deltas)
+        if added or removed:
+            schedule_similarity_update(recipe.id)
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = self.initial_data.get('ingredients')
         validated_data.pop('recipe_ingredient')
         tags = validated_data.pop('tags')
+        validated_data['image'] = save_upload(validated_data['image'])
+        validated_data['image_status'] = Recipe.IMAGE_PENDING
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags)
         self.create_recipe_ingredient(ingredients, recipe)
+        enqueue('process_recipe_image', recipe_id=recipe.id,
+                image=recipe.image.name)
+        schedule_similarity_update(recipe.id)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         tags = validated_data.pop('tags')
         validated_data.pop('recipe_ingredient')
         ingredients = self.initial_data.get('ingredients')
+        old_image = instance.image.name
+        if 'image' in validated_data:
+            validated_data['image'] = save_upload(validated_data['image'])
+            validated_data['image_status'] = Recipe.IMAGE_PENDING
         instance.tags.set(tags)
-        instance.ingredients.clear()
-        self.create_recipe_ingredient(ingredients, instance)
+        self.update_recipe_ingredient(ingredients, instance)
         instance = super().update(instance, validated_data)
+        if 'image' in validated_data:
+            enqueue('process_recipe_image', recipe_id=instance.id,
+                    image=instance.image.name)
+            enqueue('delete_recipe_image', image=old_image)
         return instance
 
+    def to_representation(self, instance):
+        return RecipeGetSerializer(instance, context=self.context).data
+
 
 class FavoriteRecipeSerializer(serializers.ModelSerializer):
     """
@@ -172,12 +275,14 @@ class FavoriteRecipeSerializer(serializers.ModelSerializer):
     """
     id = serializers.ReadOnlyField(source='recipe.id')
     name = serializers.ReadOnlyField(source='recipe.name')
-    image = Base64ImageField(source='recipe.image', read_only=True)
+    image = RecipeImageField(variant='small', source='recipe')
+    image_info = RecipeImageInfoField(variant='small', source='recipe')
     cooking_time = serializers.ReadOnlyField(source='recipe.cooking_time')
 
     class Meta:
         model = FavoriteRecipe
-        fields = ('id', 'name', 'image', 'cooking_time', 'user', 'recipe')
+        fields = ('id', 'name', 'image', 'image_info', 'cooking_time',
+                  'user', 'recipe')
         extra_kwargs = {'user': {'write_only': True},
                         'recipe': {'write_only': True}}
 
@@ -197,12 +302,14 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
     """
     id = serializers.ReadOnlyField(source='recipe.id')
     name = serializers.ReadOnlyField(source='recipe.name')
-    image = Base64ImageField(source='recipe.image', read_only=True)
+    image = RecipeImageField(variant='small', source='recipe')
+    image_info = RecipeImageInfoField(variant='small', source='recipe')
     cooking_time = serializers.ReadOnlyField(source='recipe.cooking_time')
 
     class Meta:
         model = ShoppingCart
-        fields = ('id', 'name', 'image', 'cooking_time', 'user', 'recipe')
+        fields = ('id', 'name', 'image', 'image_info', 'cooking_time',
+                  'user', 'recipe')
         extra_kwargs = {'user': {'write_only': True},
                         'recipe': {'write_only': True}}
 
@@ -215,3 +322,24 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('Рецепт уже есть в списке'
                                               ' покупок!')
         return data
+
+
+class ShoppingListItemSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор ингредиента в списке покупок.
+    """
+    id = serializers.ReadOnlyField(source='ingredient.id')
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit')
+
+    class Meta:
+        model = ShoppingListItem
+        fields = ('id', 'name', 'measurement_unit', 'amount', 'checked')
+
+
+class ShoppingListCheckSerializer(BatchSerializer):
+    """
+    Отметка о покупке ингредиентов 'ids' списка покупок.
+    """
+    checked = serializers.BooleanField()
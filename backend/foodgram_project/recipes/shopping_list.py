@@ -0,0 +1,144 @@
+from collections import Counter
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+
+from .models import RecipeIngredient, ShoppingCart, ShoppingListItem
+
+User = get_user_model()
+
+
+def recipe_amounts(recipe_ids):
+    """
+    Сумма каждого ингредиента в рецептах recipe_ids. Рецепт, который
+    встречается несколько раз, учитывается столько же раз.
+    """
+    per_recipe = RecipeIngredient.objects.filter(
+        recipe__in=set(recipe_ids)).values_list('recipe', 'ingredient',
+                                                'amount')
+    times = Counter(recipe_ids)
+    amounts = Counter()
+    for recipe_id, ingredient_id, amount in per_recipe:
+        amounts[ingredient_id] += amount * times[recipe_id]
+    return amounts
+
+
+def change(user_ids, deltas):
+    """
+    Изменение количества ингредиентов в списках покупок пользователей на
+    deltas {id ингредиента: изменение} одним запросом UPDATE. Недостающие
+    строки добавляются, строки с нулевым количеством удаляются, а при
+    увеличении количества отметка о покупке снимается. Внутри внешней
+    транзакции точка сохранения не создается.
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not user_ids or not deltas:
+        return
+    increased = [pk for pk, delta in deltas.items() if delta > 0]
+    with transaction.atomic(savepoint=False):
+        ShoppingListItem.objects.bulk_create([
+            ShoppingListItem(user_id=user_id, ingredient_id=pk)
+            for user_id in user_ids for pk in increased
+        ], ignore_conflicts=True)
+        items = ShoppingListItem.objects.filter(user__in=user_ids,
+                                                ingredient__in=deltas)
+        fields = {'amount': F('amount') + Case(
+            *[When(ingredient=pk, then=Value(delta))
+              for pk, delta in deltas.items()],
+            output_field=IntegerField())}
+        if increased:
+            fields['checked'] = Case(
+                When(ingredient__in=increased, then=Value(False)),
+                default=F('checked'))
+        items.update(**fields)
+        if len(increased) < len(deltas):
+            items.filter(amount__lte=0).delete()
+
+
+def add_recipes(user_id, recipe_ids):
+    change([user_id], recipe_amounts(recipe_ids))
+
+
+def remove_recipes(user_id, recipe_ids):
+    change([user_id], {pk: -amount for pk, amount
+                       in recipe_amounts(recipe_ids).items()})
+
+
+def change_recipe(recipe_id, deltas):
+    """
+    Изменение списков покупок всех пользователей, у которых в них есть
+    рецепт, после изменения ингредиентов рецепта.
+    """
+    if any(deltas.values()):
+        change(list(ShoppingCart.objects.filter(recipe=recipe_id).values_list(
+            'user', flat=True)), deltas)
+
+
+@contextmanager
+def recipes_changes(recipe_ids):
+    """
+    Перенос в списки покупок изменений ингредиентов рецептов recipe_ids,
+    сделанных внутри блока по одному, например в админке.
+    """
+    before = {pk: recipe_amounts([pk]) for pk in recipe_ids}
+    yield
+    for pk, amounts in before.items():
+        after = recipe_amounts([pk])
+        change_recipe(pk, {ingredient_id: after[ingredient_id]
+                           - amounts[ingredient_id]
+                           for ingredient_id in amounts.keys() | after.keys()})
+
+
+def totals(user_ids=None):
+    """
+    Суммы ингредиентов по спискам покупок, рассчитанные заново по
+    рецептам в списках.
+    """
+    carts = {'recipe__shop_cart__isnull': False}
+    if user_ids is not None:
+        carts = {'recipe__shop_cart__user__in': user_ids}
+    queryset = RecipeIngredient.objects.filter(**carts)
+    return {
+        (row['recipe__shop_cart__user'], row['ingredient']): row['total']
+        for row in queryset.values(
+            'recipe__shop_cart__user', 'ingredient'
+        ).annotate(total=Sum('amount')).order_by().iterator()
+    }
+
+
+@transaction.atomic
+def rebuild(user_ids=None):
+    """
+    Пересчет списков покупок с нуля для исправления расхождений. Отметки
+    о покупке сохраняются. Возвращает количество исправленных строк.
+    Пользователи и строки их списков блокируются до расчета сумм, поэтому
+    изменения корзины не попадают между расчетом и записью.
+    """
+    users = User.objects.select_for_update()
+    items = ShoppingListItem.objects.select_for_update()
+    if user_ids is not None:
+        users = users.filter(pk__in=user_ids)
+        items = items.filter(user__in=user_ids)
+    list(users.values_list('pk', flat=True))
+    current = {(item.user_id, item.ingredient_id): item for item in items}
+    expected = totals(user_ids)
+
+    stale = [item.pk for key, item in current.items() if key not in expected]
+    ShoppingListItem.objects.filter(pk__in=stale).delete()
+    changed = []
+    for key, amount in expected.items():
+        item = current.get(key)
+        if item is not None and item.amount != amount:
+            item.amount = amount
+            changed.append(item)
+    ShoppingListItem.objects.bulk_update(changed, ['amount'])
+    missing = [
+        ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                         amount=amount)
+        for (user_id, ingredient_id), amount in expected.items()
+        if (user_id, ingredient_id) not in current
+    ]
+    ShoppingListItem.objects.bulk_create(missing)
+    return len(stale) + len(changed) + len(missing)
@@ -0,0 +1,91 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from jobs.queue import enqueue
+
+from .cache import bump_version
+from .models import FavoriteRecipe, Ingredient, Recipe, ShoppingCart, Tag
+from .search import update_search_vector, uses_search_vector
+from .shopping_list import add_recipes, remove_recipes
+from .tasks import schedule_similarity_update
+
+
+@receiver([post_save, post_delete], sender=Tag)
+@receiver([post_save, post_delete], sender=Ingredient)
+def bump_reference_version(sender, **kwargs):
+    """
+    Новая версия справочника при изменении тэгов и ингредиентов.
+    """
+    bump_version(sender)
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_save, sender=ShoppingCart)
+def increment_recipe_counter(sender, instance, created, raw, **kwargs):
+    """
+    Увеличение счетчика избранного или списков покупок рецепта.
+    """
+    if created and not raw:
+        Recipe.objects.filter(pk=instance.recipe_id).change_counter(
+            sender.counter_field, 1)
+        schedule_similarity_update(instance.recipe_id)
+
+
+@receiver(post_delete, sender=FavoriteRecipe)
+@receiver(post_delete, sender=ShoppingCart)
+def decrement_recipe_counter(sender, instance, **kwargs):
+    """
+    Уменьшение счетчика избранного или списков покупок рецепта.
+    """
+    Recipe.objects.filter(pk=instance.recipe_id).change_counter(
+        sender.counter_field, -1)
+    schedule_similarity_update(instance.recipe_id)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(sender, instance, created, raw, **kwargs):
+    """
+    Добавление ингредиентов рецепта в список покупок пользователя.
+    """
+    if created and not raw:
+        add_recipes(instance.user_id, [instance.recipe_id])
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def remove_from_shopping_list(sender, instance, **kwargs):
+    """
+    Вычитание ингредиентов рецепта из списка покупок пользователя. При
+    удалении рецепта ингредиенты еще не удалены, так как pre_delete
+    отправляется до удаления связанных объектов.
+    """
+    remove_recipes(instance.user_id, [instance.recipe_id])
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_recipe_image(sender, instance, **kwargs):
+    """
+    Удаление файлов изображения удаленного рецепта в фоновой задаче.
+    """
+    if instance.image:
+        enqueue('delete_recipe_image', image=instance.image.name)
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search(sender, instance, raw, update_fields, **kwargs):
+    """
+    Обновление поискового вектора рецепта или, без полнотекстового поиска
+    в базе, версии индекса рецептов в памяти.
+    """
+    if raw or (update_fields is not None
+               and not {'name', 'text'} & set(update_fields)):
+        return
+    if uses_search_vector():
+        update_search_vector(Recipe.objects.filter(pk=instance.pk))
+    else:
+        bump_version(Recipe)
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_search(sender, instance, **kwargs):
+    if not uses_search_vector():
+        bump_version(Recipe)
@@ -0,0 +1,214 @@
+import heapq
+from collections import Counter, defaultdict
+from math import sqrt
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import (FavoriteRecipe, Recipe, RecipeIngredient,
+                     RecipeSimilarity, ShoppingCart)
+
+TOP_K = 10
+INTERACTION_WEIGHT = 0.6
+INGREDIENT_WEIGHT = 0.4
+COMMON_INGREDIENT_SHARE = 0.2
+MAX_USER_RECIPES = 500
+BATCH_SIZE = 1000
+
+INTERACTIONS = (FavoriteRecipe, ShoppingCart)
+
+
+def similarity(together, norm, other_norm, shared, total, other_total):
+    """
+    Сходство двух рецептов: косинус векторов пользователей, добавивших
+    рецепт в избранное или список покупок, и коэффициент Жаккара наборов
+    ингредиентов.
+    """
+    interaction = 0
+    if together and norm and other_norm:
+        interaction = min(1, together / sqrt(norm * other_norm))
+    union = total + other_total - shared
+    ingredient = shared / union if union else 0
+    return INTERACTION_WEIGHT * interaction + INGREDIENT_WEIGHT * ingredient
+
+
+def top(scores, top_k=TOP_K):
+    return heapq.nlargest(top_k, (
+        (score, other) for other, score in scores.items() if score > 0))
+
+
+def common_ingredients(recipes_count=None):
+    """
+    Ингредиенты, которые есть больше чем в COMMON_INGREDIENT_SHARE
+    рецептов: по ним кандидаты не подбираются.
+    """
+    if recipes_count is None:
+        recipes_count = Recipe.objects.count()
+    return set(RecipeIngredient.objects.values('ingredient').annotate(
+        recipes=Count('id')
+    ).filter(
+        recipes__gt=recipes_count * COMMON_INGREDIENT_SHARE
+    ).values_list('ingredient', flat=True))
+
+
+def load_ingredients(recipes_count):
+    """
+    Наборы ингредиентов рецептов, рецепты каждого ингредиента и частые
+    ингредиенты.
+    """
+    ingredients = defaultdict(set)
+    recipes_by_ingredient = defaultdict(set)
+    for recipe_id, ingredient_id in RecipeIngredient.objects.values_list(
+            'recipe', 'ingredient').iterator():
+        ingredients[recipe_id].add(ingredient_id)
+        recipes_by_ingredient[ingredient_id].add(recipe_id)
+    common = {
+        ingredient_id for ingredient_id, recipes
+        in recipes_by_ingredient.items()
+        if len(recipes) > recipes_count * COMMON_INGREDIENT_SHARE
+    }
+    return ingredients, recipes_by_ingredient, common
+
+
+def load_interactions(model):
+    """
+    Пользователи каждого рецепта и рецепты каждого пользователя для
+    избранного или списков покупок. Пользователи, у которых больше
+    MAX_USER_RECIPES записей, не учитываются.
+    """
+    recipes_by_user = defaultdict(list)
+    for user_id, recipe_id in model.objects.values_list(
+            'user', 'recipe').iterator():
+        recipes_by_user[user_id].append(recipe_id)
+    users_by_recipe = defaultdict(list)
+    for user_id, recipes in recipes_by_user.items():
+        if len(recipes) > MAX_USER_RECIPES:
+            continue
+        for recipe_id in recipes:
+            users_by_recipe[recipe_id].append(user_id)
+    return users_by_recipe, recipes_by_user
+
+
+def rebuild(top_k=TOP_K):
+    """
+    Полный пересчет похожих рецептов в памяти по всем рецептам, добавлениям
+    в избранное и списки покупок и ингредиентам. Таблица заменяется в
+    одной транзакции. Возвращает количество сохраненных пар.
+    """
+    norms = {
+        pk: favorites + carts for pk, favorites, carts
+        in Recipe.objects.values_list(
+            'id', 'favorites_count', 'in_carts_count').iterator()
+    }
+    ingredients, recipes_by_ingredient, common = load_ingredients(len(norms))
+    interactions = [load_interactions(model) for model in INTERACTIONS]
+
+    stored = 0
+    with transaction.atomic():
+        RecipeSimilarity.objects.all().delete()
+        batch = []
+        for recipe_id, norm in norms.items():
+            together = Counter()
+            for users_by_recipe, recipes_by_user in interactions:
+                for user_id in users_by_recipe[recipe_id]:
+                    together.update(recipes_by_user[user_id])
+            candidates = set(together)
+            for ingredient_id in ingredients[recipe_id] - common:
+                candidates |= recipes_by_ingredient[ingredient_id]
+            candidates.discard(recipe_id)
+
+            recipe_ingredients = ingredients[recipe_id]
+            scores = {
+                other: similarity(
+                    together[other], norm, norms.get(other, 0),
+                    len(recipe_ingredients & ingredients[other]),
+                    len(recipe_ingredients), len(ingredients[other]))
+                for other in candidates
+            }
+            batch.extend(
+                RecipeSimilarity(recipe_id=recipe_id, similar_id=other,
+                                 score=score)
+                for score, other in top(scores, top_k))
+            if len(batch) >= BATCH_SIZE:
+                RecipeSimilarity.objects.bulk_create(batch)
+                stored += len(batch)
+                batch = []
+        RecipeSimilarity.objects.bulk_create(batch)
+        stored += len(batch)
+    return stored
+
+
+def recipe_scores(recipe_id):
+    """
+    Сходство рецепта со всеми кандидатами, рассчитанное сгруппированными
+    запросами к базе, по тем же правилам, что и в rebuild.
+    """
+    recipe = Recipe.objects.filter(pk=recipe_id).values(
+        'favorites_count', 'in_carts_count').first()
+    if recipe is None:
+        return {}
+    norm = recipe['favorites_count'] + recipe['in_carts_count']
+
+    together = Counter()
+    for model in INTERACTIONS:
+        users = model.objects.filter(
+            user__in=model.objects.filter(recipe=recipe_id).values('user')
+        ).values('user').annotate(
+            recipes=Count('id')
+        ).filter(recipes__lte=MAX_USER_RECIPES).values('user')
+        together.update(dict(model.objects.filter(
+            user__in=users
+        ).exclude(recipe=recipe_id).values('recipe').annotate(
+            together=Count('id')
+        ).values_list('recipe', 'together')))
+
+    ingredients = set(RecipeIngredient.objects.filter(
+        recipe=recipe_id).values_list('ingredient', flat=True))
+    candidates = set(together) | set(RecipeIngredient.objects.filter(
+        ingredient__in=ingredients - common_ingredients()
+    ).exclude(recipe=recipe_id).values_list('recipe', flat=True))
+
+    return {
+        other: similarity(together[other], norm, favorites + carts,
+                          shared, len(ingredients), total)
+        for other, favorites, carts, total, shared
+        in Recipe.objects.filter(pk__in=candidates).annotate(
+            total=Count('recipe_ingredient'),
+            shared=Count('recipe_ingredient', filter=Q(
+                recipe_ingredient__ingredient__in=ingredients)),
+        ).values_list('id', 'favorites_count', 'in_carts_count', 'total',
+                      'shared')
+    }
+
+
+@transaction.atomic
+def update(recipe_id, top_k=TOP_K):
+    """
+    Пересчет похожих рецептов для одного рецепта. Сходство симметрично,
+    поэтому рецепт также обновляется, добавляется или удаляется в списках
+    других рецептов, которые остаются не длиннее top_k.
+    """
+    scores = recipe_scores(recipe_id)
+    best = top(scores, top_k)
+    RecipeSimilarity.objects.filter(recipe=recipe_id).delete()
+    RecipeSimilarity.objects.bulk_create(
+        RecipeSimilarity(recipe_id=recipe_id, similar_id=other, score=score)
+        for score, other in best)
+
+    reverse = RecipeSimilarity.objects.filter(similar=recipe_id)
+    existing = set(reverse.values_list('recipe', flat=True))
+    reverse.filter(recipe__in=[
+        other for other in existing if scores.get(other, 0) <= 0
+    ]).delete()
+    for other in existing:
+        if scores.get(other, 0) > 0:
+            reverse.filter(recipe=other).update(score=scores[other])
+    for score, other in best:
+        if other in existing:
+            continue
+        RecipeSimilarity.objects.create(recipe_id=other, similar_id=recipe_id,
+                                        score=score)
+        RecipeSimilarity.objects.filter(recipe=other).exclude(
+            pk__in=RecipeSimilarity.objects.filter(recipe=other).order_by(
+                '-score', '-similar').values('pk')[:top_k]
+        ).delete()
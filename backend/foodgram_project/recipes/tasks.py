@@ -0,0 +1,96 @@
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+from jobs.models import Job
+from jobs.queue import enqueue, enqueue_many_once, task
+from PIL import Image, UnidentifiedImageError
+
+from .images import collect_orphans, process_recipe_image, release
+from .models import Recipe
+from .similarity import update
+
+logger = logging.getLogger('foodgram.jobs')
+
+ORPHANS_INTERVAL = timedelta(days=1)
+SIMILARITY_DELAY = timedelta(minutes=10)
+
+
+def image_failed(recipe_id, image):
+    """
+    Пометка изображения как необработанного, когда все попытки обработки
+    завершились ошибкой.
+    """
+    Recipe.objects.filter(pk=recipe_id, image=image,
+                          image_status=Recipe.IMAGE_PENDING).update(
+        image_status=Recipe.IMAGE_FAILED)
+
+
+@task('process_recipe_image', on_failure=image_failed)
+def process_image(recipe_id, image):
+    """
+    Проверка, нормализация и создание вариантов загруженного изображения.
+    Задача для уже замененного изображения пропускается, файл, который не
+    удалось прочитать как изображение, повторно не обрабатывается.
+    """
+    recipe = Recipe.objects.filter(pk=recipe_id, image=image).first()
+    if recipe is None or recipe.image_status == Recipe.IMAGE_READY:
+        return
+    try:
+        process_recipe_image(recipe)
+    except (UnidentifiedImageError, Image.DecompressionBombError) as error:
+        image_failed(recipe_id, image)
+        logger.warning('recipe=%s image=%s rejected: %s',
+                       recipe_id, image, error)
+
+
+@task('delete_recipe_image')
+def delete_image(image):
+    """
+    Удаление ссылки на замененное или удаленное изображение рецепта.
+    """
+    release(image)
+
+
+def schedule_orphans_collection(run_after=None):
+    """
+    Постановка сборки файлов без ссылок в очередь, если она еще не
+    запланирована.
+    """
+    if Job.objects.filter(name='collect_orphan_media',
+                          status=Job.PENDING).exists():
+        return None
+    return enqueue('collect_orphan_media', run_after=run_after)
+
+
+@task('collect_orphan_media')
+def collect_orphan_media():
+    """
+    Удаление файлов без ссылок и планирование следующего запуска.
+    """
+    collected = collect_orphans()
+    logger.info('orphan media collected: files=%s bytes=%s', len(collected),
+                sum(size for name, size in collected))
+    schedule_orphans_collection(run_after=timezone.now() + ORPHANS_INTERVAL)
+
+
+def schedule_similarity_update(*recipe_ids):
+    """
+    Отложенный пересчет похожих рецептов: изменения за SIMILARITY_DELAY
+    обрабатываются одной задачей. Задачи ставятся после фиксации
+    транзакции одним запросом.
+    """
+    run_after = timezone.now() + SIMILARITY_DELAY
+    transaction.on_commit(lambda: enqueue_many_once(
+        'update_recipe_similarity',
+        [{'recipe_id': recipe_id} for recipe_id in recipe_ids], run_after))
+
+
+@task('update_recipe_similarity')
+def update_recipe_similarity(recipe_id):
+    """
+    Пересчет похожих рецептов после изменения ингредиентов, избранного или
+    списков покупок.
+    """
+    update(recipe_id)
@@ -1,7 +1,8 @@
 from django.contrib.auth.models import User
 from django.test import TestCase
-from recipes.models import FavoriteRecipe, Recipe, ShoppingCart
-from recipes.serializers import (FavoriteRecipeSerializer,
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, Tag)
+from recipes.serializers import (FavoriteRecipeSerializer, RecipeSerializer,
                                  ShoppingCartSerializer)
 
 
@@ -64,3 +65,33 @@ class RecipesSerializerTests(TestCase):
         serializer.save()
         serializer = ShoppingCartSerializer(data=self.data)
         self.assertEqual(serializer.is_valid(), False)
+
+    def test_recipe_serializer_update_ingredients(self):
+        """
+        Проверка обновления ингредиентов рецепта: неизменные строки
+        сохраняются, измененные обновляются, лишние удаляются.
+        """
+        tag = Tag.objects.create(name='обед', slug='lunch')
+        salt, sugar, flour, milk = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('соль', 'сахар', 'мука', 'молоко')
+        )
+        for ingredient, amount in ((salt, 1), (sugar, 2), (flour, 3)):
+            RecipeIngredient.objects.create(recipe=self.recipe,
+                                            ingredient=ingredient,
+                                            amount=amount)
+        salt_row = RecipeIngredient.objects.get(ingredient=salt)
+        data = {
+            'tags': [tag.id],
+            'ingredients': [{'id': salt.id, 'amount': 1},
+                            {'id': sugar.id, 'amount': 5},
+                            {'id': milk.id, 'amount': 4}],
+        }
+        serializer = RecipeSerializer(self.recipe, data=data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        amounts = dict(RecipeIngredient.objects.filter(
+            recipe=self.recipe).values_list('ingredient', 'amount'))
+        self.assertEqual(amounts, {salt.id: 1, sugar.id: 5, milk.id: 4})
+        self.assertEqual(RecipeIngredient.objects.get(ingredient=salt).id,
+                         salt_row.id)
@@ -1,8 +1,40 @@
+import base64
+import json
+import os
+import re
+import tempfile
+import time
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import Client, TestCase
-from recipes.models import FavoriteRecipe, Recipe, ShoppingCart
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import transaction
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from foodgram_project.middleware import ServerTimingMiddleware
+from foodgram_project.testing import on_commit_callbacks
+from jobs.models import Job
+from jobs.queue import MAX_ATTEMPTS, run_pending
+from PIL import Image, PngImagePlugin
+from recipes.autocomplete import ingredient_index
+from recipes.cache import (bump_version, get_version, increment_version,
+                           version_key)
+from recipes.exports import cache_key
+from recipes.images import process_recipe_image, release
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
+                            RecipeIngredient, RecipeSimilarity, ShoppingCart,
+                            ShoppingListItem, StoredImage, Tag)
+from recipes.search import START_SEL, STOP_SEL, recipe_index, snippet_html
+from recipes.serializers import RecipeSerializer
+from recipes.shopping_list import recipes_changes
+from recipes.similarity import recipe_scores, top, update
 from rest_framework import status
 from rest_framework.test import APIClient
+from users.models import Subscription, lock_user
 
 
 class RecipesViewsTests(TestCase):
@@ -160,3 +192,1220 @@ class RecipesViewsTests(TestCase):
         self.assertEqual(ShoppingCart.objects.count(), 0)
         response = self.guest_client.delete(self.url_shopping_cart)
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_put_shopping_cart_idempotent(self):
+        """
+        Повторный PUT не создает дубль и возвращает рецепт со статусом 200,
+        счетчик рецепта увеличивается один раз.
+        """
+        response = self.authorized_client.put(self.url_shopping_cart)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.authorized_client.put(self.url_shopping_cart)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['id'], self.recipe.id)
+        self.assertEqual(ShoppingCart.objects.count(), 1)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.in_carts_count, 1)
+
+    def test_post_favorite(self):
+        """
+        Добавление в избранное методом POST, повторный POST - ошибка.
+        """
+        response = self.authorized_client.post(self.url_favorite)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.authorized_client.post(self.url_favorite)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(FavoriteRecipe.objects.count(), 1)
+
+    def test_delete_favorite_missing_recipe(self):
+        """
+        Удаление из избранного несуществующего рецепта возвращает 404.
+        """
+        response = self.authorized_client.delete(
+            '/api/recipes/100/favorite/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class RecipesQueriesTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.user = User.objects.create(username="sergey",)
+        cls.author = User.objects.create(username="author",)
+        cls.tag = Tag.objects.create(name='завтрак', slug='breakfast')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(10)
+        ]
+
+    def setUp(self):
+        self.authorized_client = APIClient()
+        self.authorized_client.force_authenticate(self.user)
+
+    def create_recipes(self, count):
+        for number in range(count):
+            recipe = Recipe.objects.create(name=f'рецепт {number}',
+                                           text='текст',
+                                           cooking_time=1,
+                                           author=self.author)
+            recipe.tags.add(self.tag)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=1)
+                for ingredient in self.ingredients
+            )
+            FavoriteRecipe.objects.create(user=self.user, recipe=recipe)
+        Subscription.objects.create(author=self.author, follower=self.user)
+
+    def test_recipe_list_constant_queries(self):
+        """
+        Количество запросов к базе на странице рецептов не зависит от
+        количества рецептов и ингредиентов в них.
+        """
+        self.create_recipes(6)
+        with self.assertNumQueries(5):
+            response = self.authorized_client.get('/api/recipes/?limit=6')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual(len(results), 6)
+        self.assertTrue(all(recipe['is_favorited'] for recipe in results))
+        self.assertFalse(any(recipe['is_in_shopping_cart']
+                             for recipe in results))
+        self.assertTrue(all(recipe['author']['is_subscribed']
+                            for recipe in results))
+        self.assertEqual(len(results[0]['ingredients']), 10)
+
+    def test_recipe_list_anonymous_constant_queries(self):
+        """
+        Количество запросов на странице рецептов для Неавторизованного юзера.
+        """
+        self.create_recipes(6)
+        with self.assertNumQueries(4):
+            response = Client().get('/api/recipes/?limit=6')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 6)
+
+    def test_download_shopping_cart_totals(self):
+        """
+        Суммирование ингредиентов в списке покупок одним запросом без
+        смешивания разных единиц измерения.
+        """
+        salt_gram = Ingredient.objects.create(name='соль',
+                                              measurement_unit='г')
+        salt_spoon = Ingredient.objects.create(name='соль',
+                                               measurement_unit='ч. л.')
+        for number, amount in enumerate((2, 3)):
+            recipe = Recipe.objects.create(name=f'суп {number}',
+                                           text='текст',
+                                           cooking_time=1,
+                                           author=self.author)
+            RecipeIngredient.objects.create(recipe=recipe,
+                                            ingredient=salt_gram,
+                                            amount=amount)
+            RecipeIngredient.objects.create(recipe=recipe,
+                                            ingredient=salt_spoon,
+                                            amount=1)
+            ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        response = self.authorized_client.get(
+            '/api/recipes/download_shopping_cart/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(1):
+            content = b''.join(response.streaming_content).decode()
+        self.assertEqual(content, 'соль - 5 г\nсоль - 2 ч. л.\n')
+
+    def test_recipe_list_cursor_pagination(self):
+        """
+        Пагинация по курсору без подсчета количества рецептов совпадает с
+        постраничной пагинацией и учитывает фильтры.
+        """
+        self.create_recipes(5)
+        Recipe.objects.create(name='чужой рецепт', text='текст',
+                              cooking_time=1, author=self.user)
+        url = f'/api/recipes/?author={self.author.id}&limit=2'
+        expected = [recipe['id'] for recipe in self.authorized_client.get(
+            url + '&limit=5').data['results']]
+
+        client = Client()
+        ids = []
+        next_url = url + '&pagination=cursor'
+        while next_url:
+            with self.assertNumQueries(3):
+                response = client.get(next_url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            next_url = response.data['next']
+        self.assertEqual(ids, expected)
+
+    def test_recipe_list_combined_filters(self):
+        """
+        Фильтры избранного, списка покупок, автора и тэгов работают вместе
+        и не дублируют рецепты.
+        """
+        self.create_recipes(3)
+        dinner = Tag.objects.create(name='ужин', slug='dinner')
+        first, second, third = Recipe.objects.filter(
+            author=self.author).order_by('id')
+        first.tags.add(dinner)
+        ShoppingCart.objects.create(user=self.user, recipe=first)
+        ShoppingCart.objects.create(user=self.user, recipe=second)
+        FavoriteRecipe.objects.filter(recipe=second).delete()
+        own = Recipe.objects.create(name='свой рецепт', text='текст',
+                                    cooking_time=1, author=self.user)
+        own.tags.add(self.tag)
+        FavoriteRecipe.objects.create(user=self.user, recipe=own)
+
+        response = self.authorized_client.get(
+            '/api/recipes/?is_favorited=1&is_in_shopping_cart=1'
+            f'&author={self.author.id}&tags=breakfast&tags=dinner')
+        self.assertEqual([recipe['id'] for recipe in response.data],
+                         [first.id])
+        response = self.authorized_client.get(
+            '/api/recipes/?is_favorited=1&tags=breakfast&tags=dinner')
+        self.assertEqual(sorted(recipe['id'] for recipe in response.data),
+                         [first.id, third.id, own.id])
+        response = Client().get('/api/recipes/?is_favorited=1')
+        self.assertEqual(response.data, [])
+
+
+class IngredientAutocompleteTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        for name in ('сахарная пудра', 'сахар', 'ванильный сахар', 'соль'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def setUp(self):
+        self.guest_client = Client()
+        ingredient_index.invalidate()
+
+    def test_autocomplete_prefix_before_contains(self):
+        """
+        Совпадения по началу названия выводятся раньше совпадений по
+        вхождению.
+        """
+        response = self.guest_client.get(
+            '/api/ingredients/autocomplete/?name=Сахар')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['name'] for item in response.data],
+                         ['сахар', 'сахарная пудра', 'ванильный сахар'])
+
+    def test_autocomplete_limit_and_invalidation(self):
+        """
+        Ограничение количества результатов и сброс индекса при добавлении
+        ингредиента.
+        """
+        response = self.guest_client.get(
+            '/api/ingredients/autocomplete/?name=сах&limit=1')
+        self.assertEqual(len(response.data), 1)
+        with on_commit_callbacks():
+            Ingredient.objects.create(name='сахарный сироп',
+                                      measurement_unit='мл')
+        response = self.guest_client.get(
+            '/api/ingredients/autocomplete/?name=сахарный')
+        self.assertEqual([item['name'] for item in response.data],
+                         ['сахарный сироп'])
+
+
+class ReferenceCacheTests(TestCase):
+    def setUp(self):
+        self.guest_client = Client()
+        caches['reference'].clear()
+        Tag.objects.create(name='обед', slug='lunch')
+
+    def test_tags_not_modified(self):
+        """
+        Повторный запрос с тем же ETag получает 304 без запросов к базе.
+        """
+        response = self.guest_client.get('/api/tags/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(0):
+            response = self.guest_client.get(
+                '/api/tags/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_tags_cache_invalidation(self):
+        """
+        Ответ берется из кэша до фиксации изменения тэгов.
+        """
+        self.assertEqual(len(self.guest_client.get('/api/tags/').data), 1)
+        with self.assertNumQueries(0):
+            response = self.guest_client.get('/api/tags/')
+        self.assertEqual(len(response.data), 1)
+        with on_commit_callbacks():
+            Tag.objects.create(name='ужин', slug='dinner')
+            self.assertEqual(
+                len(self.guest_client.get('/api/tags/').data), 1)
+        self.assertEqual(len(self.guest_client.get('/api/tags/').data), 2)
+
+    def test_version_counter(self):
+        """
+        Каждое изменение увеличивает номер версии, номера не повторяются
+        после вытеснения счетчика из кэша.
+        """
+        number, _ = get_version(Tag)
+        with on_commit_callbacks():
+            bump_version(Tag)
+            bump_version(Tag)
+            self.assertEqual(get_version(Tag)[0], number)
+        self.assertEqual(get_version(Tag)[0], number + 2)
+        caches['reference'].delete(version_key(Tag))
+        with mock.patch('recipes.cache.time.time',
+                        return_value=time.time() + 1):
+            increment_version(Tag)
+        self.assertGreater(get_version(Tag)[0], number + 2)
+
+    def test_ingredients_file_based_cache(self):
+        """
+        Кэширование справочника ингредиентов в файловом кэше.
+        """
+        with tempfile.TemporaryDirectory() as location:
+            backend = 'django.core.cache.backends.filebased.FileBasedCache'
+            reference = {'BACKEND': backend, 'LOCATION': location,
+                         'TIMEOUT': None}
+            with self.settings(CACHES={**settings.CACHES,
+                                       'reference': reference}):
+                Ingredient.objects.create(name='соль', measurement_unit='г')
+                response = self.guest_client.get('/api/ingredients/')
+                self.assertEqual(len(response.data), 1)
+                with self.assertNumQueries(0):
+                    cached = self.guest_client.get('/api/ingredients/')
+                self.assertEqual(cached.data, response.data)
+                self.assertEqual(cached['ETag'], response['ETag'])
+
+
+class RecipeCountersTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.user = User.objects.create(username="sergey",)
+        cls.recipe = Recipe.objects.create(name='первый', text='текст',
+                                           cooking_time=1, author=cls.user)
+        cls.popular = Recipe.objects.create(name='второй', text='текст',
+                                            cooking_time=1, author=cls.user)
+
+    def setUp(self):
+        self.authorized_client = APIClient()
+        self.authorized_client.force_authenticate(self.user)
+
+    def test_favorite_and_cart_counters(self):
+        """
+        Счетчики избранного и списков покупок меняются при добавлении и
+        удалении рецепта.
+        """
+        url = f'/api/recipes/{self.recipe.id}/'
+        self.authorized_client.get(url + 'favorite/')
+        self.authorized_client.get(url + 'shopping_cart/')
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertEqual(self.recipe.in_carts_count, 1)
+        self.authorized_client.delete(url + 'favorite/')
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+        self.assertEqual(self.recipe.in_carts_count, 1)
+
+    def test_toggle_queries(self):
+        """
+        Сама связь добавляется одним INSERT в точке сохранения и удаляется
+        одним DELETE (после выборки удаляемой строки для сигналов), ответ
+        строится без повторного запроса рецепта. Остальные запросы:
+        поиск рецепта, блокировка пользователя, счетчик, задача пересчета
+        похожих рецептов после фиксации, для списка покупок - ингредиенты
+        рецепта и изменение позиций без точек сохранения. Транзакция
+        запроса в тесте - тоже точка сохранения, это еще два запроса.
+        """
+        RecipeIngredient.objects.create(
+            recipe=self.recipe, amount=5,
+            ingredient=Ingredient.objects.create(name='соль',
+                                                 measurement_unit='г'))
+        url = f'/api/recipes/{self.recipe.id}/'
+        for action, add, remove in (('favorite/', 9, 7),
+                                    ('shopping_cart/', 12, 10)):
+            with self.subTest(action=action):
+                with self.assertNumQueries(add), on_commit_callbacks():
+                    response = self.authorized_client.post(url + action)
+                self.assertEqual(response.status_code,
+                                 status.HTTP_201_CREATED)
+                self.assertEqual(response.data['name'], self.recipe.name)
+                with self.assertNumQueries(remove), on_commit_callbacks():
+                    response = self.authorized_client.delete(url + action)
+                self.assertEqual(response.status_code,
+                                 status.HTTP_204_NO_CONTENT)
+
+    def test_popular_ordering(self):
+        """
+        Сортировка рецептов по популярности.
+        """
+        FavoriteRecipe.objects.create(user=self.user, recipe=self.popular)
+        response = self.authorized_client.get('/api/recipes/?ordering=popular')
+        self.assertEqual([recipe['id'] for recipe in response.data],
+                         [self.popular.id, self.recipe.id])
+        response = self.authorized_client.get(
+            '/api/recipes/?ordering=popular&pagination=cursor&limit=1')
+        self.assertEqual(response.data['results'][0]['id'], self.popular.id)
+
+    def test_popular_ordering_many_ties(self):
+        """
+        Сортировка по популярности проходит все рецепты без повторов,
+        даже если у больше чем 1000 рецептов одинаковый счетчик.
+        """
+        Recipe.objects.bulk_create(
+            Recipe(name=f'рецепт {number}', text='текст', cooking_time=1,
+                   author=self.user)
+            for number in range(1200))
+        FavoriteRecipe.objects.create(user=self.user, recipe=self.popular)
+        ids = []
+        url = '/api/recipes/?ordering=popular&pagination=cursor&limit=100'
+        for _ in range(20):
+            response = self.authorized_client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+            if url is None:
+                break
+        self.assertEqual(len(ids), Recipe.objects.count())
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(ids[0], self.popular.id)
+
+    def test_rebuild_recipe_counters(self):
+        """
+        Пересчет счетчиков рецептов командой.
+        """
+        FavoriteRecipe.objects.create(user=self.user, recipe=self.popular)
+        ShoppingCart.objects.create(user=self.user, recipe=self.popular)
+        Recipe.objects.update(favorites_count=7, in_carts_count=7)
+        call_command('rebuild_recipe_counters', stdout=StringIO())
+        self.assertEqual(
+            list(Recipe.objects.order_by('id').values_list(
+                'favorites_count', 'in_carts_count')),
+            [(0, 0), (1, 1)])
+
+    def test_batch_shopping_cart(self):
+        """
+        Пакетное добавление и удаление рецептов в списке покупок с
+        результатом по каждому рецепту и изменением счетчиков.
+        """
+        url = '/api/recipes/shopping_cart/'
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipe)
+        response = self.authorized_client.post(
+            url, {'ids': [self.recipe.id, self.popular.id, 100,
+                          self.popular.id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [
+            {'id': self.recipe.id, 'status': 'exists'},
+            {'id': self.popular.id, 'status': 'added'},
+            {'id': 100, 'status': 'not_found'},
+        ])
+        self.assertEqual(ShoppingCart.objects.count(), 2)
+        self.assertEqual(
+            list(Recipe.objects.order_by('id').values_list(
+                'in_carts_count', flat=True)), [1, 1])
+
+        response = self.authorized_client.delete(
+            url, {'ids': [self.popular.id]}, format='json')
+        self.assertEqual(response.data['results'], [
+            {'id': self.popular.id, 'status': 'removed'},
+        ])
+        response = self.authorized_client.delete(
+            url, {'ids': [self.popular.id]}, format='json')
+        self.assertEqual(response.data['results'], [
+            {'id': self.popular.id, 'status': 'missing'},
+        ])
+        self.popular.refresh_from_db()
+        self.assertEqual(self.popular.in_carts_count, 0)
+
+    def test_batch_shopping_cart_retry(self):
+        """
+        Повтор того же пакета не меняет счетчики и список покупок, а
+        строка пользователя блокируется перед чтением списка покупок.
+        """
+        salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        RecipeIngredient.objects.create(recipe=self.recipe, ingredient=salt,
+                                        amount=5)
+        url = '/api/recipes/shopping_cart/'
+        with mock.patch('recipes.views.lock_user',
+                        wraps=lock_user) as lock:
+            self.authorized_client.post(url, {'ids': [self.recipe.id]},
+                                        format='json')
+        lock.assert_called_once_with(self.user.pk)
+        response = self.authorized_client.post(
+            url, {'ids': [self.recipe.id]}, format='json')
+        self.assertEqual(response.data['results'], [
+            {'id': self.recipe.id, 'status': 'exists'},
+        ])
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.in_carts_count, 1)
+        self.assertEqual(
+            list(ShoppingListItem.objects.values_list('amount', flat=True)),
+            [5])
+
+    def test_batch_remove_from_shopping_cart(self):
+        """
+        Пакетное удаление не собирает объекты и не отправляет сигналы:
+        счетчики и список покупок изменяются одним запросом на все
+        рецепты.
+        """
+        salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        for recipe in (self.recipe, self.popular):
+            RecipeIngredient.objects.create(recipe=recipe, ingredient=salt,
+                                            amount=5)
+        url = '/api/recipes/shopping_cart/'
+        ids = [self.recipe.id, self.popular.id]
+        self.authorized_client.post(url, {'ids': ids}, format='json')
+        with self.assertNumQueries(11), on_commit_callbacks():
+            response = self.authorized_client.delete(url, {'ids': ids},
+                                                     format='json')
+        self.assertEqual(response.data['results'], [
+            {'id': pk, 'status': 'removed'} for pk in ids])
+        self.assertFalse(ShoppingCart.objects.exists())
+        self.assertEqual(
+            list(Recipe.objects.values_list('in_carts_count', flat=True)),
+            [0, 0])
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+    def test_batch_validation(self):
+        """
+        Пустой или слишком длинный список id отклоняется.
+        """
+        for ids in ([], list(range(1, 102)), ['x']):
+            response = self.authorized_client.post(
+                '/api/recipes/favorite/', {'ids': ids}, format='json')
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(FavoriteRecipe.objects.exists())
+
+
+@override_settings(SERVER_TIMING_SAMPLE_RATE=1.0)
+class ServerTimingTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.user = User.objects.create(username="sergey",)
+        for number in range(3):
+            User.objects.create(username=f'author{number}')
+
+    def setUp(self):
+        self.authorized_client = APIClient()
+        self.authorized_client.force_authenticate(self.user)
+
+    def test_server_timing_header(self):
+        """
+        Заголовок Server-Timing и строка лога с вьюсетом и действием.
+        """
+        with self.assertLogs('foodgram.performance', 'INFO') as logs:
+            response = self.authorized_client.get('/api/recipes/')
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('render;dur=', response['Server-Timing'])
+        self.assertIn('view=RecipeViewSet.list', logs.output[0])
+
+    def test_server_timing_phases(self):
+        """
+        Фазы Server-Timing идут в постоянном порядке, время без базы и
+        рендеринга входит в фазу app.
+        """
+        def get_response(request):
+            User.objects.exists()
+            return HttpResponse()
+
+        response = ServerTimingMiddleware(get_response)(
+            RequestFactory().get('/phases/'))
+        phases = re.findall(r'(\w+);dur=([\d.]+)', response['Server-Timing'])
+        self.assertEqual([name for name, _ in phases],
+                         ['db', 'render', 'app', 'total'])
+        self.assertIn('desc="1 queries, 0 duplicated"',
+                      response['Server-Timing'])
+
+    def test_duplicated_queries_logged(self):
+        """
+        Повторяющиеся запросы с разными параметрами попадают в лог.
+        """
+        def get_response(request):
+            for pk in range(3):
+                User.objects.filter(pk=pk).exists()
+            User.objects.exists()
+            return HttpResponse()
+
+        middleware = ServerTimingMiddleware(get_response)
+        with self.assertLogs('foodgram.performance', 'WARNING') as logs:
+            middleware(RequestFactory().get('/duplicated/'))
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('view=/duplicated/ duplicated_query count=3',
+                      logs.output[0])
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=0)
+    def test_server_timing_sampling(self):
+        """
+        Запросы вне выборки не замеряются.
+        """
+        response = self.authorized_client.get('/api/recipes/')
+        self.assertNotIn('Server-Timing', response)
+
+
+class RecipeImageTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.user = User.objects.create(username="sergey",)
+        cls.tag = Tag.objects.create(name='обед', slug='lunch')
+        cls.ingredient = Ingredient.objects.create(name='соль',
+                                                   measurement_unit='г')
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        media = self.settings(MEDIA_ROOT=self.media_root.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.authorized_client = APIClient()
+        self.authorized_client.force_authenticate(self.user)
+
+    def encode_image(self, size=(3000, 1000)):
+        buffer = BytesIO()
+        info = PngImagePlugin.PngInfo()
+        info.add_text('Author', 'secret')
+        Image.new('RGB', size, '#336699').save(buffer, format='PNG',
+                                               pnginfo=info)
+        content = base64.b64encode(buffer.getvalue()).decode()
+        return f'data:image/png;base64,{content}'
+
+    def create_recipe(self, image=None, name='суп'):
+        data = {
+            'tags': [self.tag.id],
+            'ingredients': [{'id': self.ingredient.id, 'amount': 1}],
+            'name': name,
+            'image': image or self.encode_image(),
+            'text': 'текст',
+            'cooking_time': 10,
+        }
+        response = self.authorized_client.post('/api/recipes/', data,
+                                               format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(response.data['image'].endswith(
+            settings.RECIPE_IMAGE_PLACEHOLDER))
+        with on_commit_callbacks():
+            run_pending()
+        return Recipe.objects.get(id=response.data['id'])
+
+    def test_recipe_image_variants(self):
+        """
+        Изображение нормализуется, получает имя из хэша содержимого и
+        уменьшенные WebP варианты.
+        """
+        recipe = self.create_recipe()
+        self.assertRegex(recipe.image.name,
+                         r'^recipes/images/[0-9a-f]{64}\.jpg$')
+        with Image.open(recipe.image.path) as image:
+            self.assertEqual(image.size, (1920, 640))
+            self.assertNotIn('Author', image.info)
+        for field, size in (('image_small', (240, 240)),
+                            ('image_medium', (640, 480))):
+            with Image.open(getattr(recipe, field).path) as image:
+                self.assertEqual(image.format, 'WEBP')
+                self.assertEqual(image.size, size)
+        uploads = os.listdir(os.path.join(self.media_root.name,
+                                          'recipes', 'images'))
+        self.assertEqual(uploads, [os.path.basename(recipe.image.name)])
+
+    def test_recipe_image_variant_per_context(self):
+        """
+        В списке рецептов отдается изображение для карточки, в избранном -
+        миниатюра, в рецепте - оригинал.
+        """
+        recipe = self.create_recipe()
+        response = self.authorized_client.get('/api/recipes/')
+        self.assertTrue(response.data[0]['image'].endswith(
+            recipe.image_medium.url))
+        response = self.authorized_client.get(f'/api/recipes/{recipe.id}/')
+        self.assertTrue(response.data['image'].endswith(recipe.image.url))
+        response = self.authorized_client.get(
+            f'/api/recipes/{recipe.id}/favorite/')
+        self.assertTrue(response.data['image'].endswith(
+            recipe.image_small.url))
+
+    def test_recipe_image_info(self):
+        """
+        Размеры варианта и основной цвет отдаются вместе с адресом
+        изображения, пока изображение обрабатывается - null.
+        """
+        recipe = self.create_recipe()
+        response = self.authorized_client.get('/api/recipes/')
+        self.assertEqual(response.data[0]['image_info'],
+                         {'width': 640, 'height': 480, 'color': '#336699'})
+        response = self.authorized_client.get(f'/api/recipes/{recipe.id}/')
+        self.assertEqual(response.data['image_info'],
+                         {'width': 1920, 'height': 640, 'color': '#336699'})
+        response = self.authorized_client.get(
+            f'/api/recipes/{recipe.id}/shopping_cart/')
+        self.assertEqual(response.data['image_info']['width'], 240)
+
+        Recipe.objects.filter(pk=recipe.pk).update(
+            image_status=Recipe.IMAGE_PENDING)
+        response = self.authorized_client.get(f'/api/recipes/{recipe.id}/')
+        self.assertIsNone(response.data['image_info'])
+
+    def test_recipe_image_replace(self):
+        """
+        Старое изображение удаляется фоновой задачей после замены.
+        """
+        recipe = self.create_recipe()
+        old_path = recipe.image.path
+        response = self.authorized_client.patch(
+            f'/api/recipes/{recipe.id}/',
+            {'tags': [self.tag.id],
+             'ingredients': [{'id': self.ingredient.id, 'amount': 2}],
+             'image': self.encode_image(size=(100, 100))},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(os.path.exists(old_path))
+        with on_commit_callbacks():
+            run_pending()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_status, Recipe.IMAGE_READY)
+        self.assertFalse(os.path.exists(old_path))
+        with Image.open(recipe.image.path) as image:
+            self.assertEqual(image.size, (100, 100))
+
+    def test_recipe_image_deduplication(self):
+        """
+        Одинаковые загрузки хранятся одним файлом, который удаляется после
+        удаления последнего ссылающегося рецепта.
+        """
+        image = self.encode_image(size=(100, 100))
+        first = self.create_recipe(image)
+        second = self.create_recipe(image, name='борщ')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(
+            StoredImage.objects.get(name=first.image.name).refs, 2)
+        self.assertEqual(StoredImage.objects.count(), 1)
+        uploads = os.listdir(os.path.join(self.media_root.name,
+                                          'recipes', 'images'))
+        self.assertEqual(uploads, [os.path.basename(first.image.name)])
+
+        self.authorized_client.delete(f'/api/recipes/{first.id}/')
+        with on_commit_callbacks():
+            run_pending()
+        self.assertTrue(os.path.exists(second.image.path))
+        self.assertTrue(os.path.exists(second.image_small.path))
+        self.assertEqual(
+            StoredImage.objects.get(name=second.image.name).refs, 1)
+
+        self.authorized_client.delete(f'/api/recipes/{second.id}/')
+        with on_commit_callbacks():
+            run_pending()
+        self.assertFalse(os.path.exists(second.image.path))
+        self.assertFalse(os.path.exists(second.image_small.path))
+        self.assertFalse(StoredImage.objects.exists())
+
+    def test_release_after_commit(self):
+        """
+        Файлы удаляются только после фиксации транзакции, в которой
+        удалена последняя ссылка.
+        """
+        recipe = self.create_recipe()
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                release(recipe.image.name)
+                raise ValueError
+        self.assertTrue(os.path.exists(recipe.image.path))
+        with on_commit_callbacks():
+            release(recipe.image.name)
+            self.assertTrue(os.path.exists(recipe.image.path))
+        self.assertFalse(os.path.exists(recipe.image.path))
+        self.assertFalse(os.path.exists(recipe.image_small.path))
+
+    def test_recipe_image_invalid(self):
+        """
+        Данные, не являющиеся изображением, отмечаются ошибкой обработки.
+        """
+        content = base64.b64encode(b'not an image').decode()
+        recipe = self.create_recipe(f'data:image/png;base64,{content}')
+        self.assertEqual(recipe.image_status, Recipe.IMAGE_FAILED)
+        self.assertEqual(Job.objects.get(
+            name='process_recipe_image').status, Job.DONE)
+
+    def test_recipe_image_too_large(self):
+        """
+        Изображение больше MAX_PIXELS не обрабатывается.
+        """
+        with mock.patch('recipes.images.MAX_PIXELS', 1000):
+            recipe = self.create_recipe()
+        self.assertEqual(recipe.image_status, Recipe.IMAGE_FAILED)
+
+    def test_recipe_image_processed_twice(self):
+        """
+        Вторая обработка того же загруженного изображения, например после
+        истечения аренды задачи, не меняет результат и ссылки на файлы.
+        """
+        with mock.patch('recipes.serializers.enqueue'):
+            recipe = self.create_recipe()
+        first, second = (Recipe.objects.get(pk=recipe.pk) for _ in range(2))
+        process_recipe_image(first)
+        process_recipe_image(second)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image.name, first.image.name)
+        self.assertEqual(recipe.image_status, Recipe.IMAGE_READY)
+        self.assertEqual(StoredImage.objects.get(name=recipe.image.name).refs,
+                         1)
+
+    def test_recipe_image_processing_failed(self):
+        """
+        Изображение отмечается ошибкой обработки, когда все попытки
+        задачи завершились ошибкой.
+        """
+        with mock.patch('recipes.tasks.process_recipe_image',
+                        side_effect=OSError):
+            recipe = self.create_recipe()
+            self.assertEqual(recipe.image_status, Recipe.IMAGE_PENDING)
+            for _ in range(MAX_ATTEMPTS - 1):
+                Job.objects.update(run_after=timezone.now())
+                run_pending()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_status, Recipe.IMAGE_FAILED)
+        self.assertEqual(Job.objects.get(
+            name='process_recipe_image').status, Job.FAILED)
+
+    def test_collect_orphan_media(self):
+        """
+        Файлы без ссылок удаляются или переносятся в карантин, файлы
+        рецептов и недавние загрузки остаются.
+        """
+        recipe = self.create_recipe()
+        images = os.path.join(self.media_root.name, 'recipes', 'images')
+        orphan = os.path.join(images, 'orphan.jpg')
+        fresh = os.path.join(images, 'fresh.jpg')
+        for path in (orphan, fresh):
+            with open(path, 'wb') as file:
+                file.write(b'data')
+        os.utime(orphan, (0, 0))
+
+        out = StringIO()
+        call_command('collect_orphan_media', '--dry-run', stdout=out)
+        self.assertIn('recipes/images/orphan.jpg 4', out.getvalue())
+        self.assertNotIn('fresh.jpg', out.getvalue())
+        self.assertTrue(os.path.exists(orphan))
+
+        quarantine = os.path.join(self.media_root.name, 'quarantine')
+        call_command('collect_orphan_media', '--quarantine', quarantine,
+                     stdout=StringIO())
+        self.assertFalse(os.path.exists(orphan))
+        self.assertTrue(os.path.exists(
+            os.path.join(quarantine, 'recipes', 'images', 'orphan.jpg')))
+        self.assertTrue(os.path.exists(fresh))
+        for field in ('image', 'image_small', 'image_medium'):
+            self.assertTrue(os.path.exists(getattr(recipe, field).path))
+
+        call_command('collect_orphan_media', '--min-age', '0',
+                     stdout=StringIO())
+        self.assertFalse(os.path.exists(fresh))
+        self.assertTrue(os.path.exists(recipe.image.path))
+
+    def test_collect_orphan_media_schedule(self):
+        """
+        Регулярная сборка планируется один раз и перепланирует себя.
+        """
+        call_command('collect_orphan_media', '--schedule', stdout=StringIO())
+        call_command('collect_orphan_media', '--schedule', stdout=StringIO())
+        self.assertEqual(Job.objects.filter(status=Job.PENDING).count(), 1)
+        run_pending()
+        job = Job.objects.get(status=Job.PENDING)
+        self.assertGreater(job.run_after, Job.objects.get(
+            status=Job.DONE).run_after)
+
+
+class RecipeSearchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.user = User.objects.create(username="sergey",)
+        cls.soup = Recipe.objects.create(
+            name='Борщ', text='Свекла, капуста и томатная паста.',
+            cooking_time=60, author=cls.user)
+        cls.salad = Recipe.objects.create(
+            name='Винегрет', text='Отварная свекла, огурцы и немного '
+                                  'квашеной капусты, как в борще.',
+            cooking_time=20, author=cls.user)
+        cls.cake = Recipe.objects.create(
+            name='Пирог', text='Мука, яйца и сахар.',
+            cooking_time=40, author=cls.user)
+
+    def setUp(self):
+        self.guest_client = APIClient()
+        recipe_index.invalidate()
+
+    def search(self, query):
+        response = self.guest_client.get('/api/recipes/',
+                                         {'search': query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_search_ranking(self):
+        """
+        Совпадение в названии выше совпадения в описании, все слова
+        запроса должны найтись.
+        """
+        results = self.search('борщ')
+        self.assertEqual([recipe['id'] for recipe in results],
+                         [self.soup.id, self.salad.id])
+        results = self.search('свекла огурцы')
+        self.assertEqual([recipe['id'] for recipe in results],
+                         [self.salad.id])
+        self.assertEqual(self.search('ананас'), [])
+
+    def test_search_snippet(self):
+        """
+        В результатах поиска есть фрагмент описания с выделенными словами.
+        """
+        results = self.search('огурцы')
+        self.assertIn('<b>огурцы</b>', results[0]['search_snippet'])
+        response = self.guest_client.get('/api/recipes/')
+        self.assertNotIn('search_snippet', response.data[0])
+
+    def test_search_snippet_escaped(self):
+        """
+        Разметка из описания рецепта экранируется во фрагменте.
+        """
+        with on_commit_callbacks():
+            Recipe.objects.create(
+                name='компот', text='ягоды <script>alert(1)</script> вода',
+                cooking_time=10, author=self.user)
+        snippet = self.search('ягоды')[0]['search_snippet']
+        self.assertNotIn('<script>', snippet)
+        self.assertIn('&lt;script&gt;', snippet)
+        self.assertIn('<b>ягоды</b>', snippet)
+
+    def test_search_headline_escaped(self):
+        """
+        Фрагмент ts_headline экранируется, маркеры совпадений заменяются
+        тегами.
+        """
+        headline = f'<script>{START_SEL}ягоды{STOP_SEL}</script>'
+        with mock.patch('recipes.search.uses_search_vector',
+                        return_value=True):
+            self.assertEqual(snippet_html(headline),
+                             '&lt;script&gt;<b>ягоды</b>&lt;/script&gt;')
+
+    def test_search_index_invalidation(self):
+        """
+        Новый или измененный рецепт сразу находится поиском.
+        """
+        self.assertEqual(self.search('шарлотка'), [])
+        self.cake.name = 'Шарлотка'
+        with on_commit_callbacks():
+            self.cake.save()
+        self.assertEqual([recipe['id'] for recipe in self.search('шарл')],
+                         [self.cake.id])
+
+
+class RecipeMatchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.user = User.objects.create(username="sergey",)
+        cls.beet, cls.cabbage, cls.potato, cls.flour = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('свекла', 'капуста', 'картофель', 'мука'))
+        cls.soup = cls.create_recipe('борщ',
+                                     cls.beet, cls.cabbage, cls.potato)
+        cls.salad = cls.create_recipe('салат', cls.beet, cls.cabbage)
+        cls.cake = cls.create_recipe('пирог', cls.flour)
+
+    @classmethod
+    def create_recipe(cls, name, *ingredients):
+        recipe = Recipe.objects.create(name=name, text='текст',
+                                       cooking_time=10, author=cls.user)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=1)
+            for ingredient in ingredients)
+        return recipe
+
+    def setUp(self):
+        self.guest_client = APIClient()
+
+    def test_match_coverage(self):
+        """
+        Рецепты упорядочены по доле имеющихся ингредиентов, недостающие
+        перечислены, рецепты без совпадений не попадают в ответ.
+        """
+        ids = f'{self.beet.id},{self.cabbage.id}'
+        with self.assertNumQueries(5):
+            response = self.guest_client.get('/api/recipes/match/',
+                                             {'ingredients': ids})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 2)
+        salad, soup = response.data['results']
+        self.assertEqual(salad['id'], self.salad.id)
+        self.assertEqual((salad['ingredients_matched'],
+                          salad['ingredients_total']), (2, 2))
+        self.assertEqual(salad['missing_ingredients'], [])
+        self.assertEqual(soup['id'], self.soup.id)
+        self.assertEqual((soup['ingredients_matched'],
+                          soup['ingredients_total']), (2, 3))
+        self.assertEqual([item['id'] for item in soup['missing_ingredients']],
+                         [self.potato.id])
+
+    def test_match_invalid_ingredients(self):
+        """
+        Без ингредиентов или с некорректными id возвращается ошибка.
+        """
+        for params in ({}, {'ingredients': 'abc'}):
+            response = self.guest_client.get('/api/recipes/match/', params)
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeSimilarityTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.users = [User.objects.create(username=f'user{number}')
+                     for number in range(3)]
+        ingredients = {name: Ingredient.objects.create(name=name,
+                                                       measurement_unit='г')
+                       for name in ('свекла', 'капуста', 'мука', 'яйца')}
+        cls.soup = cls.create_recipe('борщ', ingredients['свекла'],
+                                     ingredients['капуста'])
+        cls.salad = cls.create_recipe('салат', ingredients['свекла'])
+        cls.cake = cls.create_recipe('пирог', ingredients['мука'])
+        cls.pie = cls.create_recipe('пирожки', ingredients['капуста'],
+                                    ingredients['яйца'])
+        for number in range(6):
+            cls.create_recipe(f'рецепт {number}', Ingredient.objects.create(
+                name=f'ингредиент {number}', measurement_unit='г'))
+        for user in cls.users[:2]:
+            FavoriteRecipe.objects.create(user=user, recipe=cls.soup)
+            FavoriteRecipe.objects.create(user=user, recipe=cls.salad)
+        ShoppingCart.objects.create(user=cls.users[2], recipe=cls.soup)
+        ShoppingCart.objects.create(user=cls.users[2], recipe=cls.cake)
+
+    @classmethod
+    def create_recipe(cls, name, *ingredients):
+        recipe = Recipe.objects.create(name=name, text='текст',
+                                       cooking_time=10, author=cls.users[0])
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=1)
+            for ingredient in ingredients)
+        return recipe
+
+    def setUp(self):
+        self.guest_client = APIClient()
+
+    def related(self, recipe):
+        return list(RecipeSimilarity.objects.filter(
+            recipe=recipe).order_by('-score').values_list(
+                'similar', flat=True))
+
+    def test_related_recipes(self):
+        """
+        Похожие рецепты рассчитываются командой и отдаются по убыванию
+        сходства одним запросом к таблице сходства.
+        """
+        call_command('compute_recipe_similarity', stdout=StringIO())
+        self.assertEqual(self.related(self.soup),
+                         [self.salad.id, self.cake.id, self.pie.id])
+        with self.assertNumQueries(5):
+            response = self.guest_client.get(
+                f'/api/recipes/{self.soup.id}/related/')
+        self.assertEqual([recipe['id'] for recipe in response.data],
+                         [self.salad.id, self.cake.id, self.pie.id])
+
+    def test_rebuild_matches_incremental_update(self):
+        """
+        Полный пересчет и пересчет одного рецепта дают одинаковый результат.
+        """
+        call_command('compute_recipe_similarity', stdout=StringIO())
+        for recipe in Recipe.objects.all():
+            rows = dict(RecipeSimilarity.objects.filter(
+                recipe=recipe).values_list('similar', 'score'))
+            best = {other: score
+                    for score, other in top(recipe_scores(recipe.id))}
+            self.assertEqual(rows.keys(), best.keys())
+            for other, score in rows.items():
+                self.assertAlmostEqual(score, best[other])
+
+    def test_related_incremental_update(self):
+        """
+        Новое добавление в избранное планирует один отложенный пересчет,
+        пересчет обновляет списки обоих рецептов.
+        """
+        call_command('compute_recipe_similarity', stdout=StringIO())
+        Job.objects.all().delete()
+        with on_commit_callbacks():
+            FavoriteRecipe.objects.create(user=self.users[0],
+                                          recipe=self.cake)
+            FavoriteRecipe.objects.create(user=self.users[1],
+                                          recipe=self.cake)
+        self.assertEqual(Job.objects.filter(
+            name='update_recipe_similarity').count(), 1)
+        self.assertNotIn(self.cake.id, self.related(self.salad))
+        update(self.cake.id)
+        self.assertEqual(self.related(self.cake)[0], self.soup.id)
+        self.assertIn(self.cake.id, self.related(self.salad))
+
+
+class ShoppingListTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.user = User.objects.create(username="sergey",)
+        cls.flour = Ingredient.objects.create(name='мука',
+                                              measurement_unit='г')
+        cls.eggs = Ingredient.objects.create(name='яйца',
+                                             measurement_unit='шт')
+        cls.cake = cls.create_recipe('пирог', (cls.flour, 200),
+                                     (cls.eggs, 2))
+        cls.pancakes = cls.create_recipe('блины', (cls.flour, 100))
+
+    @classmethod
+    def create_recipe(cls, name, *ingredients):
+        recipe = Recipe.objects.create(name=name, text='текст',
+                                       cooking_time=10, author=cls.user)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                             amount=amount)
+            for ingredient, amount in ingredients)
+        return recipe
+
+    def setUp(self):
+        self.authorized_client = APIClient()
+        self.authorized_client.force_authenticate(self.user)
+
+    def shopping_list(self):
+        response = self.authorized_client.get('/api/recipes/shopping_list/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(item['name'], item['amount'], item['checked'])
+                for item in response.data]
+
+    def test_shopping_list_follows_cart(self):
+        """
+        Суммы ингредиентов меняются при добавлении и удалении рецептов в
+        списке покупок, в том числе пакетном.
+        """
+        self.authorized_client.get(
+            f'/api/recipes/{self.cake.id}/shopping_cart/')
+        self.assertEqual(self.shopping_list(),
+                         [('мука', 200, False), ('яйца', 2, False)])
+        self.authorized_client.post(
+            '/api/recipes/shopping_cart/', {'ids': [self.pancakes.id]},
+            format='json')
+        self.assertEqual(self.shopping_list(),
+                         [('мука', 300, False), ('яйца', 2, False)])
+        self.authorized_client.delete(
+            f'/api/recipes/{self.cake.id}/shopping_cart/')
+        self.assertEqual(self.shopping_list(), [('мука', 100, False)])
+        self.pancakes.delete()
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+    def test_shopping_list_follows_recipe_ingredients(self):
+        """
+        Изменение ингредиентов рецепта переносится в списки покупок.
+        """
+        ShoppingCart.objects.create(user=self.user, recipe=self.cake)
+        RecipeSerializer().update_recipe_ingredient(
+            [{'id': self.flour.id, 'amount': 250}], self.cake)
+        self.assertEqual(self.shopping_list(), [('мука', 250, False)])
+
+    def test_shopping_list_follows_ingredient_edits(self):
+        """
+        Правка ингредиентов рецепта по одному, например в админке,
+        переносится в списки покупок изменениями без пересчета.
+        """
+        ShoppingCart.objects.create(user=self.user, recipe=self.cake)
+        flour = RecipeIngredient.objects.get(recipe=self.cake,
+                                             ingredient=self.flour)
+        with recipes_changes([self.cake.id]):
+            flour.amount = 300
+            flour.save()
+            RecipeIngredient.objects.get(recipe=self.cake,
+                                         ingredient=self.eggs).delete()
+        self.assertEqual(self.shopping_list(), [('мука', 300, False)])
+        with recipes_changes([self.cake.id]):
+            RecipeIngredient.objects.create(recipe=self.cake,
+                                            ingredient=self.eggs, amount=3)
+        self.assertEqual(self.shopping_list(),
+                         [('мука', 300, False), ('яйца', 3, False)])
+
+    def test_shopping_list_checked(self):
+        """
+        Отметка о покупке снимается, когда ингредиента становится больше.
+        """
+        ShoppingCart.objects.create(user=self.user, recipe=self.cake)
+        response = self.authorized_client.patch(
+            '/api/recipes/shopping_list/',
+            {'ids': [self.flour.id, self.eggs.id], 'checked': True},
+            format='json')
+        self.assertTrue(all(item['checked'] for item in response.data))
+        ShoppingCart.objects.create(user=self.user, recipe=self.pancakes)
+        self.assertEqual(self.shopping_list(),
+                         [('мука', 300, False), ('яйца', 2, True)])
+
+    def test_rebuild_shopping_lists(self):
+        """
+        Команда пересчета исправляет расхождения и сохраняет отметки.
+        """
+        ShoppingCart.objects.create(user=self.user, recipe=self.cake)
+        ShoppingListItem.objects.filter(ingredient=self.flour).update(
+            amount=7)
+        ShoppingListItem.objects.filter(ingredient=self.eggs).update(
+            checked=True)
+        ShoppingListItem.objects.create(user=self.user,
+                                        ingredient=Ingredient.objects.create(
+                                            name='соль',
+                                            measurement_unit='г'),
+                                        amount=1)
+        out = StringIO()
+        call_command('rebuild_shopping_lists', stdout=out)
+        self.assertIn('2', out.getvalue())
+        self.assertEqual(self.shopping_list(),
+                         [('мука', 200, False), ('яйца', 2, True)])
+
+    def download(self, export_format):
+        response = self.authorized_client.get(
+            '/api/recipes/download_shopping_cart/',
+            {'format': export_format})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Disposition'],
+                         f'attachment; filename=buy_list.{export_format}')
+        return b''.join(response.streaming_content)
+
+    def test_download_formats(self):
+        """
+        Список покупок скачивается в форматах csv, json и pdf.
+        """
+        ShoppingCart.objects.create(user=self.user, recipe=self.cake)
+        self.assertEqual(
+            self.download('csv').decode('utf-8-sig').splitlines(),
+            ['Ингредиент,Количество,Единица измерения', 'мука,200,г',
+             'яйца,2,шт'])
+        self.assertEqual(json.loads(self.download('json')), [
+            {'name': 'мука', 'amount': 200, 'measurement_unit': 'г'},
+            {'name': 'яйца', 'amount': 2, 'measurement_unit': 'шт'},
+        ])
+        self.assertTrue(self.download('pdf').startswith(b'%PDF'))
+        response = self.authorized_client.get(
+            '/api/recipes/download_shopping_cart/', {'format': 'doc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_download_cached(self):
+        """
+        Готовый файл кэшируется по содержимому списка и сбрасывается при
+        его изменении.
+        """
+        cache.clear()
+        ShoppingCart.objects.create(user=self.user, recipe=self.cake)
+        content = self.download('pdf')
+        key = cache_key('pdf', [['мука', 200, 'г'], ['яйца', 2, 'шт']])
+        self.assertEqual(cache.get(key), content)
+        self.assertEqual(self.download('pdf'), content)
+        ShoppingCart.objects.create(user=self.user, recipe=self.pancakes)
+        self.assertNotEqual(self.download('pdf'), content)
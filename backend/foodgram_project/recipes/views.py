@@ -1,21 +1,35 @@
-from django.http import HttpResponse
+from django.db import transaction
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters import rest_framework as filters
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from users.models import lock_user
+from users.serializers import BatchSerializer
 
+from .autocomplete import AUTOCOMPLETE_LIMIT, ingredient_index
+from .cache import VersionedCacheMixin
+from .exports import EXPORT_FORMATS, DownloadNegotiation, export
 from .filters import IngredientFilter, RecipeFilter
 from .models import (FavoriteRecipe, Ingredient, Recipe, RecipeIngredient,
-                     ShoppingCart, Tag)
+                     RecipeSimilarity, ShoppingCart, ShoppingListItem, Tag)
+from .pagination import RecipeMatchPagination, RecipePagination
 from .permissions import IsOwnerOrReadOnly
 from .serializers import (FavoriteRecipeSerializer, IngredientSerializer,
-                          RecipeGetSerializer, RecipeSerializer,
-                          ShoppingCartSerializer, TagSerializer)
+                          RecipeGetSerializer, RecipeListSerializer,
+                          RecipeMatchSerializer, RecipeSerializer,
+                          ShoppingCartSerializer, ShoppingListCheckSerializer,
+                          ShoppingListItemSerializer, TagSerializer)
+from .shopping_list import add_recipes, remove_recipes
+from .tasks import schedule_similarity_update
 
+MATCH_MAX_INGREDIENTS = 100
+NON_FIELD_ERRORS_KEY = api_settings.NON_FIELD_ERRORS_KEY
 
-class TagViewSet(viewsets.ModelViewSet):
+
+class TagViewSet(VersionedCacheMixin, viewsets.ModelViewSet):
     """
     Вьюсет модели Тэг.
     """
@@ -23,7 +37,7 @@ class TagViewSet(viewsets.ModelViewSet):
     serializer_class = TagSerializer
 
 
-class IngredientViewSet(viewsets.ModelViewSet):
+class IngredientViewSet(VersionedCacheMixin, viewsets.ModelViewSet):
     """
     Вьюсет модели Ингредиент с поиском по началу поля Нейм.
     """
@@ -32,6 +46,21 @@ class IngredientViewSet(viewsets.ModelViewSet):
     filter_backends = (filters.DjangoFilterBackend,)
     filter_class = IngredientFilter
 
+    @action(detail=False)
+    def autocomplete(self, request):
+        """
+        Автодополнение названия ингредиента: сначала совпадения по началу
+        названия, затем по вхождению, не более 'limit' результатов.
+        """
+        name = request.query_params.get('name', '')
+        try:
+            limit = int(request.query_params.get('limit',
+                                                 AUTOCOMPLETE_LIMIT))
+        except ValueError:
+            limit = AUTOCOMPLETE_LIMIT
+        limit = max(1, min(limit, AUTOCOMPLETE_LIMIT))
+        return Response(ingredient_index.search(name, limit))
+
 
 class RecipeViewSet(viewsets.ModelViewSet):
     """
@@ -41,12 +70,18 @@ class RecipeViewSet(viewsets.ModelViewSet):
     serializer_class = RecipeSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly,
                           IsOwnerOrReadOnly]
-    pagination_class = PageNumberPagination
-    PageNumberPagination.page_size_query_param = 'limit'
+    pagination_class = RecipePagination
     filter_backends = (filters.DjangoFilterBackend,)
     filter_class = RecipeFilter
 
+    def get_queryset(self):
+        if self.request.method == 'GET':
+            return Recipe.objects.for_user(self.request.user)
+        return Recipe.objects.all()
+
     def get_serializer_class(self):
+        if self.action == 'list':
+            return RecipeListSerializer
         if self.request.method == 'GET':
             return RecipeGetSerializer
         return RecipeSerializer
@@ -54,89 +89,210 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
-    @action(detail=True, methods=['GET', 'DELETE'],
+    def toggle(self, request, pk, model, serializer_class, errors):
+        """
+        Добавление и удаление связи пользователя с рецептом с опорой на
+        уникальное ограничение. PUT идемпотентен: повторное добавление
+        возвращает 200, GET и POST - ошибку. Строка пользователя
+        блокируется, как и в toggle_many, чтобы одиночные и пакетные
+        изменения не пересекались.
+        """
+        if request.method == 'DELETE':
+            with transaction.atomic():
+                lock_user(request.user.pk)
+                removed = model.objects.remove(user=request.user, recipe=pk)
+            if removed:
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            get_object_or_404(Recipe, id=pk)
+            return Response({'errors': errors['missing']},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        recipe = get_object_or_404(Recipe, id=pk)
+        with transaction.atomic():
+            lock_user(request.user.pk)
+            instance, created = model.objects.add(user=request.user,
+                                                  recipe=recipe)
+        if not created and request.method != 'PUT':
+            return Response({NON_FIELD_ERRORS_KEY: [errors['exists']]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        serializer = serializer_class(instance, context={'request': request})
+        return Response(serializer.data, status=(
+            status.HTTP_201_CREATED if created else status.HTTP_200_OK))
+
+    @action(detail=True, methods=['GET', 'POST', 'PUT', 'DELETE'],
             permission_classes=[permissions.IsAuthenticated])
     def favorite(self, request, pk):
         """
         Метод создания - удаления обьекта подписки.
         """
-        recipe = get_object_or_404(Recipe, id=pk).id
-        user = self.request.user.id
-        exist = FavoriteRecipe.objects.filter(user=user,
-                                              recipe=recipe).exists()
+        return self.toggle(request, pk, FavoriteRecipe,
+                           FavoriteRecipeSerializer, {
+                               'exists': 'Рецепт уже есть в избранном!',
+                               'missing': 'Этого рецепта нет в избранном!',
+                           })
 
-        if request.method == 'GET':
-            data = {'user': user, 'recipe': recipe}
-            context = {'request': request}
-            serializer = FavoriteRecipeSerializer(data=data,
-                                                  context=context)
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        elif request.method == 'DELETE' and exist:
-            FavoriteRecipe.objects.get(user=user, recipe=recipe).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        return Response({'errors': 'Этого рецепта нет в избранном!'},
-                        status=status.HTTP_400_BAD_REQUEST)
-
-    @action(detail=True, methods=['GET', 'DELETE'],
+    @action(detail=True, methods=['GET', 'POST', 'PUT', 'DELETE'],
             permission_classes=[permissions.IsAuthenticated])
     def shopping_cart(self, request, pk):
         """
         Метод создания - удаления обьекта в списке покупок.
         """
-        recipe = get_object_or_404(Recipe, id=pk).id
-        user = self.request.user.id
-        exist = ShoppingCart.objects.filter(user=user,
-                                            recipe=recipe).exists()
+        return self.toggle(request, pk, ShoppingCart,
+                           ShoppingCartSerializer, {
+                               'exists': 'Рецепт уже есть в списке покупок!',
+                               'missing': 'Этого рецепта нет в списке '
+                                          'покупок!',
+                           })
 
-        if request.method == 'GET':
-            data = {'user': user, 'recipe': recipe}
-            context = {'request': request}
-            serializer = ShoppingCartSerializer(data=data,
-                                                context=context)
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        elif request.method == 'DELETE' and exist:
-            ShoppingCart.objects.get(user=user, recipe=recipe).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        return Response({'errors': 'Этого рецепта нет в списке покупок!'},
-                        status=status.HTTP_400_BAD_REQUEST)
+    def toggle_many(self, request, model):
+        """
+        Пакетное добавление (POST) или удаление (DELETE) рецептов 'ids'
+        одним запросом на вставку или удаление. Пакетные вставка и
+        удаление не отправляют сигналы, поэтому счетчики и список покупок
+        изменяются здесь одним запросом на все рецепты.
+        """
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        found = set(Recipe.objects.filter(pk__in=ids).values_list(
+            'pk', flat=True))
+        recipes = [pk for pk in ids if pk in found]
+        with transaction.atomic():
+            lock_user(request.user.pk)
+            if request.method == 'DELETE':
+                changed = model.objects.remove_many('recipe', recipes,
+                                                    user=request.user)
+                delta, update_list = -1, remove_recipes
+                done, skipped = 'removed', 'missing'
+            else:
+                changed = model.objects.add_many('recipe', recipes,
+                                                 user=request.user)
+                delta, update_list = 1, add_recipes
+                done, skipped = 'added', 'exists'
+            if changed:
+                Recipe.objects.filter(pk__in=changed).change_counter(
+                    model.counter_field, delta)
+                if model is ShoppingCart:
+                    update_list(request.user.id, changed)
+                schedule_similarity_update(*changed)
+        return Response({'results': serializer.results(
+            found, set(changed), done, skipped)})
+
+    @action(detail=False, methods=['POST', 'DELETE'], url_path='favorite',
+            permission_classes=[permissions.IsAuthenticated])
+    def favorite_many(self, request):
+        """
+        Пакетное добавление и удаление рецептов в избранном.
+        """
+        return self.toggle_many(request, FavoriteRecipe)
+
+    @action(detail=False, methods=['POST', 'DELETE'],
+            url_path='shopping_cart',
+            permission_classes=[permissions.IsAuthenticated])
+    def shopping_cart_many(self, request):
+        """
+        Пакетное добавление и удаление рецептов в списке покупок, например
+        всего плана питания.
+        """
+        return self.toggle_many(request, ShoppingCart)
+
+    @action(detail=True)
+    def related(self, request, pk):
+        """
+        Похожие рецепты из заранее рассчитанной таблицы, по убыванию
+        сходства.
+        """
+        recipe = get_object_or_404(Recipe, id=pk)
+        similar = list(RecipeSimilarity.objects.filter(
+            recipe=recipe).order_by('-score').values_list(
+                'similar', flat=True))
+        recipes = Recipe.objects.for_user(request.user).in_bulk(similar)
+        serializer = RecipeListSerializer(
+            [recipes[pk] for pk in similar if pk in recipes], many=True,
+            context=self.get_serializer_context())
+        return Response(serializer.data)
 
     @action(detail=False)
-    def download_shopping_cart(self, request):
+    def match(self, request):
         """
-        Скачивание списка покупок.
+        Подбор рецептов по имеющимся ингредиентам 'ingredients': по
+        убыванию доли ингредиентов рецепта, которые есть, с перечнем
+        недостающих.
         """
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__shop_cart__user=request.user).values_list(
-                'ingredient__name',
-                'amount',
-                'ingredient__measurement_unit')
+        try:
+            ingredient_ids = {
+                int(value)
+                for values in request.query_params.getlist('ingredients')
+                for value in values.split(',') if value
+            }
+        except ValueError:
+            ingredient_ids = None
+        if not ingredient_ids or len(ingredient_ids) > MATCH_MAX_INGREDIENTS:
+            return Response(
+                {'errors': 'Укажите от 1 до '
+                           f'{MATCH_MAX_INGREDIENTS} id ингредиентов!'},
+                status=status.HTTP_400_BAD_REQUEST)
 
-        ingredients_count = {}
-        for ingredient in ingredients:
-            name = ingredient[0]
-            amount = ingredient[1]
-            measurement = ingredient[2]
+        paginator = RecipeMatchPagination()
+        page = paginator.paginate_queryset(
+            RecipeIngredient.objects.coverage(ingredient_ids), request, self)
+        recipes = Recipe.objects.for_user(request.user).in_bulk(
+            [row['recipe'] for row in page])
+        matches = []
+        for row in page:
+            recipe = recipes.get(row['recipe'])
+            if recipe is None:
+                continue
+            recipe.ingredients_matched = row['matched']
+            recipe.ingredients_total = row['total']
+            matches.append(recipe)
+        context = self.get_serializer_context()
+        context['ingredient_ids'] = ingredient_ids
+        serializer = RecipeMatchSerializer(matches, many=True,
+                                           context=context)
+        return paginator.get_paginated_response(serializer.data)
 
-            if name not in ingredients_count:
-                ingredients_count[name] = {
-                    'amount': amount,
-                    'measurement': measurement}
-            else:
-                ingredients_count[name]['amount'] += amount
+    @action(detail=False, methods=['GET', 'PATCH'],
+            permission_classes=[permissions.IsAuthenticated])
+    def shopping_list(self, request):
+        """
+        Ингредиенты из списка покупок с суммарным количеством и отметкой
+        о покупке. PATCH отмечает ингредиенты 'ids' купленными или нет.
+        """
+        items = ShoppingListItem.objects.filter(
+            user=request.user, amount__gt=0
+        ).select_related('ingredient').order_by(
+            'ingredient__name', 'ingredient__measurement_unit')
+        if request.method == 'PATCH':
+            serializer = ShoppingListCheckSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            items.filter(
+                ingredient__in=serializer.validated_data['ids']
+            ).update(checked=serializer.validated_data['checked'])
+        return Response(ShoppingListItemSerializer(items, many=True).data)
 
-        result = ''
-        for name, values in ingredients_count.items():
-            result += (f'{name} - {values["amount"]} '
-                       f'{values["measurement"]}. ')
+    @action(detail=False, permission_classes=[permissions.IsAuthenticated],
+            content_negotiation_class=DownloadNegotiation)
+    def download_shopping_cart(self, request):
+        """
+        Скачивание списка покупок в формате 'format': txt (по умолчанию),
+        csv, json или pdf.
+        """
+        export_format = request.query_params.get('format', 'txt')
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {'errors': 'Формат списка покупок: '
+                           f'{", ".join(EXPORT_FORMATS)}.'},
+                status=status.HTTP_400_BAD_REQUEST)
+        ingredients = ShoppingListItem.objects.filter(
+            user=request.user, amount__gt=0
+        ).values_list(
+            'ingredient__name', 'amount', 'ingredient__measurement_unit'
+        ).order_by('ingredient__name', 'ingredient__measurement_unit')
 
-        download = 'buy_list.txt'
-        response = HttpResponse(
-            result, content_type="text/plain,charset=utf8")
+        content_type, _ = EXPORT_FORMATS[export_format]
+        response = StreamingHttpResponse(
+            export(ingredients, export_format), content_type=content_type)
         response['Content-Disposition'] = (
-            'attachment; filename={0}'.format(download)
-        )
+            f'attachment; filename=buy_list.{export_format}')
         return response
@@ -0,0 +1,115 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+User = get_user_model()
+
+TOKEN_CACHE = 'tokens'
+
+
+class TokenCache:
+    """
+    Токены с пользователями в памяти процесса: не больше TOKEN_CACHE_SIZE
+    записей, каждая хранится TOKEN_CACHE_TIMEOUT секунд, при переполнении
+    вытесняется давно не использованная. Если в CACHES настроен кэш
+    'tokens', записи хранятся в нем, и удаление токена сразу видно всем
+    процессам. Хранятся значения полей пользователя без хэша пароля,
+    каждый запрос получает новые объекты токена и пользователя с
+    отложенным полем password.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._entries = OrderedDict()
+
+    def shared(self):
+        if TOKEN_CACHE in settings.CACHES:
+            return caches[TOKEN_CACHE]
+        return None
+
+    def cache_key(self, key):
+        return f'token:{key}'
+
+    def dump(self, token):
+        fields = [field.attname for field in User._meta.concrete_fields
+                  if field.attname != 'password']
+        return (token.created, fields,
+                tuple(getattr(token.user, name) for name in fields))
+
+    def load(self, key, data):
+        created, fields, values = data
+        user = User.from_db(DEFAULT_DB_ALIAS, fields, values)
+        return Token(key=key, user=user, created=created)
+
+    def get(self, key):
+        shared = self.shared()
+        if shared is not None:
+            data = shared.get(self.cache_key(key))
+            return None if data is None else self.load(key, data)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            data, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return self.load(key, data)
+
+    def set(self, key, token):
+        data = self.dump(token)
+        shared = self.shared()
+        if shared is not None:
+            shared.set(self.cache_key(key), data,
+                       settings.TOKEN_CACHE_TIMEOUT)
+            return
+        expires = time.monotonic() + settings.TOKEN_CACHE_TIMEOUT
+        with self._lock:
+            self._entries[key] = (data, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.TOKEN_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        shared = self.shared()
+        if shared is not None:
+            shared.delete_many([self.cache_key(key) for key in keys])
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Аутентификация по токену без запроса к базе для уже известных
+    токенов. Записи удаляются при удалении токена (выход) и при изменении
+    пользователя (смена пароля, блокировка), активность пользователя
+    проверяется и для записей из кэша.
+    """
+
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+        if token is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, token)
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.'))
+        return (token.user, token)
@@ -0,0 +1,137 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from recipes.models import Recipe
+
+from .models import FeedEntry, PulledAuthor, Subscription
+
+FANOUT_BATCH = 1000
+BACKFILL_SIZE = 50
+PULL_AUTHORS_KEY = 'feed:pull_authors'
+PULL_AUTHORS_TIMEOUT = 5 * 60
+
+
+def followers_count(author_id):
+    return Subscription.objects.filter(author_id=author_id).count()
+
+
+def pull_authors():
+    """
+    Авторы, рецепты которых выбираются при чтении ленты. Список кэшируется
+    на PULL_AUTHORS_TIMEOUT секунд и сбрасывается при изменении.
+    """
+    authors = cache.get(PULL_AUTHORS_KEY)
+    if authors is None:
+        authors = set(PulledAuthor.objects.values_list('author', flat=True))
+        cache.set(PULL_AUTHORS_KEY, authors, PULL_AUTHORS_TIMEOUT)
+    return authors
+
+
+@transaction.atomic
+def update_pulled(author_id):
+    """
+    Перевод автора с числом подписчиков больше FEED_FANOUT_LIMIT в выборку
+    при чтении ленты и обратно. При возврате к раскладыванию в ленты
+    подписчиков добавляются рецепты, опубликованные за время выборки.
+    Возвращает True, если рецепты автора выбираются при чтении.
+    """
+    pulled = followers_count(author_id) > settings.FEED_FANOUT_LIMIT
+    if pulled:
+        _, changed = PulledAuthor.objects.get_or_create(author_id=author_id)
+    else:
+        changed, _ = PulledAuthor.objects.filter(author_id=author_id).delete()
+        if changed:
+            followers = Subscription.objects.filter(
+                author_id=author_id).values_list('follower_id', flat=True)
+            for follower_id in followers.iterator():
+                backfill(follower_id, author_id)
+    if changed:
+        transaction.on_commit(lambda: cache.delete(PULL_AUTHORS_KEY))
+    return pulled
+
+
+def fan_out(recipe):
+    """
+    Добавление рецепта в ленты подписчиков автора пачками по
+    FANOUT_BATCH. Для авторов с большим числом подписчиков пропускается.
+    """
+    if update_pulled(recipe.author_id):
+        return
+    followers = Subscription.objects.filter(
+        author_id=recipe.author_id).values_list('follower_id', flat=True)
+    entries = (FeedEntry(follower_id=follower_id, author_id=recipe.author_id,
+                         recipe_id=recipe.id, pub_date=recipe.pub_date)
+               for follower_id in followers.iterator())
+    FeedEntry.objects.bulk_create(entries, batch_size=FANOUT_BATCH,
+                                  ignore_conflicts=True)
+
+
+def backfill(follower_id, author_id, size=BACKFILL_SIZE):
+    """
+    Добавление последних рецептов автора в ленту нового подписчика.
+    """
+    if PulledAuthor.objects.filter(author_id=author_id).exists():
+        return
+    recipes = Recipe.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-id').values_list('id', 'pub_date')[:size]
+    FeedEntry.objects.bulk_create(
+        [FeedEntry(follower_id=follower_id, author_id=author_id,
+                   recipe_id=recipe_id, pub_date=pub_date)
+         for recipe_id, pub_date in recipes],
+        ignore_conflicts=True)
+
+
+def encode_cursor(pub_date, recipe_id):
+    position = f'{pub_date.isoformat()}|{recipe_id}'
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Позиция (дата публикации, id рецепта) из курсора, ValueError для
+    некорректного курсора.
+    """
+    try:
+        position = base64.urlsafe_b64decode(cursor.encode()).decode()
+        pub_date, recipe_id = position.split('|')
+        return datetime.fromisoformat(pub_date), int(recipe_id)
+    except (binascii.Error, UnicodeDecodeError) as error:
+        raise ValueError(error)
+
+
+def before(position, date_field, id_field):
+    if position is None:
+        return Q()
+    pub_date, recipe_id = position
+    return Q(**{f'{date_field}__lt': pub_date}) | Q(
+        **{date_field: pub_date, f'{id_field}__lt': recipe_id})
+
+
+def read_feed(follower, position=None, size=6):
+    """
+    Страница ленты подписчика после позиции position: пары (дата
+    публикации, id рецепта) по убыванию и признак следующей страницы.
+    Записи ленты и рецепты авторов, которые не раскладываются по лентам,
+    выбираются по индексу не более size + 1 строк каждая.
+    """
+    rows = set(FeedEntry.objects.filter(
+        before(position, 'pub_date', 'recipe_id'), follower=follower
+    ).order_by('-pub_date', '-recipe_id').values_list(
+        'pub_date', 'recipe_id')[:size + 1])
+
+    authors = pull_authors()
+    if authors:
+        followed = Subscription.objects.filter(
+            follower=follower, author__in=authors).values('author')
+        rows.update(Recipe.objects.filter(
+            before(position, 'pub_date', 'id'), author__in=followed
+        ).order_by('-pub_date', '-id').values_list(
+            'pub_date', 'id')[:size + 1])
+
+    rows = sorted(rows, reverse=True)
+    return rows[:size], len(rows) > size
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from users.feed import backfill
+from users.models import FeedEntry, Subscription
+
+
+class Command(BaseCommand):
+    help = ('Заполняет ленты подписчиков последними рецептами авторов, на '
+            'которых они подписаны.')
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        FeedEntry.objects.all().delete()
+        subscriptions = Subscription.objects.values_list(
+            'follower_id', 'author_id')
+        processed = 0
+        for follower_id, author_id in subscriptions.iterator():
+            backfill(follower_id, author_id)
+            processed += 1
+        self.stdout.write(f'Обработано подписок: {processed}.')
@@ -0,0 +1,40 @@
+# Generated by Django 3.0.5 on 2026-10-18 19:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_pulled_authors(apps, schema_editor):
+    Subscription = apps.get_model('users', 'Subscription')
+    PulledAuthor = apps.get_model('users', 'PulledAuthor')
+    authors = Subscription.objects.values('author').annotate(
+        followers=Count('id')
+    ).filter(
+        followers__gt=settings.FEED_FANOUT_LIMIT
+    ).values_list('author', flat=True)
+    PulledAuthor.objects.bulk_create(
+        PulledAuthor(author_id=author_id) for author_id in authors)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('users', '0002_feedentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PulledAuthor',
+            fields=[
+                ('author', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+            ],
+            options={
+                'verbose_name': 'Автор с выборкой при чтении ленты',
+                'verbose_name_plural': 'Авторы с выборкой при чтении ленты',
+            },
+        ),
+        migrations.RunPython(fill_pulled_authors, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,74 @@
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import IntegrityError, models, transaction
 
 User = get_user_model()
 
 
+def lock_user(user_id):
+    """
+    Блокировка строки пользователя до конца транзакции. Пакетные
+    изменения связей одного пользователя выполняются по очереди, поэтому
+    прочитанные существующие связи не устаревают до записи.
+    """
+    list(User.objects.select_for_update().filter(pk=user_id).values_list(
+        'pk', flat=True))
+
+
+class RelationQuerySet(models.QuerySet):
+    """
+    Кверисет связей пользователя с уникальным ограничением: добавление и
+    удаление без предварительной проверки существования.
+    """
+
+    def add(self, **fields):
+        """
+        Вставка связи в точке сохранения. При нарушении уникальности
+        возвращает несохраненный объект и False.
+        """
+        instance = self.model(**fields)
+        try:
+            with transaction.atomic():
+                instance.save(force_insert=True)
+        except IntegrityError:
+            return instance, False
+        return instance, True
+
+    def remove(self, **fields):
+        """
+        Удаление связи одним запросом, возвращает True, если она была.
+        """
+        deleted, _ = self.filter(**fields).delete()
+        return deleted > 0
+
+    def add_many(self, field, values, **fields):
+        """
+        Вставка связей со всеми values по полю field одним запросом
+        bulk_create, уже существующие связи пропускаются. Сигналы post_save
+        не отправляются. Возвращает добавленные значения. Вызывается в
+        транзакции после lock_user для владельца связей.
+        """
+        existing = set(self.filter(
+            **{f'{field}__in': values}, **fields
+        ).values_list(field, flat=True))
+        added = [value for value in values if value not in existing]
+        self.bulk_create([self.model(**{f'{field}_id': value}, **fields)
+                          for value in added], ignore_conflicts=True)
+        return added
+
+    def remove_many(self, field, values, **fields):
+        """
+        Удаление связей со всеми values по полю field одним запросом без
+        сбора объектов: сигналы pre_delete и post_delete не отправляются.
+        Возвращает удаленные значения. Вызывается в транзакции после
+        lock_user для владельца связей.
+        """
+        relations = self.filter(**{f'{field}__in': values}, **fields)
+        removed = set(relations.values_list(field, flat=True))
+        if removed:
+            relations._raw_delete(relations.db)
+        return [value for value in values if value in removed]
+
+
 class Subscription(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE,
                                related_name='following',
@@ -12,9 +77,52 @@ class Subscription(models.Model):
                                  related_name='follower',
                                  verbose_name='Подписчик')
 
+    objects = RelationQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Подписка"
         verbose_name_plural = "Подписки"
 
         constraints = [models.UniqueConstraint(fields=['author', 'follower'],
                                                name='unique_follow')]
+
+
+class FeedEntry(models.Model):
+    """
+    Рецепт в ленте подписчика. Записи создаются при публикации рецепта
+    для всех подписчиков автора, дата публикации копируется для выборки
+    страниц ленты по индексу.
+    """
+    follower = models.ForeignKey(User, on_delete=models.CASCADE,
+                                 related_name='feed',
+                                 verbose_name='Подписчик')
+    author = models.ForeignKey(User, on_delete=models.CASCADE,
+                               related_name='+', verbose_name='Автор')
+    recipe = models.ForeignKey('recipes.Recipe', on_delete=models.CASCADE,
+                               related_name='+', verbose_name='Рецепт')
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Лента подписок'
+        constraints = [models.UniqueConstraint(fields=['follower', 'recipe'],
+                                               name='unique_feed_entry')]
+        indexes = [
+            models.Index(fields=['follower', '-pub_date', '-recipe'],
+                         name='feed_follower_pub_date_idx'),
+        ]
+
+
+class PulledAuthor(models.Model):
+    """
+    Автор, рецепты которого не раскладываются по лентам подписчиков, а
+    выбираются при чтении ленты. Признак меняется задачей раскладывания
+    рецепта по числу подписчиков автора.
+    """
+    author = models.OneToOneField(User, on_delete=models.CASCADE,
+                                  primary_key=True, related_name='+',
+                                  verbose_name='Автор')
+
+    class Meta:
+        verbose_name = 'Автор с выборкой при чтении ленты'
+        verbose_name_plural = 'Авторы с выборкой при чтении ленты'
@@ -1,5 +1,6 @@
 from django.contrib.auth import get_user_model
 from djoser.serializers import UserCreateSerializer, UserSerializer
+from recipes.fields import RecipeImageField, RecipeImageInfoField
 from recipes.models import Recipe
 from rest_framework import serializers
 
@@ -7,6 +8,8 @@ from .models import Subscription
 
 User = get_user_model()
 
+BATCH_MAX_ITEMS = 100
+
 
 class ReUserSerializer(UserSerializer):
     """Сериализатор модели Юзер GET запрос."""
@@ -25,6 +28,8 @@ class ReUserSerializer(UserSerializer):
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         queryset = Subscription.objects.filter(
             author=obj.id,
             follower=request.user.id).exists()
@@ -47,9 +52,12 @@ class RecipeInSubscriptionSerializer(serializers.ModelSerializer):
     """
     Внутреннее Поле Рецепты на странице с подписками пользователя.
     """
+    image = RecipeImageField(variant='small', source='*')
+    image_info = RecipeImageInfoField(variant='small', source='*')
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_info', 'cooking_time')
 
 
 class SubscriptionSerializer(serializers.ModelSerializer):
@@ -81,23 +89,35 @@ class SubscriptionSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         queryset = Subscription.objects.filter(
-            author=obj.id,
+            author=obj.author_id,
             follower=request.user.id).exists()
         return queryset
 
     def get_recipes(self, obj):
         """
-        Внутреннее поле Рецепты на странице подписок пользователя.
+        Внутреннее поле Рецепты на странице подписок пользователя, не более
+        'recipes_limit' последних рецептов автора.
         """
-        queryset = Recipe.objects.filter(author=obj.author.id)
-        serializer = RecipeInSubscriptionSerializer(queryset, many=True)
+        if hasattr(obj.author, 'limited_recipes'):
+            queryset = obj.author.limited_recipes
+        else:
+            queryset = Recipe.objects.filter(author=obj.author.id)
+            limit = self.context.get('recipes_limit')
+            if limit:
+                queryset = queryset[:limit]
+        serializer = RecipeInSubscriptionSerializer(queryset, many=True,
+                                                    context=self.context)
         return serializer.data
 
     def get_recipes_count(self, obj):
         """
         Количество рецептов у автора на которого подписан пользователь.
         """
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         queryset = Recipe.objects.filter(author=obj.author.id).count()
         return queryset
 
@@ -111,3 +131,32 @@ class SubscriptionSerializer(serializers.ModelSerializer):
                                        follower=data['follower']).exists():
             raise serializers.ValidationError('Вы уже подписаны!')
         return data
+
+
+class BatchSerializer(serializers.Serializer):
+    """
+    Список id для пакетного добавления или удаления связей, повторы
+    отбрасываются.
+    """
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1, max_length=BATCH_MAX_ITEMS)
+
+    def validate_ids(self, data):
+        return list(dict.fromkeys(data))
+
+    def results(self, found, changed, done, skipped):
+        """
+        Результат по каждому id: done для измененных связей, skipped для
+        связей без изменений, not_found для несуществующих объектов.
+        """
+        results = []
+        for pk in self.validated_data['ids']:
+            if pk in changed:
+                result = done
+            elif pk in found:
+                result = skipped
+            else:
+                result = 'not_found'
+            results.append({'id': pk, 'status': result})
+        return results
@@ -0,0 +1,61 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from jobs.queue import enqueue
+from recipes.models import Recipe
+from rest_framework.authtoken.models import Token
+
+from .authentication import token_cache
+from .models import FeedEntry, Subscription
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Recipe)
+def publish_recipe(sender, instance, created, raw, **kwargs):
+    """
+    Раскладывание нового рецепта по лентам подписчиков в фоновой задаче.
+    """
+    if created and not raw:
+        enqueue('fan_out_recipe', recipe_id=instance.id)
+
+
+@receiver(post_save, sender=Subscription)
+def subscribe(sender, instance, created, raw, **kwargs):
+    """
+    Добавление последних рецептов автора в ленту нового подписчика.
+    """
+    if created and not raw:
+        enqueue('backfill_feed', follower_id=instance.follower_id,
+                author_id=instance.author_id)
+
+
+@receiver(post_delete, sender=Subscription)
+def unsubscribe(sender, instance, **kwargs):
+    """
+    Удаление рецептов автора из ленты отписавшегося пользователя.
+    """
+    FeedEntry.objects.filter(follower_id=instance.follower_id,
+                             author_id=instance.author_id).delete()
+
+
+@receiver(post_delete, sender=Token)
+def forget_token(sender, instance, **kwargs):
+    """
+    Удаление токена из кэша аутентификации при выходе.
+    """
+    token_cache.delete(instance.key)
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(sender, instance, update_fields, **kwargs):
+    """
+    Удаление токенов пользователя из кэша аутентификации при изменении
+    пользователя: смене пароля, блокировке, изменении профиля.
+    """
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    keys = list(Token.objects.filter(user=instance).values_list(
+        'key', flat=True))
+    if keys:
+        token_cache.delete(*keys)
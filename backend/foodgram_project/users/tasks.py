@@ -0,0 +1,26 @@
+from jobs.queue import task
+from recipes.models import Recipe
+
+from .feed import backfill, fan_out
+from .models import Subscription
+
+
+@task('fan_out_recipe')
+def fan_out_recipe(recipe_id):
+    """
+    Добавление опубликованного рецепта в ленты подписчиков автора.
+    """
+    recipe = Recipe.objects.filter(pk=recipe_id).only(
+        'id', 'author', 'pub_date').first()
+    if recipe is not None:
+        fan_out(recipe)
+
+
+@task('backfill_feed')
+def backfill_feed(follower_id, author_id):
+    """
+    Добавление последних рецептов автора в ленту нового подписчика.
+    """
+    if Subscription.objects.filter(follower_id=follower_id,
+                                   author_id=author_id).exists():
+        backfill(follower_id, author_id)
@@ -1,8 +1,16 @@
 from django.contrib.auth.models import User
-from django.test import Client, TestCase
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+from foodgram_project.testing import on_commit_callbacks
+from jobs.models import Job
+from jobs.queue import run_pending
+from recipes.models import Recipe
 from rest_framework import status
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
-from users.models import Subscription
+from users.authentication import token_cache
+from users.feed import pull_authors
+from users.models import FeedEntry, PulledAuthor, Subscription
 
 
 class UrlsViewsTests(TestCase):
@@ -142,3 +150,304 @@ class UrlsViewsTests(TestCase):
         response = self.authorized_client.get(self.url_users1_subscribe)
         self.assertEqual(Subscription.objects.count(), 0)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_put_subscription_idempotent(self):
+        """
+        Повторная подписка методом PUT возвращает автора со статусом 200.
+        """
+        self.guest_client.post(self.url_users, data=self.user2_create_data)
+        response = self.authorized_client.put(self.url_users2_subscribe)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.authorized_client.put(self.url_users2_subscribe)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['username'], 'test_username')
+        self.assertTrue(response.data['is_subscribed'])
+        self.assertEqual(Subscription.objects.count(), 1)
+
+
+class SubscriptionsQueriesTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.user = User.objects.create(username='sergey')
+        for number in range(3):
+            author = User.objects.create(username=f'author{number}')
+            Subscription.objects.create(author=author, follower=cls.user)
+            for recipe_number in range(5):
+                Recipe.objects.create(name=f'рецепт {number} {recipe_number}',
+                                      text='текст',
+                                      cooking_time=1,
+                                      author=author)
+
+    def setUp(self):
+        self.authorized_client = APIClient()
+        self.authorized_client.force_authenticate(self.user)
+
+    def test_subscriptions_recipes_limit(self):
+        """
+        Ограничение количества рецептов автора на странице подписок при
+        постоянном количестве запросов к базе.
+        """
+        with self.assertNumQueries(3):
+            response = self.authorized_client.get(
+                '/api/users/subscriptions/?limit=6&recipes_limit=2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual(len(results), 3)
+        for author in results:
+            self.assertEqual(len(author['recipes']), 2)
+            self.assertEqual(author['recipes_count'], 5)
+            self.assertTrue(author['is_subscribed'])
+        latest = Recipe.objects.filter(author=results[0]['id'])[:2]
+        self.assertEqual([recipe['id'] for recipe in results[0]['recipes']],
+                         [recipe.id for recipe in latest])
+
+    def test_subscribe_queries(self):
+        """
+        Ответ на подписку строится по автору с количеством рецептов, без
+        повторных запросов, рецепты не запрашиваются у автора без них.
+        Подписка и отписка блокируют строку пользователя.
+        """
+        author = User.objects.create(username='author')
+        Recipe.objects.create(name='рецепт', text='текст', cooking_time=1,
+                              author=author)
+        url = f'/api/users/{author.id}/subscribe/'
+        with self.assertNumQueries(9):
+            response = self.authorized_client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['recipes_count'], 1)
+        self.assertEqual(len(response.data['recipes']), 1)
+        with self.assertNumQueries(6):
+            response = self.authorized_client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        reader = User.objects.create(username='reader')
+        with self.assertNumQueries(8):
+            response = self.authorized_client.post(
+                f'/api/users/{reader.id}/subscribe/')
+        self.assertEqual(response.data['recipes_count'], 0)
+        self.assertEqual(response.data['recipes'], [])
+
+    def test_subscriptions_without_recipes_limit(self):
+        """
+        Без 'recipes_limit' выводятся все рецепты автора.
+        """
+        response = self.authorized_client.get('/api/users/subscriptions/')
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(len(response.data[0]['recipes']), 5)
+
+
+class FeedTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.user = User.objects.create(username="sergey",)
+        cls.authors = [User.objects.create(username=f'author{number}')
+                       for number in range(3)]
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = APIClient()
+        self.authorized_client.force_authenticate(self.user)
+
+    def publish(self, author, count=1):
+        recipes = [Recipe.objects.create(
+            name=f'{author.username} {number}', text='текст',
+            cooking_time=1, author=author) for number in range(count)]
+        run_pending()
+        return recipes
+
+    def read(self, url='/api/users/feed/', **params):
+        pull_authors()
+        with self.assertNumQueries(5):
+            response = self.authorized_client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_feed_fan_out_and_pages(self):
+        """
+        Рецепты авторов из подписок попадают в ленту от новых к старым,
+        страницы выбираются по курсору.
+        """
+        for author in self.authors[:2]:
+            Subscription.objects.create(author=author, follower=self.user)
+        recipes = []
+        for author in self.authors:
+            recipes += self.publish(author, 2)
+        expected = [recipe.id for recipe in reversed(recipes[:4])]
+
+        data = self.read(limit=3)
+        self.assertEqual([recipe['id'] for recipe in data['results']],
+                         expected[:3])
+        data = self.read(data['next'])
+        self.assertEqual([recipe['id'] for recipe in data['results']],
+                         expected[3:])
+        self.assertIsNone(data['next'])
+
+    def test_feed_subscribe_and_unsubscribe(self):
+        """
+        При подписке в ленту добавляются прежние рецепты автора, при
+        отписке они удаляются.
+        """
+        recipes = self.publish(self.authors[0], 2)
+        self.authorized_client.get(
+            f'/api/users/{self.authors[0].id}/subscribe/')
+        run_pending()
+        data = self.read()
+        self.assertEqual([recipe['id'] for recipe in data['results']],
+                         [recipe.id for recipe in reversed(recipes)])
+        self.authorized_client.delete(
+            f'/api/users/{self.authors[0].id}/subscribe/')
+        self.assertFalse(FeedEntry.objects.exists())
+
+    def test_batch_subscribe(self):
+        """
+        Пакетная подписка с результатом по каждому автору и добавлением
+        рецептов авторов в ленту.
+        """
+        recipes = self.publish(self.authors[0])
+        response = self.authorized_client.post(
+            '/api/users/subscribe/',
+            {'ids': [self.authors[0].id, self.user.id, 100]}, format='json')
+        self.assertEqual(response.data['results'], [
+            {'id': self.authors[0].id, 'status': 'added'},
+            {'id': self.user.id, 'status': 'self'},
+            {'id': 100, 'status': 'not_found'},
+        ])
+        response = self.authorized_client.post(
+            '/api/users/subscribe/', {'ids': [self.authors[0].id]},
+            format='json')
+        self.assertEqual(response.data['results'], [
+            {'id': self.authors[0].id, 'status': 'exists'},
+        ])
+        self.assertEqual(Job.objects.filter(name='backfill_feed').count(), 1)
+        run_pending()
+        self.assertEqual([recipe['id'] for recipe in self.read()['results']],
+                         [recipe.id for recipe in recipes])
+        response = self.authorized_client.delete(
+            '/api/users/subscribe/', {'ids': [self.authors[0].id]},
+            format='json')
+        self.assertEqual(response.data['results'], [
+            {'id': self.authors[0].id, 'status': 'removed'},
+        ])
+        self.assertFalse(Subscription.objects.exists())
+        self.assertFalse(FeedEntry.objects.exists())
+
+    @override_settings(FEED_FANOUT_LIMIT=0)
+    def test_feed_pull_for_popular_authors(self):
+        """
+        Рецепты авторов с большим числом подписчиков выбираются при
+        чтении ленты. Когда подписчиков становится меньше, рецепты снова
+        раскладываются, а в ленты добавляются пропущенные.
+        """
+        Subscription.objects.create(author=self.authors[0],
+                                    follower=self.user)
+        run_pending()
+        with on_commit_callbacks():
+            recipes = self.publish(self.authors[0], 2)
+        self.assertTrue(PulledAuthor.objects.filter(
+            author=self.authors[0]).exists())
+        self.assertFalse(FeedEntry.objects.exists())
+        pull_authors()
+        with self.assertNumQueries(6):
+            response = self.authorized_client.get('/api/users/feed/')
+        self.assertEqual([recipe['id'] for recipe in response.data['results']],
+                         [recipe.id for recipe in reversed(recipes)])
+
+        with self.settings(FEED_FANOUT_LIMIT=1), on_commit_callbacks():
+            recipes += self.publish(self.authors[0])
+        self.assertFalse(PulledAuthor.objects.exists())
+        self.assertEqual(pull_authors(), set())
+        self.assertEqual(
+            set(FeedEntry.objects.values_list('recipe', flat=True)),
+            {recipe.id for recipe in recipes})
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.user = User.objects.create(username="sergey",
+                                       email='sergey@email.ru')
+        cls.user.set_password('test_password')
+        cls.user.save()
+
+    def setUp(self):
+        token_cache.clear()
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_token_lookup_cached(self):
+        """
+        Повторный запрос с тем же токеном не обращается к базе за токеном,
+        остается только запрос подписки в ответе.
+        """
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/users/me/')
+        self.assertEqual(response.data['username'], 'sergey')
+
+    def test_logout_invalidates_token(self):
+        """
+        После выхода токен из кэша больше не принимается.
+        """
+        self.client.get('/api/users/me/')
+        response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivation_invalidates_token(self):
+        """
+        Заблокированный пользователь не проходит аутентификацию по токену
+        из кэша.
+        """
+        self.client.get('/api/users/me/')
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.user.is_active = True
+        self.user.save()
+
+    def test_cached_user_without_password(self):
+        """
+        В кэше нет хэша пароля, пароль загружается из базы по запросу.
+        """
+        self.client.get('/api/users/me/')
+        self.assertNotIn(self.user.password,
+                         token_cache._entries[self.token.key][0][2])
+        token = token_cache.get(self.token.key)
+        self.assertEqual(token.user.get_deferred_fields(), {'password'})
+        with self.assertNumQueries(1):
+            self.assertTrue(token.user.check_password('test_password'))
+
+    def test_cached_inactive_user_rejected(self):
+        """
+        Активность пользователя проверяется и для записи из кэша.
+        """
+        token = Token.objects.select_related('user').get(key=self.token.key)
+        token.user.is_active = False
+        token_cache.set(token.key, token)
+        response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(TOKEN_CACHE_SIZE=1)
+    def test_token_cache_bounded(self):
+        """
+        При переполнении вытесняется давно не использованный токен.
+        """
+        other = User.objects.create(username='other')
+        other_client = APIClient()
+        other_client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=other)}')
+        self.client.get('/api/users/me/')
+        other_client.get('/api/users/me/')
+        with self.assertNumQueries(2):
+            self.client.get('/api/users/me/')
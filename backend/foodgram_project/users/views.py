@@ -1,16 +1,31 @@
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import (BooleanField, Count, OuterRef, Prefetch,
+                              Subquery, Value)
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet
+from jobs.queue import enqueue
+from recipes.models import Recipe
+from recipes.serializers import RecipeListSerializer
 from rest_framework import permissions, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 
-from .models import Subscription
-from .serializers import ReUserSerializer, SubscriptionSerializer
+from .feed import decode_cursor, encode_cursor, read_feed
+from .models import FeedEntry, Subscription, lock_user
+from .serializers import (BatchSerializer, ReUserSerializer,
+                          SubscriptionSerializer)
 
 User = get_user_model()
 
+FEED_PAGE_SIZE = 6
+FEED_MAX_PAGE_SIZE = 100
+NON_FIELD_ERRORS_KEY = api_settings.NON_FIELD_ERRORS_KEY
+
 
 class ReUserViewSet(UserViewSet):
     """
@@ -21,14 +36,49 @@ class ReUserViewSet(UserViewSet):
     pagination_class = PageNumberPagination
     PageNumberPagination.page_size_query_param = 'limit'
 
+    def get_recipes_limit(self):
+        """
+        Ограничение количества рецептов автора из параметра 'recipes_limit'.
+        """
+        try:
+            limit = int(self.request.query_params.get('recipes_limit'))
+        except (TypeError, ValueError):
+            return None
+        return limit if limit > 0 else None
+
+    def get_subscriptions_queryset(self, follower, limit=None):
+        """
+        Подписки с авторами, количеством их рецептов и последними рецептами
+        одним запросом на каждую связь.
+        """
+        recipes = Recipe.objects.only(
+            'id', 'name', 'image', 'image_small', 'image_status',
+            'image_width', 'image_height', 'image_color', 'cooking_time',
+            'author')
+        if limit:
+            recipes = recipes.filter(pk__in=Subquery(
+                Recipe.objects.filter(
+                    author_id=OuterRef('author_id')).values('pk')[:limit]
+            ))
+        return Subscription.objects.filter(
+            follower=follower
+        ).select_related('author').annotate(
+            recipes_count=Count('author__recipe'),
+            is_subscribed=Value(True, output_field=BooleanField()),
+        ).prefetch_related(
+            Prefetch('author__recipe_set', queryset=recipes,
+                     to_attr='limited_recipes')
+        ).order_by('id')
+
     @action(detail=False, permission_classes=[permissions.IsAuthenticated])
     def subscriptions(self, request):
         """
         Отображение страницы с подписками авторизованного пользователя.
         """
         user = self.request.user
-        context = {'request': request}
-        queryset = Subscription.objects.filter(follower=user)
+        limit = self.get_recipes_limit()
+        context = {'request': request, 'recipes_limit': limit}
+        queryset = self.get_subscriptions_queryset(user, limit)
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = SubscriptionSerializer(page, context=context,
@@ -38,28 +88,110 @@ class ReUserViewSet(UserViewSet):
                                             many=True)
         return Response(serializer.data)
 
-    @action(detail=True, methods=['GET', 'DELETE'],
+    @action(detail=False, permission_classes=[permissions.IsAuthenticated])
+    def feed(self, request):
+        """
+        Лента рецептов авторов, на которых подписан пользователь, от
+        новых к старым. Страницы выбираются по курсору 'cursor', размер
+        страницы - параметр 'limit'.
+        """
+        try:
+            limit = int(request.query_params.get('limit', FEED_PAGE_SIZE))
+        except ValueError:
+            limit = FEED_PAGE_SIZE
+        limit = max(1, min(limit, FEED_MAX_PAGE_SIZE))
+        cursor = request.query_params.get('cursor')
+        try:
+            position = decode_cursor(cursor) if cursor else None
+        except ValueError:
+            raise NotFound('Некорректный курсор.')
+
+        rows, has_next = read_feed(request.user, position, limit)
+        recipes = Recipe.objects.for_user(request.user).in_bulk(
+            [recipe_id for _, recipe_id in rows])
+        page = [recipes[recipe_id] for _, recipe_id in rows
+                if recipe_id in recipes]
+        next_url = None
+        if has_next:
+            next_url = replace_query_param(
+                request.build_absolute_uri(), 'cursor',
+                encode_cursor(*rows[-1]))
+        serializer = RecipeListSerializer(
+            page, many=True, context=self.get_serializer_context())
+        return Response({'next': next_url, 'results': serializer.data})
+
+    @action(detail=True, methods=['GET', 'POST', 'PUT', 'DELETE'],
             permission_classes=[permissions.IsAuthenticated])
     def subscribe(self, request, id):
         """
-        Подписка и отписка от выбранного автора.
+        Подписка и отписка от выбранного автора. PUT идемпотентен:
+        повторная подписка возвращает 200, GET и POST - ошибку. Строка
+        пользователя блокируется, как и в subscribe_many.
         """
-        author = get_object_or_404(User, id=id).id
-        follower = request.user.id
-        exist = Subscription.objects.filter(author=author,
-                                            follower=request.user).exists()
+        if request.method == 'DELETE':
+            with transaction.atomic():
+                lock_user(request.user.pk)
+                removed = Subscription.objects.remove(author=id,
+                                                      follower=request.user)
+            if removed:
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            get_object_or_404(User, id=id)
+            return Response({'errors': 'Вы не подписаны на автора'},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-        if request.method == 'GET':
-            data = {'author': author, 'follower': follower}
-            context = {'request': request}
-            serializer = SubscriptionSerializer(data=data, context=context)
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        author = get_object_or_404(
+            User.objects.annotate(recipes_count=Count('recipe')), id=id)
+        if author == request.user:
+            return Response(
+                {NON_FIELD_ERRORS_KEY: ['Нельзя подписаться на себя!']},
+                status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            lock_user(request.user.pk)
+            subscription, created = Subscription.objects.add(
+                author=author, follower=request.user)
+        if not created and request.method != 'PUT':
+            return Response({NON_FIELD_ERRORS_KEY: ['Вы уже подписаны!']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        subscription.is_subscribed = True
+        subscription.recipes_count = author.recipes_count
+        if not author.recipes_count:
+            author.limited_recipes = []
+        context = {'request': request,
+                   'recipes_limit': self.get_recipes_limit()}
+        serializer = SubscriptionSerializer(subscription, context=context)
+        return Response(serializer.data, status=(
+            status.HTTP_201_CREATED if created else status.HTTP_200_OK))
 
-        elif request.method == 'DELETE' and exist:
-            Subscription.objects.get(author=author,
-                                     follower=request.user).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        return Response({'errors': 'Вы не подписаны на автора'},
-                        status=status.HTTP_400_BAD_REQUEST)
+    @action(detail=False, methods=['POST', 'DELETE'], url_path='subscribe',
+            permission_classes=[permissions.IsAuthenticated])
+    def subscribe_many(self, request):
+        """
+        Пакетная подписка (POST) и отписка (DELETE) от авторов 'ids'
+        одним запросом на вставку или удаление.
+        """
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        found = set(User.objects.filter(pk__in=ids).exclude(
+            pk=request.user.pk).values_list('pk', flat=True))
+        authors = [pk for pk in ids if pk in found]
+        with transaction.atomic():
+            lock_user(request.user.pk)
+            if request.method == 'DELETE':
+                changed = Subscription.objects.remove_many(
+                    'author', authors, follower=request.user)
+                FeedEntry.objects.filter(follower=request.user,
+                                         author__in=changed).delete()
+                done, skipped = 'removed', 'missing'
+            else:
+                changed = Subscription.objects.add_many(
+                    'author', authors, follower=request.user)
+                for pk in changed:
+                    enqueue('backfill_feed', follower_id=request.user.pk,
+                            author_id=pk)
+                done, skipped = 'added', 'exists'
+        results = serializer.results(found, set(changed), done, skipped)
+        for result in results:
+            if result['id'] == request.user.pk:
+                result['status'] = 'self'
+        return Response({'results': results})